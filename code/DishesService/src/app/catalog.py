@@ -0,0 +1,133 @@
+from prometheus_client import Gauge
+from sqlalchemy.ext.asyncio import AsyncSession
+from types import MappingProxyType
+from typing import Iterable, Mapping, NamedTuple, Optional
+import asyncio
+import os
+import time
+
+from app.database_postgres import SessionLocal
+from app.repositories import DishRepository
+
+# Как часто каждый процесс перечитывает справочник из БД: изменения таблицы
+# dishes (и обновление через /dish/catalog/refresh в другом воркере) доходят
+# до всех воркеров не позже чем через это время; 0 – только при старте
+CATALOG_REFRESH_SECONDS = float(os.environ.get("CATALOG_REFRESH_SECONDS", "60"))
+
+CATALOG_SIZE = Gauge("dishes_catalog_size", "Количество блюд в справочнике процесса")
+CATALOG_LOADED_AT = Gauge("dishes_catalog_loaded_at_seconds", "Время последней загрузки справочника блюд")
+
+
+class CatalogDish(NamedTuple):
+    """Блюдо справочника (неизменяемая копия строки таблицы dishes)"""
+    id: int
+    name: str
+    calories: int
+    protein: float
+    fat: float
+    carbs: float
+
+
+class DishCatalog:
+    """
+    Неизменяемый снимок справочника блюд с индексами по названию и по ID.
+    Обновление справочника создаёт новый снимок и подменяет ссылку на него,
+    поэтому читатели не блокируются и всегда видят согласованные данные.
+    """
+
+    __slots__ = ("by_name", "by_id", "loaded_at")
+
+    def __init__(self, dishes: Iterable[CatalogDish] = ()) -> None:
+        dishes = tuple(dishes)
+        self.by_name: Mapping[str, CatalogDish] = MappingProxyType({dish.name: dish for dish in dishes})
+        self.by_id: Mapping[int, CatalogDish] = MappingProxyType({dish.id: dish for dish in dishes})
+        self.loaded_at: float = time.time()
+
+    def get_by_name(self, dish_name: str) -> Optional[CatalogDish]:
+        return self.by_name.get(dish_name)
+
+    def get_by_id(self, dish_id: int) -> Optional[CatalogDish]:
+        return self.by_id.get(dish_id)
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+
+_catalog: DishCatalog = DishCatalog()
+_refresh_lock = asyncio.Lock()
+
+
+async def load_catalog(db: Optional[AsyncSession] = None) -> DishCatalog:
+    """
+    Загружает справочник блюд из PostgreSQL одним запросом и делает его
+    текущим, если он изменился. Вызывается при старте, периодически из
+    CatalogRefresher и из /dish/catalog/refresh
+
+    :param db: Сессия БД; если не передана, открывается новая
+    :return: Текущий снимок справочника
+    """
+    global _catalog
+
+    async with _refresh_lock:
+        if db is None:
+            async with SessionLocal() as session:
+                rows = await DishRepository(session).get_all_dishes(limit=None)
+        else:
+            rows = await DishRepository(db).get_all_dishes(limit=None)
+
+        catalog = DishCatalog(
+            CatalogDish(dish.id, dish.name, dish.calories, dish.protein, dish.fat, dish.carbs)
+            for dish in rows
+        )
+        if catalog.by_id == _catalog.by_id:
+            return _catalog
+        _catalog = catalog
+
+    CATALOG_SIZE.set(len(catalog))
+    CATALOG_LOADED_AT.set(catalog.loaded_at)
+    print(f"Справочник блюд загружен: {len(catalog)} блюд")
+    return catalog
+
+
+class CatalogRefresher:
+    """
+    Фоновое перечитывание справочника в каждом процессе раз в interval
+    секунд. Снимок живёт в памяти процесса, поэтому иначе обновление через
+    /dish/catalog/refresh применялось бы только в обработавшем его воркере
+    """
+
+    def __init__(self, interval: float = CATALOG_REFRESH_SECONDS) -> None:
+        """
+        :param interval: Период перечитывания в секундах, 0 – выключено
+        """
+        self.interval: float = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await load_catalog()
+            except Exception as e:
+                # БД временно недоступна: продолжаем работать со старым снимком
+                print(f"[WARNING] Не удалось перечитать справочник блюд: {e!r}")
+
+
+catalog_refresher = CatalogRefresher()
+
+
+def get_catalog() -> DishCatalog:
+    """
+    Текущий снимок справочника блюд (без обращения к БД)
+    """
+    return _catalog
@@ -1,5 +1,10 @@
-from pymongo import MongoClient
+from gridfs import AsyncGridFSBucket
+from gridfs.errors import FileExists
+from pymongo import AsyncMongoClient
+from typing import Any, AsyncIterable, Dict, List, Optional
 
+import asyncio
+import hashlib
 import os
 
 # Получаем параметры подключения из переменных окружения
@@ -11,18 +16,166 @@ mongo_password = os.environ.get("MONGO_PASSWORD", "password")
 # Формируем строку подключения
 mongo_uri = f"mongodb://{mongo_user}:{mongo_password}@{mongo_host}:{mongo_port}/"
 
-client = MongoClient(mongo_uri)
+# Размер пула соединений с MongoDB на процесс
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "0"))
+
+# Асинхронный клиент: операции с MongoDB не блокируют event loop
+client = AsyncMongoClient(
+    mongo_uri, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE
+)
 db = client["caloriecam"]
+# Старый формат: изображение целиком в поле data одного документа. Такие
+# документы только читаются и переносятся в GridFS при первом обращении
 images_collection = db["images"]
 
+# Изображения хранятся в GridFS чанками, поэтому не упираются в лимит BSON
+# в 16 МБ и пишутся/читаются потоком, без полной копии в памяти
+GRIDFS_BUCKET = os.environ.get("MONGO_GRIDFS_BUCKET", "image_files")
+GRIDFS_CHUNK_SIZE = int(os.environ.get("MONGO_GRIDFS_CHUNK_SIZE", str(255 * 1024)))
+images_fs = AsyncGridFSBucket(db, bucket_name=GRIDFS_BUCKET, chunk_size_bytes=GRIDFS_CHUNK_SIZE)
+image_files_collection = db[f"{GRIDFS_BUCKET}.files"]
+
+
+async def init_mongo() -> None:
+    """
+    Создаёт индексы хранилища изображений. Индексы по хэшу разреженные:
+    документы, сохранённые до появления хэша, его не имеют.
+    """
+    await images_collection.create_index("sha256", unique=True, sparse=True)
+    await image_files_collection.create_index("sha256", unique=True, sparse=True)
+
+
+class ImageTooLargeError(Exception):
+    """
+    Изображение превышает допустимый размер загрузки.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        super().__init__(f"Image is larger than {max_size} bytes")
+        self.max_size: int = max_size
+
 
-def save_image_to_mongo(image_data: bytes) -> str:
+async def find_images_by_hashes(image_hashes: List[str]) -> Dict[str, str]:
     """
-    Сохраняет изображение в MongoDB.
+    Ищет уже сохранённые изображения по хэшам содержимого, в GridFS и среди
+    документов старого формата.
+
+    :param image_hashes: SHA-256 содержимого изображений
+    :return: Словарь хэш -> строковый ObjectId для найденных изображений
+    """
+    ids: Dict[str, str] = {}
+    for collection in (image_files_collection, images_collection):
+        missing = [image_hash for image_hash in image_hashes if image_hash not in ids]
+        if not missing:
+            break
+        async for document in collection.find(
+            {"sha256": {"$in": missing}}, projection={"_id": True, "sha256": True}
+        ):
+            ids[document["sha256"]] = str(document["_id"])
+    return ids
+
+
+async def save_image_to_mongo(
+    image_data: bytes, image_hash: Optional[str] = None, fields: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    Сохраняет изображение в GridFS. Если передан хэш содержимого, повторная
+    загрузка того же изображения возвращает ID уже сохранённого файла.
 
     :param image_data: Двоичные данные изображения
+    :param image_hash: SHA-256 содержимого изображения
+    :param fields: Дополнительные поля документа файла (например, original_id)
+    :return: Строковое представление ObjectId сохранённого изображения
+    """
+    image_hash = image_hash or hashlib.sha256(image_data).hexdigest()
+    existing = await find_images_by_hashes([image_hash])
+    if image_hash in existing:
+        return existing[image_hash]
+
+    return await _upload(_single_chunk(image_data), max_size=0, image_hash=image_hash, fields=fields)
+
+
+async def save_image_stream_to_mongo(
+    chunks: AsyncIterable[bytes], max_size: int = 0, filename: Optional[str] = None
+) -> str:
+    """
+    Сохраняет изображение в GridFS потоком, чанк за чанком, считая хэш
+    содержимого по ходу записи. Дубликат обнаруживается при закрытии
+    файла по уникальному индексу, его чанки удаляются.
+
+    :param chunks: Асинхронный итератор блоков изображения
+    :param max_size: Максимальный размер изображения в байтах, 0 – без ограничения
+    :param filename: Исходное имя файла
     :return: Строковое представление ObjectId сохранённого изображения
+    :raises ImageTooLargeError: Если изображение больше max_size; записанные чанки удаляются
+    """
+    return await _upload(chunks, max_size=max_size, filename=filename)
+
+
+async def save_images_to_mongo(images: List[bytes], image_hashes: List[str]) -> List[str]:
+    """
+    Сохраняет несколько изображений в GridFS параллельно. Изображения, уже
+    сохранённые ранее или повторяющиеся внутри пакета, не дублируются.
+
+    :param images: Двоичные данные изображений
+    :param image_hashes: SHA-256 содержимого изображений в том же порядке
+    :return: Строковые ObjectId в порядке изображений
     """
-    image_document = {"data": image_data}
-    result = images_collection.insert_one(image_document)
-    return str(result.inserted_id)
+    ids = await find_images_by_hashes(list(dict.fromkeys(image_hashes)))
+
+    new_images: Dict[str, bytes] = {}
+    for image_data, image_hash in zip(images, image_hashes):
+        if image_hash not in ids and image_hash not in new_images:
+            new_images[image_hash] = image_data
+
+    if new_images:
+        new_ids = await asyncio.gather(
+            *(
+                _upload(_single_chunk(image_data), max_size=0, image_hash=image_hash)
+                for image_hash, image_data in new_images.items()
+            )
+        )
+        ids.update(zip(new_images, new_ids))
+
+    return [ids[image_hash] for image_hash in image_hashes]
+
+
+async def _single_chunk(image_data: bytes) -> AsyncIterable[bytes]:
+    yield image_data
+
+
+async def _upload(
+    chunks: AsyncIterable[bytes],
+    max_size: int,
+    image_hash: Optional[str] = None,
+    filename: Optional[str] = None,
+    fields: Optional[Dict[str, Any]] = None,
+) -> str:
+    grid_in = images_fs.open_upload_stream(filename or image_hash or "image")
+    for name, value in (fields or {}).items():
+        setattr(grid_in, name, value)
+    digest = hashlib.sha256() if image_hash is None else None
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if max_size and size > max_size:
+                raise ImageTooLargeError(max_size)
+            if digest is not None:
+                digest.update(chunk)
+            await grid_in.write(chunk)
+
+        image_hash = image_hash or digest.hexdigest()
+        grid_in.sha256 = image_hash
+        await grid_in.close()
+    except FileExists:
+        # Сработал уникальный индекс по хэшу: то же изображение уже сохранено
+        # (в т.ч. конкурентной загрузкой)
+        await grid_in.abort()
+        existing = await find_images_by_hashes([image_hash])
+        return existing[image_hash]
+    except BaseException:
+        await grid_in.abort()
+        raise
+    return str(grid_in._id)
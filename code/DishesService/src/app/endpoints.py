@@ -1,55 +1,206 @@
-from fastapi import APIRouter, UploadFile, File, Depends
+from fastapi import APIRouter, UploadFile, File, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from datetime import datetime
+from typing import List, Literal, Optional
+import asyncio
+import hashlib
+import os
 from app.services import (
     ImageService,
     PredictionService,
     DishService,
     NeuralNetworkService,
 )
-from app.schemas import GetStatus, GetPredictionInfo
+from app.schemas import (
+    GetStatus,
+    GetPredictionInfo,
+    GetItemStatus,
+    GetBatchStatus,
+    GetCatalogStatus,
+    GetPredictionPage,
+)
+from app.catalog import load_catalog
+from app.ingestion import InvalidImageError
 from app.database_postgres import get_db
-from sqlalchemy.orm import Session
+from app.jobs import PredictionWorkerPool, get_worker_pool
+from app.profiling import require_admin
+from app.models import STATUS_PENDING
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter()
 
+# Максимальное количество изображений в одном запросе /load_images
+MAX_UPLOAD_FILES = int(os.environ.get("MAX_UPLOAD_FILES", "32"))
+
 
 @router.post("/load_image/{prediction_name}", response_model=GetStatus)
 async def load_image(
     prediction_name: str,
+    response: Response,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    mode: Literal["sync", "async"] = Query("sync"),
+    db: AsyncSession = Depends(get_db),
     image_service: ImageService = Depends(),
     nn_service: NeuralNetworkService = Depends(),
     dish_service: DishService = Depends(DishService),
     prediction_service: PredictionService = Depends(PredictionService),
+    worker_pool: PredictionWorkerPool = Depends(get_worker_pool),
 ):
-    mongo_id = await image_service.save_image_to_mongo(file)
-    predicted_class = await nn_service.classify_image(mongo_id)
-    dish_info = dish_service.get_dish_by_name(predicted_class)
-    pred = prediction_service.save_prediction(
+    # Изображение декодируется один раз и уменьшается: и в GridFS, и в
+    # нейросеть уходит компактная копия вместо полноразмерного фото
+    image = await image_service.normalize_upload(file)
+    image_hash = image_service.get_image_hash(image.data)
+
+    if mode == "async":
+        # Классификация уходит в очередь заданий: клиент получает ID сразу
+        # и опрашивает /predict/{id}
+        mongo_id = await image_service.store_upload(file, image, image_hash)
+        job = await prediction_service.create_job(prediction_name=prediction_name, image_id=mongo_id)
+        worker_pool.notify()
+        response.status_code = 202
+        return GetStatus(status=STATUS_PENDING, id=job.id)
+
+    # Байты уходят в нейросеть напрямую, сохранение в MongoDB идёт параллельно,
+    # как в /load_images. Если классификация не удалась, файл остаётся в GridFS
+    # без предсказания; это безопасно: файлы дедуплицируются по SHA-256, и
+    # повторная загрузка того же фото использует его снова
+    mongo_id, prediction = await asyncio.gather(
+        image_service.store_upload(file, image, image_hash),
+        nn_service.classify_image_bytes(image.data, image_hash),
+    )
+    dish_info = dish_service.get_dish_by_name(prediction.predicted_class)
+    if dish_info is None:
+        raise HTTPException(status_code=502, detail=f"Unknown dish: {prediction.predicted_class}")
+    pred = await prediction_service.save_prediction(
         dish_id=dish_info.id, 
         prediction_name=prediction_name, 
-        result=predicted_class,
-        image_id=mongo_id
+        result=prediction.predicted_class,
+        image_id=mongo_id,
+        probability=prediction.probability,
+        top_k=prediction.top_k,
     )
 
     return GetStatus(status="success", id=pred.id)
 
 
+@router.post("/load_images/{prediction_name}", response_model=GetBatchStatus)
+async def load_images(
+    prediction_name: str,
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db),
+    image_service: ImageService = Depends(),
+    nn_service: NeuralNetworkService = Depends(),
+    dish_service: DishService = Depends(DishService),
+    prediction_service: PredictionService = Depends(PredictionService),
+):
+    if len(files) > MAX_UPLOAD_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_UPLOAD_FILES} images per request")
+
+    normalized = await asyncio.gather(
+        *(image_service.normalize_upload(file) for file in files), return_exceptions=True
+    )
+    # Нераспознанный файл помечается ошибкой, остальные ошибки прерывают запрос
+    for result in normalized:
+        if isinstance(result, BaseException) and not isinstance(result, InvalidImageError):
+            raise result
+    valid = [index for index, result in enumerate(normalized) if not isinstance(result, BaseException)]
+    images = [normalized[index] for index in valid]
+    image_hashes = [image_service.get_image_hash(image.data) for image in images]
+    # Сохранение в MongoDB параллельно с одним батчевым запросом к нейросети
+    mongo_ids, nn_items = await asyncio.gather(
+        image_service.store_uploads([files[index] for index in valid], images, image_hashes),
+        nn_service.classify_images_bytes([image.data for image in images], image_hashes),
+    )
+    outcomes = dict(zip(valid, zip(mongo_ids, nn_items)))
+    dishes = dish_service.get_dishes_by_names(
+        [item.prediction.predicted_class for item in nn_items if item.prediction is not None]
+    )
+
+    statuses: List[GetItemStatus] = []
+    rows = []
+    for index, file in enumerate(files):
+        status = GetItemStatus(index=index, filename=file.filename, status="failed")
+        statuses.append(status)
+        if index not in outcomes:
+            status.error = str(normalized[index])
+            continue
+        mongo_id, item = outcomes[index]
+        status.error = item.error
+        if item.prediction is None:
+            continue
+        dish_info = dishes.get(item.prediction.predicted_class)
+        if dish_info is None:
+            status.error = f"Unknown dish: {item.prediction.predicted_class}"
+            continue
+        status.status = "success"
+        rows.append(dict(
+            dish_id=dish_info.id,
+            prediction_name=prediction_name,
+            result=item.prediction.predicted_class,
+            image_id=mongo_id,
+            probability=item.prediction.probability,
+            top_k=item.prediction.top_k,
+        ))
+
+    # Все предсказания пакета сохраняются одной транзакцией
+    prediction_ids = iter(await prediction_service.save_predictions(rows) if rows else [])
+    for status in statuses:
+        if status.status == "success":
+            status.id = next(prediction_ids)
+
+    return GetBatchStatus(items=statuses)
+
+
 @router.get("/predict/{predict_id}", response_model=GetPredictionInfo)
-def get_prediction_from_service(
+async def get_prediction_from_service(
     predict_id: int,
-    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
     prediction_service: PredictionService = Depends(PredictionService),
-    dishes_service: DishService = Depends(DishService),
 ):
-    prediction = prediction_service.get_prediction_by_id(predict_id)
-    dish_info = dishes_service.get_dish_by_id(prediction.dish_id)
-
-    return GetPredictionInfo(
-        prediction_name=prediction.prediction_name,
-        dish_name=dish_info.name,
-        calories=dish_info.calories,
-        protein=dish_info.protein,
-        fat=dish_info.fat,
-        carbs=dish_info.carbs,
-    )
\ No newline at end of file
+    info = await prediction_service.get_prediction_info(predict_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Prediction not found")
+
+    # ETag по содержимому ответа: фронтенд, опрашивающий статус задания,
+    # получает 304 без тела, пока ответ не изменился
+    body = info.model_dump_json().encode()
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+@router.get("/predictions", response_model=GetPredictionPage)
+async def get_predictions(
+    cursor: Optional[int] = Query(None, description="next_cursor предыдущей страницы"),
+    limit: int = Query(50, ge=1, le=1000),
+    order: Literal["desc", "asc"] = Query("desc"),
+    dish_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    prediction_service: PredictionService = Depends(PredictionService),
+):
+    return await prediction_service.get_history(cursor, limit, order == "desc", dish_id, since, until)
+
+
+@router.get("/predictions/export")
+async def export_predictions(
+    format: Literal["ndjson", "csv"] = Query("ndjson"),
+    dish_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        PredictionService.export_history(format, dish_id, since, until),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="predictions.{format}"'},
+    )
+
+
+@router.post("/catalog/refresh", response_model=GetCatalogStatus, dependencies=[Depends(require_admin)])
+async def refresh_catalog(db: AsyncSession = Depends(get_db)):
+    # Перечитать справочник после изменения таблицы dishes. Сразу – только в
+    # текущем процессе, остальные воркеры подхватят изменения сами
+    catalog = await load_catalog(db)
+    return GetCatalogStatus(dishes=len(catalog), loaded_at=catalog.loaded_at, pid=os.getpid())
@@ -0,0 +1,87 @@
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError
+from prometheus_client import Counter, Histogram
+from typing import BinaryIO, NamedTuple, Union
+import io
+import os
+
+# Модель видит только 224×224, поэтому хранить и передавать в NNService
+# полноразмерные фото незачем. Длинная сторона сохраняемой копии ограничена
+# с запасом, 0 – изображения сохраняются как есть
+INGEST_MAX_SIDE = int(os.environ.get("INGEST_MAX_SIDE", "512"))
+INGEST_JPEG_QUALITY = int(os.environ.get("INGEST_JPEG_QUALITY", "90"))
+# Дополнительно сохранять исходный файл в GridFS (ссылка – поле original_id)
+INGEST_KEEP_ORIGINAL = os.environ.get("INGEST_KEEP_ORIGINAL", "false").lower() in ("1", "true", "yes")
+
+INGEST_SECONDS = Histogram(
+    "dishes_ingest_seconds",
+    "Длительность нормализации одного изображения",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+INGEST_BYTES = Counter(
+    "dishes_ingest_bytes_total", "Объём изображений до и после нормализации", ["stage"]
+)
+
+
+class InvalidImageError(Exception):
+    """
+    Загруженный файл не удалось декодировать как изображение.
+    """
+
+
+class NormalizedImage(NamedTuple):
+    """Изображение, подготовленное к хранению и инференсу"""
+    data: bytes
+    width: int
+    height: int
+    original_size: int
+    # Байты не менялись: исходный файл уже подходит под ограничения
+    unchanged: bool
+
+
+def normalize_image(
+    source: Union[bytes, BinaryIO],
+    max_side: int = INGEST_MAX_SIDE,
+    quality: int = INGEST_JPEG_QUALITY,
+) -> NormalizedImage:
+    """
+    Декодирует изображение один раз, поворачивает по EXIF-ориентации,
+    уменьшает до max_side по длинной стороне и перекодирует в JPEG.
+    JPEG декодируется сразу в уменьшенном масштабе (draft), поэтому
+    полноразмерный растр не создаётся. Небольшой JPEG без поворота
+    сохраняется без перекодирования.
+
+    :param source: Закодированное изображение или файловый объект с ним
+    :param max_side: Максимальная длина стороны в пикселях, 0 – без нормализации
+    :param quality: Качество JPEG (1–95)
+    :return: Нормализованное изображение
+    :raises InvalidImageError: Если файл не является изображением
+    """
+    stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    stream.seek(0, io.SEEK_END)
+    original_size = stream.tell()
+    stream.seek(0)
+
+    with INGEST_SECONDS.time():
+        try:
+            with Image.open(stream) as img:
+                orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+                if not max_side or (
+                    img.format == "JPEG" and max(img.size) <= max_side and orientation == 1
+                ):
+                    stream.seek(0)
+                    result = NormalizedImage(stream.read(), *img.size, original_size, True)
+                else:
+                    img.draft("RGB", (max_side, max_side))
+                    img = ImageOps.exif_transpose(img)
+                    if img.mode != "RGB":
+                        img = img.convert("RGB")
+                    img.thumbnail((max_side, max_side), Image.BILINEAR)
+                    out = io.BytesIO()
+                    img.save(out, "JPEG", quality=quality)
+                    result = NormalizedImage(out.getvalue(), *img.size, original_size, False)
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+            raise InvalidImageError(f"Image could not be decoded: {e}") from e
+
+    INGEST_BYTES.labels(stage="original").inc(original_size)
+    INGEST_BYTES.labels(stage="stored").inc(len(result.data))
+    return result
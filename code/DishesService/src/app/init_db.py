@@ -1,5 +1,5 @@
-from sqlalchemy.orm import Session
-from app.database_postgres import Base, engine, get_db
+from sqlalchemy import Connection, inspect, select, text
+from app.database_postgres import Base, SessionLocal
 from app.models import Dish
 
 initial_dishes = [
@@ -106,17 +106,56 @@ initial_dishes = [
     {"name": "waffles", "calories": 310, "protein": 8, "fat": 15, "carbs": 40},
 ]
 
-def init_db():
+async def init_db():
     # Создание данных в таблице dishes, если она пуста
-    db: Session = next(get_db())
-    try:
-        if not db.query(Dish).first():  # Если в таблице нет блюд
-            for dish in initial_dishes:
-                db.add(Dish(**dish))
-            db.commit()
-            print("Инициализация завершена: блюда добавлены.")
-        else:
-            print("Блюда уже существуют в базе данных.")
-    except Exception as e:
-        print(f"Ошибка при добавлении блюд: {e}")
-        db.rollback()
\ No newline at end of file
+    async with SessionLocal() as db:
+        try:
+            if (await db.execute(select(Dish.id).limit(1))).first() is None:  # Если в таблице нет блюд
+                db.add_all([Dish(**dish) for dish in initial_dishes])
+                await db.commit()
+                print("Инициализация завершена: блюда добавлены.")
+            else:
+                print("Блюда уже существуют в базе данных.")
+        except Exception as e:
+            print(f"Ошибка при добавлении блюд: {e}")
+            await db.rollback()
+
+
+def migrate_db(conn: Connection):
+    # create_all не изменяет существующие таблицы: добавляем колонки,
+    # появившиеся в моделях после создания таблиц.
+    # Вызывается через AsyncConnection.run_sync: инспектор синхронный
+    inspector = inspect(conn)
+    dialect = conn.dialect
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect)}"
+            if column.server_default is not None:
+                default = column.server_default.arg
+                if isinstance(default, str):
+                    default = "'" + default.replace("'", "''") + "'"
+                else:
+                    default = str(default.compile(dialect=dialect))
+                ddl += f" DEFAULT {default}"
+            conn.execute(text(ddl))
+            print(f"Миграция: добавлена колонка {table.name}.{column.name}")
+
+        # Колонки, ставшие необязательными (SQLite не поддерживает ALTER COLUMN)
+        db_columns = inspector.get_columns(table.name) if dialect.name != "sqlite" else []
+        for column_info in db_columns:
+            column = table.columns.get(column_info["name"])
+            if column is not None and column.nullable and not column_info["nullable"]:
+                conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {column.name} DROP NOT NULL"))
+                print(f"Миграция: колонка {table.name}.{column.name} стала необязательной")
+
+        # Индексы, появившиеся в моделях после создания таблицы
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=conn)
+                print(f"Миграция: создан индекс {index.name}")
@@ -0,0 +1,183 @@
+from prometheus_client import Gauge, Histogram
+from datetime import timezone
+from typing import List, Optional
+import asyncio
+import os
+
+from app.database_postgres import SessionLocal
+from app.nn_client import NeuralNetworkClient, nn_client
+from app.repositories import PredictionRepository
+from app.catalog import get_catalog
+from app.schemas import NNPrediction
+from app.services import NeuralNetworkService, PredictionService
+from app.instrumentation import trace
+
+# Количество одновременно обрабатываемых заданий на классификацию
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+# Как часто свободный воркер проверяет очередь, если его не разбудили
+JOB_POLL_INTERVAL_SECONDS = float(os.environ.get("JOB_POLL_INTERVAL_SECONDS", "1"))
+# Через сколько секунд задание в статусе processing считается брошенным
+JOB_STALE_SECONDS = float(os.environ.get("JOB_STALE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+
+JOB_QUEUE_DEPTH = Gauge(
+    "dishes_job_queue_depth", "Задания на классификацию в статусах pending и processing"
+)
+JOB_LATENCY = Histogram(
+    "dishes_job_latency_seconds",
+    "Время от постановки задания в очередь до его завершения",
+    ["status"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+JOB_PROCESSING = Histogram(
+    "dishes_job_processing_seconds",
+    "Длительность одной попытки обработки задания",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+
+class PredictionWorkerPool:
+    """
+    Ограниченный пул воркеров, разбирающих очередь заданий на классификацию.
+    Очередью служит таблица predictions: задание – строка в статусе pending,
+    поэтому она переживает перезапуск сервиса, а незавершённые попытки
+    подбираются повторно по истечении JOB_STALE_SECONDS.
+    """
+
+    def __init__(
+        self,
+        client: NeuralNetworkClient = nn_client,
+        workers: int = JOB_WORKERS,
+        poll_interval: float = JOB_POLL_INTERVAL_SECONDS,
+        stale_seconds: float = JOB_STALE_SECONDS,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ) -> None:
+        """
+        :param client: Клиент NNService
+        :param workers: Количество воркеров
+        :param poll_interval: Период опроса очереди в секундах
+        :param stale_seconds: Таймаут зависшей обработки в секундах
+        :param max_attempts: Количество попыток до статуса failed
+        """
+        self.client: NeuralNetworkClient = client
+        self.workers: int = max(1, workers)
+        self.poll_interval: float = poll_interval
+        self.stale_seconds: float = stale_seconds
+        self.max_attempts: int = max(1, max_attempts)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        await self._update_queue_depth()
+
+
+    async def stop(self) -> None:
+        """
+        Останавливает воркеры. Прерванные задания остаются в статусе
+        processing и будут подобраны повторно после перезапуска
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+    def notify(self) -> None:
+        """
+        Будит свободные воркеры после постановки нового задания
+        """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                # БД временно недоступна: воркер не завершается, а ждёт
+                print(f"[ERROR] Не удалось получить задание из очереди: {e!r}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._process(*job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Задание останется в processing и будет подобрано повторно
+                print(f"[ERROR] Не удалось обработать задание {job[0]}: {e!r}")
+
+
+    async def _claim(self):
+        async with SessionLocal() as db:
+            job = await PredictionRepository(db).claim_next_job(self.stale_seconds, self.max_attempts)
+            if job is None:
+                return None
+            return job.id, job.image_id
+
+
+    async def _process(self, job_id: int, image_id: str) -> None:
+        # Задание выполняется вне HTTP-запроса: своя трассировка, которая
+        # передаётся в NNService вместе с запросом предсказания
+        with JOB_PROCESSING.time(), trace(f"job {job_id}"):
+            try:
+                prediction = await NeuralNetworkService(self.client).classify_image(image_id)
+                job = await self._complete(job_id, prediction, PredictionService.pack_top_k(prediction.top_k))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[ERROR] Задание {job_id}: {e!r}")
+                job = await self._fail(job_id, str(e) or type(e).__name__)
+
+        if job.finished_at is not None and job.created_at is not None:
+            # SQLite возвращает время без часового пояса (CURRENT_TIMESTAMP – UTC)
+            created_at = job.created_at
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            JOB_LATENCY.labels(status=job.status).observe(
+                (job.finished_at - created_at).total_seconds()
+            )
+        await self._update_queue_depth()
+
+
+    async def _complete(self, job_id: int, prediction: NNPrediction, top_k: list):
+        dish = get_catalog().get_by_name(prediction.predicted_class)
+        if dish is None:
+            raise LookupError(f"Unknown dish: {prediction.predicted_class}")
+        async with SessionLocal() as db:
+            return await PredictionRepository(db).complete_job(
+                job_id,
+                dish_id=dish.id,
+                result=prediction.predicted_class,
+                probability=prediction.probability,
+                top_k=top_k or None,
+            )
+
+
+    async def _fail(self, job_id: int, error: str):
+        async with SessionLocal() as db:
+            return await PredictionRepository(db).fail_job(job_id, error, self.max_attempts)
+
+
+    async def _update_queue_depth(self) -> None:
+        async with SessionLocal() as db:
+            JOB_QUEUE_DEPTH.set(await PredictionRepository(db).count_pending())
+
+
+worker_pool = PredictionWorkerPool()
+
+
+def get_worker_pool() -> PredictionWorkerPool:
+    """
+    Зависимость FastAPI: общий для приложения пул воркеров
+    """
+    return worker_pool
@@ -1,7 +1,13 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, JSON, DateTime, Index, func
 from sqlalchemy.orm import relationship
 from app.database_postgres import Base
 
+# Статусы предсказания (задания на классификацию)
+STATUS_PENDING = "pending"
+STATUS_PROCESSING = "processing"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
 class Dish(Base):
     __tablename__ = "dishes"
 
@@ -29,11 +35,37 @@ class Prediction(Base):
     dish_id = Column(
         Integer,
         ForeignKey("dishes.id"),
-        nullable=False,
-        comment="ID блюда, на которое сделано предсказание",
+        nullable=True,
+        comment="ID блюда, на которое сделано предсказание (пусто, пока задание не выполнено)",
     )
     prediction_name = Column(String, comment="Название предсказания для отображения")
     result = Column(String, comment="Результат предсказания (название класса)")
     image_id = Column(String, nullable=True, comment="ID изображения в MongoDB")
+    probability = Column(Float, nullable=True, comment="Вероятность предсказанного класса")
+    top_k = Column(
+        JSON,
+        nullable=True,
+        comment="Наиболее вероятные классы: [[класс, вероятность], ...]",
+    )
+    status = Column(
+        String,
+        nullable=False,
+        default=STATUS_DONE,
+        server_default=STATUS_DONE,
+        comment="Статус: pending, processing, done или failed",
+    )
+    error = Column(String, nullable=True, comment="Текст ошибки, если задание не выполнено")
+    attempts = Column(Integer, nullable=False, default=0, server_default="0", comment="Количество попыток обработки")
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), comment="Время создания")
+    started_at = Column(DateTime(timezone=True), nullable=True, comment="Время начала последней попытки")
+    finished_at = Column(DateTime(timezone=True), nullable=True, comment="Время завершения обработки")
 
     dish = relationship("Dish", back_populates="predictions")
+
+    __table_args__ = (
+        # Очередь заданий: выборка ожидающих по порядку создания
+        Index("ix_predictions_status_id", "status", "id"),
+        # История с курсором по id: фильтр по блюду и по времени создания
+        Index("ix_predictions_dish_id_id", "dish_id", "id"),
+        Index("ix_predictions_created_at_id", "created_at", "id"),
+    )
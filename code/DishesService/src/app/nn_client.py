@@ -0,0 +1,244 @@
+import httpx
+from prometheus_client import Counter, Gauge
+from typing import Optional
+import asyncio
+import os
+import random
+import time
+
+from app.instrumentation import TRACE_HEADER, current_trace_id, span
+
+# URL эндпоинта предсказаний NNService (см. docker-compose.yaml)
+NEURAL_NETWORK_SERVICE_URL = os.environ.get(
+    "NEURAL_NETWORK_SERVICE_URL", "http://caloriecam-nn-service:8000/nn/predict"
+)
+
+NN_CONNECT_TIMEOUT = float(os.environ.get("NN_CONNECT_TIMEOUT", "2"))
+NN_READ_TIMEOUT = float(os.environ.get("NN_READ_TIMEOUT", "30"))
+NN_MAX_CONNECTIONS = int(os.environ.get("NN_MAX_CONNECTIONS", "100"))
+NN_MAX_KEEPALIVE = int(os.environ.get("NN_MAX_KEEPALIVE", "20"))
+NN_RETRIES = int(os.environ.get("NN_RETRIES", "2"))
+NN_RETRY_BACKOFF = float(os.environ.get("NN_RETRY_BACKOFF", "0.1"))
+# Самая долгая пауза по заголовку Retry-After, которую стоит выждать перед
+# повтором; если NNService просит подождать дольше, запрос не повторяется
+NN_RETRY_AFTER_MAX = float(os.environ.get("NN_RETRY_AFTER_MAX", "5"))
+NN_BREAKER_FAILURES = int(os.environ.get("NN_BREAKER_FAILURES", "5"))
+NN_BREAKER_RESET_SECONDS = float(os.environ.get("NN_BREAKER_RESET_SECONDS", "10"))
+
+# Ответы, означающие перегрузку или временную недоступность NNService
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+
+NN_RETRIES_TOTAL = Counter("dishes_nn_retries_total", "Повторные запросы к NNService")
+NN_BREAKER_OPEN = Gauge("dishes_nn_breaker_open", "Автомат NNService разомкнут (1) или замкнут (0)")
+NN_BREAKER_REJECTED = Counter(
+    "dishes_nn_breaker_rejected_total", "Запросы, отклонённые разомкнутым автоматом NNService"
+)
+
+
+class CircuitOpenError(Exception):
+    """
+    NNService признан недоступным, запрос отклонён без обращения к нему.
+    """
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__("Neural network service is unavailable")
+        self.retry_after: float = retry_after
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель: после failure_threshold ошибок подряд
+    размыкается на reset_timeout секунд, затем пропускает один пробный
+    запрос и замыкается, если тот завершился успешно.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self._failures: int = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight: bool = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def before_request(self) -> bool:
+        """
+        :return: True, если запрос пропущен как пробный
+        :raises CircuitOpenError: Если автомат разомкнут
+        """
+        if self._opened_at is None:
+            return False
+        elapsed = time.monotonic() - self._opened_at
+        if elapsed < self.reset_timeout or self._probe_in_flight:
+            NN_BREAKER_REJECTED.inc()
+            raise CircuitOpenError(retry_after=max(self.reset_timeout - elapsed, 1.0))
+        self._probe_in_flight = True
+        return True
+
+    def release_probe(self) -> None:
+        """
+        Освобождает место пробного запроса, который завершился без
+        результата (отменён или упал с неожиданной ошибкой), чтобы следующий
+        запрос смог стать пробным. Состояние автомата не меняется.
+        """
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        NN_BREAKER_OPEN.set(0)
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probe_in_flight = False
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            NN_BREAKER_OPEN.set(1)
+
+
+class NeuralNetworkClient:
+    """
+    HTTP-клиент NNService на всё время жизни приложения: общий пул
+    соединений с keep-alive, раздельные таймауты подключения и чтения,
+    ограниченные повторы с джиттером для идемпотентных запросов и
+    автоматический выключатель.
+    """
+
+    def __init__(
+        self,
+        predict_url: str = NEURAL_NETWORK_SERVICE_URL,
+        connect_timeout: float = NN_CONNECT_TIMEOUT,
+        read_timeout: float = NN_READ_TIMEOUT,
+        max_connections: int = NN_MAX_CONNECTIONS,
+        max_keepalive: int = NN_MAX_KEEPALIVE,
+        retries: int = NN_RETRIES,
+        backoff: float = NN_RETRY_BACKOFF,
+    ):
+        self.predict_url = predict_url.rstrip("/")
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_keepalive
+        )
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(NN_BREAKER_FAILURES, NN_BREAKER_RESET_SECONDS)
+        self._client: Optional[httpx.AsyncClient] = None
+
+
+    async def start(self):
+        self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+    async def request(self, method: str, url: str, idempotent: bool = False, **kwargs) -> httpx.Response:
+        """
+        Выполняет запрос к NNService через общий пул соединений
+
+        :param method: HTTP-метод
+        :param url: Полный URL
+        :param idempotent: Можно ли безопасно повторить запрос
+        :param kwargs: Параметры httpx.AsyncClient.request
+        :return: Успешный ответ
+        :raises CircuitOpenError: Если автомат разомкнут
+        :raises httpx.HTTPError: Если запрос не удался после всех попыток
+        """
+        if self._client is None:
+            raise RuntimeError("Neural network client is not started")
+
+        # Идентификатор трассировки передаётся в NNService, чтобы запрос
+        # можно было найти в журналах обоих сервисов
+        trace_id = current_trace_id()
+        if trace_id:
+            kwargs["headers"] = {**kwargs.get("headers", {}), TRACE_HEADER: trace_id}
+
+        with span("nn_request"):
+            return await self._request_with_retries(method, url, idempotent, **kwargs)
+
+
+    async def probe(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Служебный запрос к NNService через тот же пул соединений, но без
+        повторов и мимо автомата: ответы 503 во время загрузки модели не
+        должны размыкать его для запросов предсказаний
+
+        :param method: HTTP-метод
+        :param url: Полный URL
+        :param kwargs: Параметры httpx.AsyncClient.request
+        :return: Успешный ответ
+        :raises httpx.HTTPError: Если запрос не удался
+        """
+        if self._client is None:
+            raise RuntimeError("Neural network client is not started")
+        response = await self._client.request(method, url, **kwargs)
+        response.raise_for_status()
+        return response
+
+
+    async def _request_with_retries(self, method: str, url: str, idempotent: bool, **kwargs) -> httpx.Response:
+        attempts = self.retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            last_attempt = attempt + 1 >= attempts
+            probe = self.breaker.before_request()
+            try:
+                response = await self._client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                self.breaker.record_failure()
+                if last_attempt:
+                    raise
+                delay = self._retry_delay(attempt, None)
+            else:
+                # Ошибка сервера размыкает автомат так же, как недоступность;
+                # остальные ответы 4xx означают, что NNService работает
+                if response.status_code >= 500 or response.status_code in RETRYABLE_STATUS_CODES:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                delay = None
+                if response.status_code in RETRYABLE_STATUS_CODES and not last_attempt:
+                    delay = self._retry_delay(attempt, response)
+                if delay is None:
+                    response.raise_for_status()
+                    return response
+            finally:
+                # Пробный запрос, отменённый или упавший с неожиданной ошибкой,
+                # не должен навсегда оставить автомат разомкнутым
+                if probe:
+                    self.breaker.release_probe()
+
+            NN_RETRIES_TOTAL.inc()
+            await asyncio.sleep(delay)
+
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response]) -> Optional[float]:
+        """
+        :return: Пауза перед повтором или None, если повторять не стоит
+        """
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after is not None:
+            try:
+                delay = max(float(retry_after), 0.0)
+            except ValueError:
+                delay = None
+            if delay is not None:
+                # NNService сам сообщает, когда освободится очередь
+                return delay if delay <= NN_RETRY_AFTER_MAX else None
+        # Экспоненциальная задержка с полным джиттером
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+
+nn_client = NeuralNetworkClient()
+
+
+def get_nn_client() -> NeuralNetworkClient:
+    """
+    Зависимость FastAPI: общий для приложения клиент NNService
+    """
+    return nn_client
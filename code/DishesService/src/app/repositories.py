@@ -1,42 +1,301 @@
-from sqlalchemy.orm import Session
-from app.models import Dish, Prediction
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, List, Optional
+from app.models import (
+    Dish,
+    Prediction,
+    STATUS_PENDING,
+    STATUS_PROCESSING,
+    STATUS_DONE,
+    STATUS_FAILED,
+)
 
 
 class DishRepository:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
-    def get_all_dishes(self, skip: int = 0, limit: int = 100):
-        return self.db.query(Dish).offset(skip).limit(limit).all()
+    async def get_all_dishes(self, after_id: int = 0, limit: Optional[int] = 100):
+        # Курсор по id вместо offset: стоимость страницы не зависит от её номера
+        result = await self.db.execute(
+            select(Dish).where(Dish.id > after_id).order_by(Dish.id).limit(limit)
+        )
+        return result.scalars().all()
 
-    def get_dish_by_id(self, dish_id: int):
-        return self.db.query(Dish).filter(Dish.id == dish_id).first()
+    async def get_dish_by_id(self, dish_id: int):
+        return await self.db.get(Dish, dish_id)
     
-    def get_dish_by_name(self, dish_name: str):
-        return self.db.query(Dish).filter(Dish.name == dish_name).first()
+    async def get_dish_by_name(self, dish_name: str):
+        result = await self.db.execute(select(Dish).where(Dish.name == dish_name).limit(1))
+        return result.scalars().first()
 
 
 class PredictionRepository:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
     
-    def get_all_predictions(self, skip: int = 0, limit: int = 5):
-        return self.db.query(Prediction).offset(skip).limit(limit).all()
+    async def get_all_predictions(self, after_id: int = 0, limit: int = 5):
+        result = await self.db.execute(
+            select(Prediction).where(Prediction.id > after_id).order_by(Prediction.id).limit(limit)
+        )
+        return result.scalars().all()
+
+
+    @staticmethod
+    def _history_query(
+        dish_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ):
+        query = select(
+            Prediction.id,
+            Prediction.prediction_name,
+            Prediction.status,
+            Prediction.result,
+            Prediction.dish_id,
+            Prediction.probability,
+            Prediction.image_id,
+            Prediction.created_at,
+        )
+        if dish_id is not None:
+            query = query.where(Prediction.dish_id == dish_id)
+        if since is not None:
+            query = query.where(Prediction.created_at >= since)
+        if until is not None:
+            query = query.where(Prediction.created_at < until)
+        return query
 
 
-    def get_prediction_by_id(self, prediction_id: int):
-        return self.db.query(Prediction).filter(Prediction.id == prediction_id).first()
+    async def get_predictions_page(
+        self,
+        cursor: Optional[int] = None,
+        limit: int = 50,
+        descending: bool = True,
+        dish_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ):
+        """
+        Страница истории предсказаний с курсором по id (keyset-пагинация):
+        запрос продолжает индекс с последнего выданного id, а не пропускает
+        offset строк, поэтому глубокие страницы не дороже первой
+
+        :param cursor: id последнего предсказания предыдущей страницы
+        :param limit: Размер страницы
+        :param descending: Сначала новые (True) или сначала старые
+        :param dish_id: Фильтр по блюду
+        :param since: Созданные не раньше этого момента
+        :param until: Созданные раньше этого момента
+        :return: Строки предсказаний
+        """
+        query = self._history_query(dish_id, since, until)
+        if cursor is not None:
+            query = query.where(Prediction.id < cursor if descending else Prediction.id > cursor)
+        order = Prediction.id.desc() if descending else Prediction.id
+        return (await self.db.execute(query.order_by(order).limit(limit))).all()
+
+
+    async def iter_predictions(
+        self,
+        dish_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        batch_size: int = 1000,
+    ) -> AsyncIterator:
+        """
+        Все предсказания по фильтрам в порядке id. Строки читаются
+        серверным курсором порциями по batch_size, поэтому выгрузка
+        любого объёма занимает постоянную память
+        """
+        result = await self.db.stream(
+            self._history_query(dish_id, since, until)
+            .order_by(Prediction.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for partition in result.partitions():
+            for row in partition:
+                yield row
+
 
+    async def get_prediction_by_id(self, prediction_id: int):
+        return await self.db.get(Prediction, prediction_id)
 
-    def create_prediction(self, dish_id: int, prediction_name: str, result: str, image_id: str = None):
+
+    async def get_prediction_info(self, prediction_id: int):
+        """
+        Предсказание вместе с блюдом одним запросом: внешнее соединение
+        (у невыполненных заданий блюда нет) и только нужные для ответа колонки
+
+        :param prediction_id: ID предсказания
+        :return: Строка с колонками предсказания и блюда или None
+        """
+        result = await self.db.execute(
+            select(
+                Prediction.prediction_name,
+                Prediction.status,
+                Prediction.error,
+                Prediction.probability,
+                Prediction.top_k,
+                Dish.name.label("dish_name"),
+                Dish.calories,
+                Dish.protein,
+                Dish.fat,
+                Dish.carbs,
+            )
+            .outerjoin(Dish, Dish.id == Prediction.dish_id)
+            .where(Prediction.id == prediction_id)
+        )
+        return result.first()
+
+
+    async def create_prediction(
+        self,
+        dish_id: int,
+        prediction_name: str,
+        result: str,
+        image_id: str = None,
+        probability: float = None,
+        top_k: list = None,
+    ):
         new_prediction = Prediction(
             dish_id=dish_id, 
             prediction_name=prediction_name,
             result=result, 
-            image_id=image_id
+            image_id=image_id,
+            probability=probability,
+            top_k=top_k,
         )
         self.db.add(new_prediction)
-        self.db.commit()
-        self.db.refresh(new_prediction)
-        return new_prediction
\ No newline at end of file
+        await self.db.commit()
+        return new_prediction
+
+
+    async def create_predictions(self, rows: List[dict]) -> List[int]:
+        """
+        Сохраняет несколько предсказаний в одной транзакции
+
+        :param rows: Значения колонок для каждого предсказания
+        :return: ID созданных предсказаний в том же порядке
+        """
+        new_predictions = [Prediction(**row) for row in rows]
+        self.db.add_all(new_predictions)
+        await self.db.commit()
+        return [prediction.id for prediction in new_predictions]
+
+
+    async def create_pending_prediction(self, prediction_name: str, image_id: str):
+        """
+        Создаёт задание на классификацию уже сохранённого изображения
+        """
+        new_prediction = Prediction(
+            prediction_name=prediction_name,
+            image_id=image_id,
+            status=STATUS_PENDING,
+            attempts=0,
+        )
+        self.db.add(new_prediction)
+        await self.db.commit()
+        return new_prediction
+
+
+    async def claim_next_job(self, stale_seconds: float, max_attempts: int) -> Optional[Prediction]:
+        """
+        Забирает самое старое ожидающее задание (или зависшее в обработке
+        дольше stale_seconds, например после падения воркера) и помечает
+        его как обрабатываемое. SKIP LOCKED позволяет нескольким воркерам
+        и экземплярам сервиса разбирать очередь, не блокируя друг друга.
+        Зависшее задание, исчерпавшее попытки (например, каждый раз роняющее
+        воркер), больше не подбирается, а помечается как failed
+
+        :param stale_seconds: Через сколько секунд обработка считается зависшей
+        :param max_attempts: Количество попыток до статуса failed
+        :return: Задание или None, если очередь пуста
+        """
+        now = datetime.now(timezone.utc)
+        stale = (Prediction.status == STATUS_PROCESSING) & (
+            Prediction.started_at < now - timedelta(seconds=stale_seconds)
+        )
+        await self.db.execute(
+            update(Prediction)
+            .where(stale, Prediction.attempts >= max_attempts)
+            .values(
+                status=STATUS_FAILED,
+                error=f"Job was not finished after {max_attempts} attempts",
+                finished_at=now,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.db.execute(
+            select(Prediction)
+            .where(
+                or_(
+                    Prediction.status == STATUS_PENDING,
+                    stale & (Prediction.attempts < max_attempts),
+                )
+            )
+            .order_by(Prediction.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        job = result.scalars().first()
+        if job is None:
+            await self.db.commit()
+            return None
+        # Условное обновление: задание, уже перехваченное другим воркером
+        # (на СУБД без блокировок строк), повторно не забирается
+        claimed = (await self.db.execute(
+            update(Prediction)
+            .where(Prediction.id == job.id, Prediction.attempts == job.attempts)
+            .values(status=STATUS_PROCESSING, started_at=now, attempts=Prediction.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )).rowcount
+        await self.db.commit()
+        if not claimed:
+            return None
+        await self.db.refresh(job)
+        return job
+
+
+    async def complete_job(
+        self,
+        job_id: int,
+        dish_id: int,
+        result: str,
+        probability: float = None,
+        top_k: list = None,
+    ):
+        job = await self.get_prediction_by_id(job_id)
+        job.dish_id = dish_id
+        job.result = result
+        job.probability = probability
+        job.top_k = top_k
+        job.status = STATUS_DONE
+        job.error = None
+        job.finished_at = datetime.now(timezone.utc)
+        await self.db.commit()
+        return job
+
+
+    async def fail_job(self, job_id: int, error: str, max_attempts: int):
+        """
+        Возвращает задание в очередь или, если попытки исчерпаны,
+        помечает его как завершившееся ошибкой
+        """
+        job = await self.get_prediction_by_id(job_id)
+        job.error = error
+        if job.attempts >= max_attempts:
+            job.status = STATUS_FAILED
+            job.finished_at = datetime.now(timezone.utc)
+        else:
+            job.status = STATUS_PENDING
+        await self.db.commit()
+        return job
+
+
+    async def count_pending(self) -> int:
+        return await self.db.scalar(
+            select(func.count(Prediction.id))
+            .where(Prediction.status.in_((STATUS_PENDING, STATUS_PROCESSING)))
+        )
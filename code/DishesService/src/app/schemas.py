@@ -1,13 +1,70 @@
 from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional
+
+class ClassProbability(BaseModel):
+    class_name: str
+    probability: float
+
+class NNPrediction(BaseModel):
+    """Ответ NNService на запрос предсказания"""
+    predicted_class: str
+    probability: Optional[float] = None
+    top_k: List[ClassProbability] = []
+    model_version: Optional[str] = None
+
+class NNBatchItem(BaseModel):
+    """Результат NNService для одного изображения пакета"""
+    prediction: Optional[NNPrediction] = None
+    error: Optional[str] = None
 
 class GetPredictionInfo(BaseModel):
     prediction_name: str
-    dish_name: str
-    calories: int
-    protein: float
-    fat: float
-    carbs: float
+    # pending, processing, done или failed; данные блюда есть только у done
+    status: str = "done"
+    error: Optional[str] = None
+    dish_name: Optional[str] = None
+    calories: Optional[int] = None
+    protein: Optional[float] = None
+    fat: Optional[float] = None
+    carbs: Optional[float] = None
+    probability: Optional[float] = None
+    alternatives: List[ClassProbability] = []
     
 class GetStatus(BaseModel):
     status: str
     id: int
+
+class GetItemStatus(BaseModel):
+    """Результат загрузки одного изображения пакета"""
+    index: int
+    filename: Optional[str] = None
+    status: str
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+class GetBatchStatus(BaseModel):
+    items: List[GetItemStatus]
+
+class GetCatalogStatus(BaseModel):
+    dishes: int
+    loaded_at: float
+    # Процесс, в котором справочник обновлён сразу; остальные воркеры
+    # перечитывают его в течение CATALOG_REFRESH_SECONDS
+    pid: int
+
+class PredictionHistoryItem(BaseModel):
+    id: int
+    prediction_name: str
+    status: str
+    result: Optional[str] = None
+    dish_id: Optional[int] = None
+    dish_name: Optional[str] = None
+    probability: Optional[float] = None
+    image_id: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+class GetPredictionPage(BaseModel):
+    items: List[PredictionHistoryItem]
+    # Передаётся в cursor для следующей страницы; None – страниц больше нет
+    next_cursor: Optional[int] = None
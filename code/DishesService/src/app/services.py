@@ -1,92 +1,606 @@
-import httpx
 from fastapi import Depends, UploadFile
+from starlette.concurrency import run_in_threadpool
 from app.repositories import DishRepository, PredictionRepository
-from app.database_postgres import get_db
-from sqlalchemy.orm import Session
-from typing import Dict, Any
-from app.database_mongo import save_image_to_mongo
+from app.database_postgres import get_db, SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, Any, Optional
+from app.database_mongo import (
+    GRIDFS_CHUNK_SIZE,
+    ImageTooLargeError,
+    save_image_stream_to_mongo,
+    save_image_to_mongo,
+    save_images_to_mongo,
+)
+from app.cache import TTLCache
+from app.ingestion import INGEST_KEEP_ORIGINAL, NormalizedImage, normalize_image
+from app.schemas import (
+    ClassProbability,
+    NNPrediction,
+    NNBatchItem,
+    GetPredictionInfo,
+    GetPredictionPage,
+    PredictionHistoryItem,
+)
+from app.models import STATUS_DONE, STATUS_FAILED
+from app.nn_client import NeuralNetworkClient, get_nn_client, nn_client
+from app.catalog import CatalogDish, DishCatalog, get_catalog
+from app.instrumentation import span
+from typing import AsyncIterator, List
+from datetime import datetime
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+
+# Максимальный размер одного загружаемого изображения в байтах, 0 – без ограничения
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+
+# Сколько наиболее вероятных классов запрашивать у NNService и хранить в предсказании
+PREDICTION_TOP_K = int(os.environ.get("PREDICTION_TOP_K", "5"))
+
+# Как часто сверять версию модели с /nn/ready NNService, с: после горячей
+# замены модели кэш предсказаний старой версии перестаёт использоваться не позже
+NN_VERSION_CHECK_SECONDS = float(os.environ.get("NN_VERSION_CHECK_SECONDS", "5"))
+
+# Кэш предсказаний: (SHA-256 изображения, версия модели) -> ответ NNService
+prediction_cache: TTLCache[NNPrediction] = TTLCache(
+    "prediction",
+    max_size=int(os.environ.get("PREDICTION_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.environ.get("PREDICTION_CACHE_TTL_SECONDS", "3600")),
+)
+
+# Поля выгрузки истории предсказаний (порядок колонок CSV)
+EXPORT_FIELDS = list(PredictionHistoryItem.model_fields)
+# Сколько строк читается из БД и отправляется клиенту за раз при выгрузке
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+
+# Кэш ответов /predict/{id}: выполненные и неудачные предсказания больше не меняются
+prediction_info_cache: TTLCache[GetPredictionInfo] = TTLCache(
+    "prediction_info",
+    max_size=int(os.environ.get("PREDICTION_INFO_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.environ.get("PREDICTION_INFO_CACHE_TTL_SECONDS", "600")),
+)
+
 
 class ImageService:
     def __init__(self):
         pass
 
 
-    async def save_image_to_mongo(self, file: UploadFile):
+    @staticmethod
+    async def iter_upload(file: UploadFile, max_size: int = MAX_IMAGE_BYTES) -> AsyncIterator[bytes]:
+        """
+        Читает загруженный файл блоками размера чанка GridFS
+
+        :param file: Загруженный файл
+        :param max_size: Максимальный размер файла в байтах, 0 – без ограничения
+        :return: Асинхронный итератор блоков файла
+        :raises ImageTooLargeError: Если файл больше max_size
+        """
+        if max_size and file.size is not None and file.size > max_size:
+            raise ImageTooLargeError(max_size)
+        size = 0
+        while True:
+            chunk = await file.read(GRIDFS_CHUNK_SIZE)
+            if not chunk:
+                return
+            size += len(chunk)
+            if max_size and size > max_size:
+                raise ImageTooLargeError(max_size)
+            yield chunk
+
+
+    async def read_upload(self, file: UploadFile, max_size: int = MAX_IMAGE_BYTES) -> bytes:
+        """
+        Читает загруженный файл целиком (для отправки в нейросеть), прерывая
+        чтение, как только превышен допустимый размер
+
+        :param file: Загруженный файл
+        :param max_size: Максимальный размер файла в байтах, 0 – без ограничения
+        :return: Двоичные данные изображения
+        :raises ImageTooLargeError: Если файл больше max_size
+        """
+        return b"".join([chunk async for chunk in self.iter_upload(file, max_size)])
+
+
+    async def save_upload_to_mongo(self, file: UploadFile, max_size: int = MAX_IMAGE_BYTES) -> str:
+        """
+        Сохраняет загруженный файл в GridFS потоком, не собирая его в памяти
+
+        :param file: Загруженный файл
+        :param max_size: Максимальный размер файла в байтах, 0 – без ограничения
+        :return: ID сохранённого изображения в MongoDB
+        :raises ImageTooLargeError: Если файл больше max_size
+        """
+        return await save_image_stream_to_mongo(
+            self.iter_upload(file, max_size=0), max_size=max_size, filename=file.filename
+        )
+
+
+    async def normalize_upload(self, file: UploadFile, max_size: int = MAX_IMAGE_BYTES) -> NormalizedImage:
+        """
+        Готовит загруженное изображение к хранению и инференсу: поворот по
+        EXIF, уменьшение и перекодирование в JPEG. Декодирование идёт в пуле
+        потоков прямо из временного файла загрузки, без копии исходных байт
+
+        :param file: Загруженный файл
+        :param max_size: Максимальный размер исходного файла в байтах, 0 – без ограничения
+        :return: Нормализованное изображение
+        :raises ImageTooLargeError: Если файл больше max_size
+        :raises InvalidImageError: Если файл не является изображением
+        """
+        if file.size is None:
+            image_data = await self.read_upload(file, max_size)
+            with span("normalize"):
+                return await run_in_threadpool(normalize_image, image_data)
+        if max_size and file.size > max_size:
+            raise ImageTooLargeError(max_size)
+        with span("normalize"):
+            return await run_in_threadpool(normalize_image, file.file)
+
+
+    async def store_upload(self, file: UploadFile, image: NormalizedImage, image_hash: str) -> str:
+        """
+        Сохраняет нормализованное изображение в GridFS, а при
+        INGEST_KEEP_ORIGINAL – и исходный файл (потоком, поле original_id)
+
+        :param file: Загруженный файл
+        :param image: Нормализованное изображение
+        :param image_hash: SHA-256 нормализованного изображения
+        :return: ID сохранённого нормализованного изображения в MongoDB
+        """
+        with span("mongo_save"):
+            fields = None
+            if INGEST_KEEP_ORIGINAL and not image.unchanged:
+                await file.seek(0)
+                fields = {"original_id": await self.save_upload_to_mongo(file)}
+            return await save_image_to_mongo(image.data, image_hash, fields)
+
+
+    async def store_uploads(
+        self, files: List[UploadFile], images: List[NormalizedImage], image_hashes: List[str]
+    ) -> List[str]:
+        """
+        Сохраняет пакет нормализованных изображений (см. store_upload)
+
+        :param files: Загруженные файлы
+        :param images: Нормализованные изображения в том же порядке
+        :param image_hashes: SHA-256 нормализованных изображений
+        :return: ID сохранённых изображений в MongoDB в том же порядке
         """
-        Загружает изображение из запроса и сохраняет его в MongoDB
+        if INGEST_KEEP_ORIGINAL:
+            return list(await asyncio.gather(
+                *(self.store_upload(*args) for args in zip(files, images, image_hashes))
+            ))
+        with span("mongo_save"):
+            return await save_images_to_mongo([image.data for image in images], image_hashes)
+
+
+    @staticmethod
+    def get_image_hash(image_data: bytes) -> str:
+        """
+        Вычисляет хэш содержимого изображения
         
-        :param file: Загруженный файл изображения
-        :return: ID сохраненного изображения в MongoDB
+        :param image_data: Двоичные данные изображения
+        :return: SHA-256 в шестнадцатеричном виде
         """
+        return hashlib.sha256(image_data).hexdigest()
+
+
+    async def save_image_to_mongo(self, image_data: bytes, image_hash: Optional[str] = None):
+        """
+        Сохраняет изображение в MongoDB. Повторная загрузка того же
+        изображения не создаёт новый документ
         
-        # Чтение содержимого файла
-        image_data = await file.read()
+        :param image_data: Двоичные данные изображения
+        :param image_hash: SHA-256 содержимого изображения
+        :return: ID сохраненного изображения в MongoDB
+        """
         
-        # Сохранение в MongoDB и получение ID
-        image_id = save_image_to_mongo(image_data)
+        # Асинхронный драйвер: сохранение не блокирует event loop
+        # и выполняется параллельно с запросом к нейросети
+        image_id = await save_image_to_mongo(image_data, image_hash)
         
         return image_id
 
 
+    async def save_images_to_mongo(self, images: List[bytes], image_hashes: List[str]) -> List[str]:
+        """
+        Сохраняет несколько изображений в MongoDB одной операцией
+        
+        :param images: Двоичные данные изображений
+        :param image_hashes: SHA-256 содержимого изображений
+        :return: ID сохраненных изображений в MongoDB в том же порядке
+        """
+        return await save_images_to_mongo(images, image_hashes)
+
+
 class DishService:
-    def __init__(self, db: Session = Depends(get_db)):
+    """
+    Блюда читаются из справочника процесса (app.catalog) без обращения
+    к БД; в PostgreSQL идут только выборки списком
+    """
+
+    def __init__(self, db: AsyncSession = Depends(get_db), catalog: DishCatalog = Depends(get_catalog)):
         self.repo = DishRepository(db)
+        self.catalog = catalog
+
+
+    async def get_all_dishes(self, after_id: int = 0, limit: int = 100):
+        return await self.repo.get_all_dishes(after_id=after_id, limit=limit)
 
 
-    def get_all_dishes(self, skip: int = 0, limit: int = 100):
-        return self.repo.get_all_dishes(skip=skip, limit=limit)
+    def get_dish_by_name(self, dish_name: str) -> Optional[CatalogDish]:
+        with span("dish_lookup"):
+            return self.catalog.get_by_name(dish_name)
 
 
-    def get_dish_by_name(self, dish_name: str):
-        return self.repo.get_dish_by_name(dish_name=dish_name)
+    def get_dish_by_id(self, dish_id: int) -> Optional[CatalogDish]:
+        return self.catalog.get_by_id(dish_id)
 
 
-    def get_dish_by_id(self, dish_id: int):
-        return self.repo.get_dish_by_id(dish_id=dish_id)
+    def get_dishes_by_names(self, dish_names: List[str]) -> Dict[str, CatalogDish]:
+        """
+        Находит блюда по названиям
+
+        :param dish_names: Названия блюд
+        :return: Словарь название -> блюдо (ненайденных названий в нём нет)
+        """
+        with span("dish_lookup"):
+            return {name: self.catalog.by_name[name] for name in dish_names if name in self.catalog.by_name}
 
 
 class NeuralNetworkService:
     """Сервис для взаимодействия с внешним API микросервиса NNService"""
     
-    def __init__(self):
-        # URL сервиса нейросети
-        # self.nn_service_url = "http://localhost:8000/nn/predict"
-        self.nn_service_url = "http://caloriecam-nn-service:8000/nn/predict"
-        
+    # Последняя версия модели, о которой сообщил NNService (ответ или /nn/ready)
+    model_version: Optional[str] = None
+
+    def __init__(self, client: NeuralNetworkClient = Depends(get_nn_client)):
+        # Общий для приложения клиент с пулом соединений; URL сервиса
+        # нейросети задаётся переменной NEURAL_NETWORK_SERVICE_URL
+        self.client = client
+        self.nn_service_url = client.predict_url
+
     
-    async def classify_image(self, image_id: str) -> str:        
+    async def classify_image_bytes(self, image_data: bytes, image_hash: Optional[str] = None) -> NNPrediction:
+        """
+        Классифицирует изображение, передавая его байты в NNService напрямую,
+        без промежуточного чтения из MongoDB
+
+        :param image_data: Двоичные данные изображения
+        :param image_hash: SHA-256 содержимого изображения (ключ кэша)
+        :return: Предсказание NNService
+        """
+        cached = self._get_cached(image_hash)
+        if cached is not None:
+            return cached
+
+        # Предсказание не имеет побочных эффектов, поэтому запрос можно повторять
+        response = await self.client.request(
+            "POST",
+            self.nn_service_url,
+            idempotent=True,
+            params={"k": PREDICTION_TOP_K},
+            content=image_data,
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        return self._remember(NNPrediction(**response.json()), image_hash)
+
+
+    async def classify_images_bytes(self, images: List[bytes], image_hashes: List[str]) -> List[NNBatchItem]:
+        """
+        Классифицирует несколько изображений одним запросом к NNService.
+        Изображения, предсказания для которых есть в кэше, не отправляются
+
+        :param images: Двоичные данные изображений
+        :param image_hashes: SHA-256 содержимого изображений
+        :return: Предсказание или текст ошибки для каждого изображения
+        """
+        results: List[Optional[NNBatchItem]] = []
+        misses: List[int] = []
+        version = NeuralNetworkService.model_version
+        for i, image_hash in enumerate(image_hashes):
+            cached = prediction_cache.get((image_hash, version)) if version is not None else None
+            results.append(NNBatchItem(prediction=cached) if cached is not None else None)
+            if cached is None:
+                misses.append(i)
+
+        if misses:
+            response = await self.client.request(
+                "POST",
+                f"{self.nn_service_url}/batch",
+                idempotent=True,
+                params={"k": PREDICTION_TOP_K},
+                files=[("files", (f"{i}", images[i], "application/octet-stream")) for i in misses],
+            )
+            for i, item in zip(misses, response.json()):
+                item = NNBatchItem(**item)
+                if item.prediction is not None:
+                    self._remember(item.prediction, image_hashes[i])
+                results[i] = item
+
+        return results
+
+
+    async def classify_image(self, image_id: str, image_hash: Optional[str] = None) -> NNPrediction:
+        """
+        Классифицирует изображение, уже сохранённое в MongoDB, по его ID
+        (используется для повторной обработки)
+
+        :param image_id: ID изображения в MongoDB
+        :param image_hash: SHA-256 содержимого изображения (ключ кэша)
+        :return: Предсказание NNService
+        """
+        cached = self._get_cached(image_hash)
+        if cached is not None:
+            return cached
+
         # Отправляем запрос в сервис нейросети
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f'{self.nn_service_url}/{image_id}', timeout=60)
-            
-            # Проверяем успешность запроса
-            response.raise_for_status()
-            
-            # Получаем результат
-            result_data = response.json()
-            
-            # Возвращаем название класса блюда
-            return result_data.get("predicted_class")
+        response = await self.client.request(
+            "GET",
+            f'{self.nn_service_url}/{image_id}',
+            idempotent=True,
+            params={"k": PREDICTION_TOP_K},
+        )
+
+        # Возвращаем класс блюда и наиболее вероятные альтернативы
+        return self._remember(NNPrediction(**response.json()), image_hash)
+
+
+    @staticmethod
+    def _get_cached(image_hash: Optional[str]) -> Optional[NNPrediction]:
+        # Повторное изображение для той же версии модели не отправляем на инференс
+        version = NeuralNetworkService.model_version
+        if image_hash is None or version is None:
+            return None
+        return prediction_cache.get((image_hash, version))
+
+
+    @staticmethod
+    def _remember(prediction: NNPrediction, image_hash: Optional[str]) -> NNPrediction:
+        NeuralNetworkService.model_version = prediction.model_version
+        if image_hash is not None:
+            prediction_cache.set((image_hash, prediction.model_version), prediction)
+        return prediction
+
+
+class ModelVersionWatcher:
+    """
+    Фоновая сверка версии модели NNService с /nn/ready раз в
+    NN_VERSION_CHECK_SECONDS. Попадания в кэш предсказаний не обращаются к
+    NNService, поэтому иначе о горячей замене модели сервис узнал бы только
+    после промаха. Запросы на пути обработки загрузок версию не ждут
+    """
+
+    def __init__(self, client: NeuralNetworkClient = nn_client, interval: float = NN_VERSION_CHECK_SECONDS) -> None:
+        """
+        :param client: Клиент NNService
+        :param interval: Период сверки в секундах
+        """
+        self.client: NeuralNetworkClient = client
+        self.interval: float = interval
+        self.ready_url: str = client.predict_url.rsplit("/", 1)[0] + "/ready"
+        self._task: Optional[asyncio.Task] = None
+
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+    async def refresh(self) -> None:
+        """
+        Сверяет версию с /nn/ready. Если NNService не ответил, остаётся
+        последняя известная версия
+        """
+        try:
+            response = await self.client.probe("GET", self.ready_url)
+            versions = {model["version"] for model in response.json()["models"].values()}
+        except Exception as e:
+            print(f"[WARNING] Не удалось узнать версию модели NNService: {e}")
+            return
+        # NNService обслуживает предсказания одной моделью
+        NeuralNetworkService.model_version = versions.pop() if len(versions) == 1 else None
+
+
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+
+model_version_watcher = ModelVersionWatcher()
 
 
 class PredictionService:
-    def __init__(self, db: Session = Depends(get_db)):
+    def __init__(self, db: AsyncSession = Depends(get_db)):
         self.repo = PredictionRepository(db)
-        self.dish_service = DishService(db)
 
 
-    def get_all_predictions(self, skip: int = 0, limit: int = 5):
-        return self.repo.get_all_predictions(skip=skip, limit=limit)
+    async def get_all_predictions(self, after_id: int = 0, limit: int = 5):
+        return await self.repo.get_all_predictions(after_id=after_id, limit=limit)
+
+
+    async def get_prediction_by_id(self, prediction_id: int):
+        return await self.repo.get_prediction_by_id(prediction_id=prediction_id)
+
 
+    async def get_prediction_info(self, prediction_id: int) -> Optional[GetPredictionInfo]:
+        """
+        Информация о предсказании с данными блюда (один запрос к БД,
+        завершённые предсказания отдаются из кэша)
 
-    def get_prediction_by_id(self, prediction_id: int):
-        return self.repo.get_prediction_by_id(prediction_id=prediction_id)
+        :param prediction_id: ID предсказания
+        :return: Информация о предсказании или None, если его нет
+        """
+        cached = prediction_info_cache.get(prediction_id)
+        if cached is not None:
+            return cached
 
+        row = await self.repo.get_prediction_info(prediction_id)
+        if row is None:
+            return None
 
-    def save_prediction(self, dish_id: int, prediction_name: str, result: str, image_id: str = None):
-        return self.repo.create_prediction(
-            dish_id=dish_id,
-            prediction_name=prediction_name,
-            result=result,
-            image_id=image_id
+        info = GetPredictionInfo(
+            prediction_name=row.prediction_name,
+            status=row.status,
+            error=row.error,
+            dish_name=row.dish_name,
+            calories=row.calories,
+            protein=row.protein,
+            fat=row.fat,
+            carbs=row.carbs,
+            probability=row.probability,
+            alternatives=self.unpack_top_k(row.top_k)[1:],
         )
+        if row.status in (STATUS_DONE, STATUS_FAILED):
+            prediction_info_cache.set(prediction_id, info)
+        return info
+
+
+    async def get_history(
+        self,
+        cursor: Optional[int] = None,
+        limit: int = 50,
+        descending: bool = True,
+        dish_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> GetPredictionPage:
+        """
+        Страница истории предсказаний. Названия блюд берутся из справочника
+
+        :param cursor: next_cursor предыдущей страницы
+        :param limit: Размер страницы
+        :param descending: Сначала новые
+        :param dish_id: Фильтр по блюду
+        :param since: Начало интервала времени создания (включительно)
+        :param until: Конец интервала времени создания (не включительно)
+        :return: Страница и курсор следующей страницы
+        """
+        rows = await self.repo.get_predictions_page(cursor, limit, descending, dish_id, since, until)
+        catalog = get_catalog()
+        items = [PredictionHistoryItem(**self._history_row(row, catalog)) for row in rows]
+        return GetPredictionPage(
+            items=items,
+            next_cursor=items[-1].id if len(items) == limit else None,
+        )
+
+
+    @staticmethod
+    async def export_history(
+        export_format: str,
+        dish_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Выгрузка истории предсказаний в NDJSON или CSV частями по
+        EXPORT_BATCH_SIZE строк. Генератор открывает собственную сессию:
+        он выполняется уже после выхода из обработчика запроса
+
+        :param export_format: ndjson или csv
+        :return: Части выгрузки
+        """
+        catalog = get_catalog()
+        async with SessionLocal() as db:
+            rows = PredictionRepository(db).iter_predictions(dish_id, since, until, EXPORT_BATCH_SIZE)
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS) if export_format == "csv" else None
+            if writer is not None:
+                writer.writeheader()
+
+            count = 0
+            async for row in rows:
+                count += 1
+                item = PredictionService._history_row(row, catalog)
+                if writer is not None:
+                    writer.writerow(item)
+                else:
+                    buffer.write(json.dumps(item, default=str, ensure_ascii=False))
+                    buffer.write("\n")
+                if count % EXPORT_BATCH_SIZE == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+
+            if buffer.tell():
+                yield buffer.getvalue()
+
+
+    @staticmethod
+    def _history_row(row, catalog: DishCatalog) -> Dict[str, Any]:
+        item = row._asdict()
+        dish = catalog.get_by_id(row.dish_id) if row.dish_id is not None else None
+        item["dish_name"] = dish.name if dish is not None else None
+        if row.created_at is not None:
+            item["created_at"] = row.created_at.isoformat()
+        return item
+
+
+    async def create_job(self, prediction_name: str, image_id: str):
+        """
+        Ставит в очередь задание на классификацию сохранённого изображения
+        """
+        with span("db_commit"):
+            return await self.repo.create_pending_prediction(prediction_name=prediction_name, image_id=image_id)
+
+
+    async def save_predictions(self, rows: List[Dict[str, Any]]) -> List[int]:
+        """
+        Сохраняет несколько предсказаний в одной транзакции
+
+        :param rows: Параметры save_prediction для каждого предсказания
+        :return: ID созданных предсказаний
+        """
+        with span("db_commit"):
+            return await self.repo.create_predictions([
+                {**row, "top_k": self.pack_top_k(row["top_k"]) if row.get("top_k") else None}
+                for row in rows
+            ])
+
+
+    async def save_prediction(
+        self,
+        dish_id: int,
+        prediction_name: str,
+        result: str,
+        image_id: str = None,
+        probability: float = None,
+        top_k: List[ClassProbability] = None,
+    ):
+        with span("db_commit"):
+            return await self.repo.create_prediction(
+                dish_id=dish_id,
+                prediction_name=prediction_name,
+                result=result,
+                image_id=image_id,
+                probability=probability,
+                top_k=self.pack_top_k(top_k) if top_k else None,
+            )
+
+
+    @staticmethod
+    def pack_top_k(top_k: List[ClassProbability]) -> list:
+        """
+        Компактное представление top-k для хранения: [[класс, вероятность], ...]
+        с вероятностями, округлёнными до 4 знаков
+        """
+        return [[item.class_name, round(item.probability, 4)] for item in top_k]
+
+
+    @staticmethod
+    def unpack_top_k(packed: Optional[list]) -> List[ClassProbability]:
+        return [
+            ClassProbability(class_name=class_name, probability=probability)
+            for class_name, probability in (packed or [])
+        ]
@@ -1,13 +1,49 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from app.endpoints import router
 from app.database_postgres import Base, engine
-from app.init_db import init_db
+from app.init_db import init_db, migrate_db
+from app.database_mongo import init_mongo, ImageTooLargeError
+from app.catalog import catalog_refresher, load_catalog
+from app.ingestion import InvalidImageError
 from fastapi.middleware.cors import CORSMiddleware
+from app.nn_client import nn_client, CircuitOpenError
+from app.jobs import worker_pool
+from app.services import model_version_watcher
+from app.instrumentation import InstrumentationMiddleware
+from app.profiling import ADMIN_TOKEN, ProfilingMiddleware, router as admin_router
+from prometheus_client import make_asgi_app
+from contextlib import asynccontextmanager
+import httpx
 
-app = FastAPI(title="DishesService")
 
-Base.metadata.create_all(bind=engine)
-init_db()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(migrate_db)
+    await init_db()
+    await init_mongo()
+    # Справочник блюд обслуживается из памяти; в фоне он перечитывается,
+    # чтобы изменения таблицы dishes дошли до всех воркеров
+    await load_catalog()
+    await catalog_refresher.start()
+
+    # Один HTTP-клиент NNService с пулом соединений на всё время жизни приложения
+    await nn_client.start()
+    # Версия модели NNService для ключей кэша предсказаний сверяется в фоне
+    await model_version_watcher.start()
+    # Воркеры очереди заданий на классификацию (режим mode=async)
+    await worker_pool.start()
+    yield
+    await worker_pool.stop()
+    await model_version_watcher.stop()
+    await catalog_refresher.stop()
+    await nn_client.close()
+    await engine.dispose()
+
+
+app = FastAPI(title="DishesService", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,6 +51,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id", "Server-Timing", "X-Profile-Id"],
 )
 
 # # Updated CORS configuration
@@ -28,7 +65,44 @@ app.add_middleware(
 #     max_age=600,  # Cache preflight requests for 10 minutes
 # )
 
+# Профилирование отдельных запросов (X-Profile); без ADMIN_TOKEN не подключается
+# вовсе и ничего не стоит. Добавляется до InstrumentationMiddleware, чтобы
+# профиль сохранялся под идентификатором трассировки запроса
+if ADMIN_TOKEN:
+    app.add_middleware(ProfilingMiddleware)
+
+# Счётчики и длительность запросов, X-Trace-Id и разбивка по этапам (Server-Timing)
+app.add_middleware(InstrumentationMiddleware)
+
 app.include_router(router=router, prefix='/dish')
+app.include_router(router=admin_router, prefix='/admin')
+app.mount('/metrics', make_asgi_app())
+
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    # NNService перегружен: отвечаем сразу, не накапливая зависшие запросы
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(exc.retry_after))},
+    )
+
+
+@app.exception_handler(httpx.HTTPError)
+async def nn_service_error_handler(request: Request, exc: httpx.HTTPError):
+    return JSONResponse(status_code=502, content={"detail": f"Neural network service error: {exc}"})
+
+
+@app.exception_handler(ImageTooLargeError)
+async def image_too_large_handler(request: Request, exc: ImageTooLargeError):
+    return JSONResponse(status_code=413, content={"detail": str(exc)})
+
+
+@app.exception_handler(InvalidImageError)
+async def invalid_image_handler(request: Request, exc: InvalidImageError):
+    return JSONResponse(status_code=422, content={"detail": str(exc)})
+
 
 @app.get('/')
 def get_root():
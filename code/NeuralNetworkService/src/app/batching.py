@@ -0,0 +1,217 @@
+from prometheus_client import Histogram
+from typing import List, Optional, Set, Tuple
+import asyncio
+import os
+import time
+
+import numpy as np
+
+from app.model_registry import registry
+from app.executor import inference_executor
+
+MAX_BATCH_SIZE = int(os.environ.get("NN_MAX_BATCH_SIZE", "16"))
+MAX_BATCH_WAIT_MS = float(os.environ.get("NN_MAX_BATCH_WAIT_MS", "5"))
+# Сколько наиболее вероятных классов вычисляется для каждого изображения
+TOP_K = int(os.environ.get("NN_TOP_K", "5"))
+
+BATCH_SIZE = Histogram(
+    "nn_batch_size",
+    "Количество изображений в одном прогоне модели",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+BATCH_QUEUE_WAIT = Histogram(
+    "nn_batch_queue_wait_seconds",
+    "Время ожидания запроса в очереди до начала прогона модели",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+BATCH_INFERENCE = Histogram(
+    "nn_batch_inference_seconds",
+    "Длительность одного батчевого прогона модели",
+)
+
+
+class _PendingItem:
+    __slots__ = ("tensor", "future", "enqueued_at")
+
+    def __init__(self, tensor: np.ndarray, future: asyncio.Future) -> None:
+        self.tensor: np.ndarray = tensor
+        self.future: asyncio.Future = future
+        self.enqueued_at: float = time.perf_counter()
+
+
+class BatchScheduler:
+    """
+    Планировщик динамических микробатчей: собирает конкурентные запросы
+    до max_batch_size изображений или до истечения max_wait_ms с момента
+    прихода первого из них, выполняет один батчевый прогон модели и
+    возвращает каждому вызывающему его top-k классов. Одновременно
+    выполняется до max_concurrent_batches батчей (по числу потоков пула
+    инференса): следующий батч собирается, пока идут текущие прогоны.
+    Тензоры батча копируются в заранее выделенные буферы, по одному на
+    одновременный прогон, а батч из одного изображения не копируется вовсе.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = MAX_BATCH_WAIT_MS,
+        top_k: int = TOP_K,
+        max_concurrent_batches: Optional[int] = None,
+    ) -> None:
+        """
+        :param max_batch_size: Максимальный размер батча
+        :param max_wait_ms: Максимальное ожидание добора батча в миллисекундах
+        :param top_k: Количество наиболее вероятных классов в результате
+        :param max_concurrent_batches: Одновременные прогоны (по умолчанию – потоки пула инференса)
+        """
+        self.max_batch_size: int = max(1, max_batch_size)
+        self.top_k: int = max(1, top_k)
+        self.max_wait: float = max(0.0, max_wait_ms) / 1000
+        self.max_concurrent_batches: int = max(1, max_concurrent_batches or inference_executor.max_workers)
+        self._pending: List[_PendingItem] = []
+        self._has_items: Optional[asyncio.Event] = None
+        self._batch_full: Optional[asyncio.Event] = None
+        self._batch_slots: Optional[asyncio.Semaphore] = None
+        self._batches: Set[asyncio.Task] = set()
+        # Свободные буферы формы (max_batch_size, H, W, 3)
+        self._free_buffers: List[np.ndarray] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """
+        Запускает фоновый цикл формирования батчей в текущем event loop.
+        """
+        self._has_items = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._batch_slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Останавливает фоновый цикл и дожидается начатых прогонов;
+        ожидающие в очереди запросы получают ошибку.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+        for item in self._pending:
+            if not item.future.done():
+                item.future.set_exception(RuntimeError("Batch scheduler stopped"))
+        self._pending.clear()
+
+    async def submit(self, tensor: np.ndarray) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        Ставит одно предобработанное изображение в очередь и ждёт результата.
+
+        :param tensor: Тензор изображения формы (H, W, 3)
+        :return: Индексы и вероятности top-k классов по убыванию вероятности
+            и эмбеддинг изображения (None, если модель его не отдаёт)
+        """
+        if self._task is None:
+            raise RuntimeError("Batch scheduler is not started")
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_PendingItem(tensor, future))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._batch_full.set()
+        return await future
+
+    async def _run(self) -> None:
+        while True:
+            # Пока все потоки инференса заняты, запросы копятся в очереди
+            # и попадут в следующий, более полный батч
+            await self._batch_slots.acquire()
+            await self._has_items.wait()
+            if len(self._pending) < self.max_batch_size and self.max_wait > 0:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            items = self._pending[: self.max_batch_size]
+            del self._pending[: self.max_batch_size]
+            if len(self._pending) < self.max_batch_size:
+                self._batch_full.clear()
+            if not self._pending:
+                self._has_items.clear()
+
+            # Запросы, клиенты которых уже отключились, в батч не попадают
+            items = [item for item in items if not item.future.done()]
+            if not items:
+                self._batch_slots.release()
+                continue
+            task = asyncio.create_task(self._process(items))
+            self._batches.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task: asyncio.Task) -> None:
+        self._batches.discard(task)
+        self._batch_slots.release()
+
+    async def _process(self, items: List[_PendingItem]) -> None:
+        started = time.perf_counter()
+        for item in items:
+            BATCH_QUEUE_WAIT.observe(started - item.enqueued_at)
+        BATCH_SIZE.observe(len(items))
+
+        batch, buffer = self._batch_array(items)
+        try:
+            engine = registry.get()
+            with BATCH_INFERENCE.time():
+                indices, probabilities, embeddings = await inference_executor.run(
+                    engine.predict_top_k_with_embeddings, batch, self.top_k
+                )
+        except Exception as e:
+            self._release(buffer)
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        # Буфер возвращается только после завершения прогона, не при отмене
+        # задачи: поток инференса может ещё читать его
+        self._release(buffer)
+
+        for i, item in enumerate(items):
+            if not item.future.done():
+                embedding = embeddings[i] if embeddings is not None else None
+                item.future.set_result((indices[i], probabilities[i], embedding))
+
+
+    def _batch_array(self, items: List[_PendingItem]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        :return: Батч тензоров и буфер, в котором он лежит (None – буфер не нужен)
+        """
+        first = items[0].tensor
+        if len(items) == 1:
+            # Тензор изображения – строка батча декодирования, отдельная копия не нужна
+            return first[np.newaxis], None
+        buffer = self._free_buffers.pop() if self._free_buffers else None
+        if buffer is None or buffer.shape[1:] != first.shape or buffer.dtype != first.dtype:
+            # Первый прогон или новая модель с другим входом
+            buffer = np.empty((self.max_batch_size, *first.shape), dtype=first.dtype)
+        batch = buffer[: len(items)]
+        for row, item in zip(batch, items):
+            np.copyto(row, item.tensor)
+        return batch, buffer
+
+
+    def _release(self, buffer: Optional[np.ndarray]) -> None:
+        if buffer is not None:
+            self._free_buffers.append(buffer)
+
+
+scheduler = BatchScheduler()
+
+
+def get_scheduler() -> BatchScheduler:
+    """
+    Зависимость FastAPI: общий для процесса планировщик батчей.
+    """
+    return scheduler
@@ -0,0 +1,67 @@
+from collections import OrderedDict
+from prometheus_client import Counter
+from typing import Generic, Hashable, Optional, Tuple, TypeVar
+import threading
+import time
+
+V = TypeVar("V")
+
+CACHE_HITS = Counter("nn_cache_hits_total", "Попадания в кэш", ["cache"])
+CACHE_MISSES = Counter("nn_cache_misses_total", "Промахи кэша", ["cache"])
+
+
+class TTLCache(Generic[V]):
+    """
+    Ограниченный по размеру LRU-кэш с временем жизни записей.
+    Потокобезопасен: используется как из event loop, так и из пула потоков.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl_seconds: float) -> None:
+        """
+        :param name: Имя кэша (метка в метриках попаданий и промахов)
+        :param max_size: Максимальное количество записей, 0 – кэш выключен
+        :param ttl_seconds: Время жизни записи в секундах
+        """
+        self.name: str = name
+        self.max_size: int = max_size
+        self.ttl: float = ttl_seconds
+        self._data: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """
+        Возвращает значение по ключу или None, если его нет или оно устарело.
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > now:
+                self._data.move_to_end(key)
+                CACHE_HITS.labels(cache=self.name).inc()
+                return item[1]
+            if item is not None:
+                del self._data[key]
+        CACHE_MISSES.labels(cache=self.name).inc()
+        return None
+
+    def peek(self, key: Hashable) -> Optional[V]:
+        """
+        Возвращает значение как get, но не считает попадание или промах и
+        не меняет порядок вытеснения.
+        """
+        item = self._data.get(key)
+        if item is not None and item[0] > time.monotonic():
+            return item[1]
+        return None
+
+    def set(self, key: Hashable, value: V) -> None:
+        """
+        Сохраняет значение, вытесняя самые давно использованные записи.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
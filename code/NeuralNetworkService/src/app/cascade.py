@@ -0,0 +1,253 @@
+"""
+Двухступенчатый каскад инференса: облегчённая модель отвечает первой,
+ResNet50 запускается только для изображений, в которых она не уверена.
+
+Подбор порога на отложенной выборке (каталог вида <класс>/<изображение>):
+    python -m app.cascade tune --images-dir data/holdout --light-weights resources/mobilenet_v3.weights.h5
+"""
+from prometheus_client import Counter, Histogram
+from typing import Dict, List, Optional, Sequence, Tuple
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from app.neural_network import Config, NeuralNetwork
+
+STAGE_LIGHT = "light"
+STAGE_FULL = "full"
+
+CASCADE_ANSWERS = Counter(
+    "nn_cascade_answers_total",
+    "Количество изображений, ответ для которых дала ступень каскада",
+    ["stage"],
+)
+CASCADE_STAGE_SECONDS = Histogram(
+    "nn_cascade_stage_seconds",
+    "Длительность прогона батча на ступени каскада",
+    ["stage"],
+)
+
+
+class CascadeNeuralNetwork:
+    """
+    Каскад из облегчённой модели (MobileNetV3) и полной ResNet50 с общим
+    Config и списком классов. Повторяет интерфейс NeuralNetwork, которым
+    пользуются сервис и планировщик батчей; «предобработанный» тензор
+    каскада – это декодированные пиксели, каждая ступень готовит вход сама.
+    """
+
+    def __init__(
+        self,
+        path_to_weights: str,
+        path_to_light_weights: str,
+        threshold: float = 0.8,
+        backend: str = "keras",
+        light_backend: str = "keras",
+        **kwargs,
+    ) -> None:
+        """
+        :param path_to_weights: Веса (или артефакт) полной модели ResNet50
+        :param path_to_light_weights: Веса (или артефакт) облегчённой модели
+        :param threshold: Порог вероятности top-1, ниже которого запрос уходит в ResNet50
+        :param backend: Бэкенд инференса полной модели
+        :param light_backend: Бэкенд инференса облегчённой модели
+        :param kwargs: Остальные параметры NeuralNetwork, общие для обеих ступеней
+        """
+        self.light: NeuralNetwork = NeuralNetwork(
+            path_to_weights=path_to_light_weights,
+            backend=light_backend,
+            architecture="mobilenet_v3",
+            **kwargs,
+        )
+        self.full: NeuralNetwork = NeuralNetwork(
+            path_to_weights=path_to_weights,
+            backend=backend,
+            architecture="resnet50",
+            **kwargs,
+        )
+        if self.light.class_names != self.full.class_names:
+            raise ValueError("Ступени каскада должны использовать один список классов")
+
+        self.threshold: float = threshold
+        # Вход каскада – декодированные пиксели без предобработки (см. выше)
+        self.architecture: str = "cascade"
+        self.conf: Config = self.full.conf
+        self.class_names: List[str] = self.full.class_names
+        self.version: str = "unversioned"
+
+    def load_and_preprocess_bytes(self, image_data: bytes) -> np.ndarray:
+        return self.full.decode_batch([image_data])
+
+    def load_and_preprocess_batch(self, buffers: Sequence[bytes]) -> np.ndarray:
+        return self.full.decode_batch(buffers)
+
+    def load_and_preprocess_many(self, buffers: Sequence[bytes]) -> Tuple[np.ndarray, List[Optional[Exception]]]:
+        return self.full.decoder.decode(buffers)
+
+    def predict_top_k(self, batch: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Прогоняет весь батч через облегчённую модель и дозапускает ResNet50
+        только на изображениях с вероятностью top-1 ниже порога.
+
+        :param batch: Декодированные пиксели RGB формы (N, H, W, 3)
+        :param k: Количество классов в результате
+        :return: Индексы и вероятности top-k формы (N, k)
+        """
+        with CASCADE_STAGE_SECONDS.labels(stage=STAGE_LIGHT).time():
+            indices, probabilities = self.light.predict_top_k(self.light.preprocess(batch), k)
+
+        escalate = probabilities[:, 0] < self.threshold
+        escalated = int(np.count_nonzero(escalate))
+        if escalated:
+            # Выборка по маске копирует строки, поэтому предобработка ResNet50
+            # на месте не затрагивает исходный батч
+            with CASCADE_STAGE_SECONDS.labels(stage=STAGE_FULL).time():
+                full_indices, full_probabilities = self.full.predict_top_k(
+                    self.full.preprocess(batch[escalate]), k
+                )
+            indices[escalate] = full_indices
+            probabilities[escalate] = full_probabilities
+
+        CASCADE_ANSWERS.labels(stage=STAGE_LIGHT).inc(len(batch) - escalated)
+        CASCADE_ANSWERS.labels(stage=STAGE_FULL).inc(escalated)
+        return indices, probabilities
+
+    def predict_top_k_with_embeddings(
+        self, batch: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        Эмбеддинги ступеней каскада лежат в разных пространствах, поэтому
+        каскад их не отдаёт и индекс похожих изображений не пополняется.
+        """
+        indices, probabilities = self.predict_top_k(batch, k)
+        return indices, probabilities, None
+
+    def warmup(self, batch_sizes: Sequence[int] = (1,)) -> None:
+        self.light.warmup(batch_sizes)
+        self.full.warmup(batch_sizes)
+
+
+def load_holdout(images_dir: str, class_names: List[str]) -> Tuple[List[str], np.ndarray]:
+    """
+    Собирает отложенную выборку из каталога вида <класс>/<изображение>.
+
+    :param images_dir: Корневой каталог выборки
+    :param class_names: Список классов модели
+    :return: Пути к изображениям и индексы их истинных классов
+    """
+    paths: List[str] = []
+    labels: List[int] = []
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(images_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        for file_name in sorted(os.listdir(class_dir)):
+            paths.append(os.path.join(class_dir, file_name))
+            labels.append(label)
+    return paths, np.asarray(labels, dtype=np.int64)
+
+
+def tune_threshold(
+    cascade: CascadeNeuralNetwork,
+    paths: List[str],
+    labels: np.ndarray,
+    thresholds: Sequence[float],
+    batch_size: int = 32,
+) -> Dict[str, object]:
+    """
+    Прогоняет отложенную выборку через обе ступени один раз и для каждого
+    порога считает точность каскада, долю ответов облегчённой модели и
+    ожидаемую задержку на изображение.
+
+    :param cascade: Каскад моделей
+    :param paths: Пути к изображениям
+    :param labels: Индексы истинных классов
+    :param thresholds: Проверяемые пороги
+    :param batch_size: Размер батча прогона
+    :return: Отчёт с точностью отдельных моделей и таблицей по порогам
+    """
+    light_top1: List[np.ndarray] = []
+    light_prob: List[np.ndarray] = []
+    full_top1: List[np.ndarray] = []
+    light_seconds = full_seconds = 0.0
+
+    for start in range(0, len(paths), batch_size):
+        buffers = []
+        for path in paths[start : start + batch_size]:
+            with open(path, "rb") as f:
+                buffers.append(f.read())
+        batch = cascade.full.decode_batch(buffers)
+
+        started = time.perf_counter()
+        indices, probabilities = cascade.light.predict_top_k(cascade.light.preprocess(batch), 1)
+        light_seconds += time.perf_counter() - started
+        light_top1.append(indices[:, 0])
+        light_prob.append(probabilities[:, 0])
+
+        started = time.perf_counter()
+        indices, _ = cascade.full.predict_top_k(cascade.full.preprocess(batch), 1)
+        full_seconds += time.perf_counter() - started
+        full_top1.append(indices[:, 0])
+
+    light_pred = np.concatenate(light_top1)
+    confidence = np.concatenate(light_prob)
+    full_pred = np.concatenate(full_top1)
+    light_ms = light_seconds / len(paths) * 1000
+    full_ms = full_seconds / len(paths) * 1000
+
+    rows = []
+    for threshold in thresholds:
+        use_light = confidence >= threshold
+        prediction = np.where(use_light, light_pred, full_pred)
+        light_share = float(np.mean(use_light))
+        rows.append(
+            {
+                "threshold": threshold,
+                "accuracy": float(np.mean(prediction == labels)),
+                "light_share": light_share,
+                "expected_latency_ms": light_ms + (1 - light_share) * full_ms,
+            }
+        )
+
+    return {
+        "images": len(paths),
+        "light_accuracy": float(np.mean(light_pred == labels)),
+        "full_accuracy": float(np.mean(full_pred == labels)),
+        "light_latency_ms": light_ms,
+        "full_latency_ms": full_ms,
+        "thresholds": rows,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Подбор порога каскада моделей")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    tune_parser = subparsers.add_parser("tune", help="Точность и задержка каскада по порогам")
+    tune_parser.add_argument("--images-dir", required=True)
+    tune_parser.add_argument("--weights", default="resources/v1.weights.h5")
+    tune_parser.add_argument("--light-weights", required=True)
+    tune_parser.add_argument("--batch-size", type=int, default=32)
+    tune_parser.add_argument(
+        "--thresholds", default="0.5,0.6,0.7,0.75,0.8,0.85,0.9,0.95"
+    )
+
+    args = parser.parse_args(argv)
+
+    cascade = CascadeNeuralNetwork(args.weights, args.light_weights)
+    paths, labels = load_holdout(args.images_dir, cascade.class_names)
+    if not paths:
+        print(f"[ERROR] В {args.images_dir} нет изображений по классам модели")
+        return 1
+
+    thresholds = [float(value) for value in args.thresholds.split(",")]
+    report = tune_threshold(cascade, paths, labels, thresholds, args.batch_size)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
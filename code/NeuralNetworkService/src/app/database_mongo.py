@@ -1,7 +1,11 @@
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from bson.objectid import ObjectId
-from typing import Optional
+from gridfs import GridFSBucket, NoFile
+from gridfs.errors import FileExists
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple
 
+import io
 import os
 
 # Получаем параметры подключения из переменных окружения
@@ -15,22 +19,104 @@ mongo_uri = f"mongodb://{mongo_user}:{mongo_password}@{mongo_host}:{mongo_port}/
 
 client = MongoClient(mongo_uri)
 db = client["caloriecam"]
+# Старый формат: изображение целиком в поле data одного документа
 images_collection = db["images"]
 
+# Изображения в GridFS (бакет общий с DishesService)
+GRIDFS_BUCKET = os.environ.get("MONGO_GRIDFS_BUCKET", "image_files")
+images_fs = GridFSBucket(db, bucket_name=GRIDFS_BUCKET)
+image_files_collection = db[f"{GRIDFS_BUCKET}.files"]
 
-def get_image_from_mongo(image_id: str) -> Optional[bytes]:
+
+def open_image_from_mongo(image_id: str) -> Optional[Tuple[BinaryIO, Optional[str]]]:
     """
-    Получает бинарные данные изображения из MongoDB по его ObjectId.
+    Открывает изображение из MongoDB по его ObjectId для потокового чтения.
+    Файл GridFS читается чанками по мере декодирования; документ старого
+    формата при первом обращении переносится в GridFS с тем же ObjectId.
 
     :param image_id: Строковый ObjectId изображения (из MongoDB)
-    :return: Бинарные данные изображения или None, если не найдено
+    :return: Файловый объект и SHA-256 содержимого (если известен) или None, если не найдено
     """
     try:
         obj_id = ObjectId(image_id)
     except Exception:
         return None
 
+    try:
+        grid_out = images_fs.open_download_stream(obj_id)
+        return grid_out, getattr(grid_out, "sha256", None)
+    except NoFile:
+        pass
+
     image = images_collection.find_one({"_id": obj_id})
-    if image and "data" in image:
-        return image["data"]
-    return None
+    if not image or "data" not in image:
+        return None
+    migrate_image_to_gridfs(obj_id, image["data"], image.get("sha256"))
+    return io.BytesIO(image["data"]), image.get("sha256")
+
+
+def get_image_hash(image_id: str) -> Optional[str]:
+    """
+    Читает SHA-256 содержимого изображения из метаданных файла GridFS,
+    не скачивая само изображение.
+
+    :param image_id: Строковый ObjectId изображения
+    :return: SHA-256 или None, если файла нет или хэш не записан
+    """
+    try:
+        obj_id = ObjectId(image_id)
+    except Exception:
+        return None
+    document = image_files_collection.find_one({"_id": obj_id}, projection={"sha256": True})
+    return document.get("sha256") if document else None
+
+
+def find_image_ids_by_hashes(hashes: Sequence[str]) -> Dict[str, List[str]]:
+    """
+    Находит ObjectId изображений GridFS по SHA-256 содержимого
+    (индекс по sha256 создаёт DishesService).
+
+    :param hashes: SHA-256 изображений
+    :return: Словарь SHA-256 -> ObjectId изображений с таким содержимым
+    """
+    ids: Dict[str, List[str]] = {}
+    cursor = image_files_collection.find({"sha256": {"$in": list(hashes)}}, projection={"sha256": True})
+    for document in cursor:
+        ids.setdefault(document["sha256"], []).append(str(document["_id"]))
+    return ids
+
+
+def migrate_image_to_gridfs(obj_id: ObjectId, image_data: bytes, image_hash: Optional[str]) -> bool:
+    """
+    Переносит изображение старого формата в GridFS с тем же ObjectId,
+    поэтому ссылки из предсказаний остаются действительными.
+
+    :param obj_id: ObjectId документа старого формата
+    :param image_data: Двоичные данные изображения
+    :param image_hash: SHA-256 содержимого изображения
+    :return: True, если изображение перенесено
+    """
+    # Если в GridFS уже есть копия с тем же хэшем, перенесённый файл хэш не
+    # получает: иначе сработал бы уникальный индекс дедупликации
+    if image_hash and image_files_collection.find_one({"sha256": image_hash}, projection={"_id": True}):
+        image_hash = None
+
+    grid_in = images_fs.open_upload_stream_with_id(obj_id, image_hash or str(obj_id))
+    if image_hash:
+        grid_in.sha256 = image_hash
+    try:
+        grid_in.write(image_data)
+        grid_in.close()
+    except (DuplicateKeyError, FileExists) as e:
+        # GridFS заворачивает ошибку вставки документа файла в FileExists
+        cause = e if isinstance(e, DuplicateKeyError) else e.__context__
+        key_pattern = (getattr(cause, "details", None) or {}).get("keyPattern") or {}
+        if "sha256" in key_pattern:
+            # Копия с тем же хэшем появилась конкурентно: убираем свои чанки
+            grid_in.abort()
+        # Иначе изображение уже переносит конкурентный запрос
+        print(f"[WARNING] Изображение {obj_id} не перенесено в GridFS: {e}")
+        return False
+
+    images_collection.delete_one({"_id": obj_id})
+    return True
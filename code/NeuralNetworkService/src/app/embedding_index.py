@@ -0,0 +1,464 @@
+"""
+Индекс эмбеддингов изображений для поиска похожих.
+
+Эмбеддинги (выход слоя Dense(256) модели) хранятся нормированными в
+float16 в файле, отображённом в память (np.memmap), поэтому миллион
+векторов занимает 512 МБ на диске и в памяти не копируется целиком.
+Ключ записи – SHA-256 содержимого изображения: тот же ключ, что у кэша
+предсказаний и у метаданных файлов GridFS, поэтому изображение находится
+и при загрузке байтами, и по ObjectId.
+
+Файлы индекса (каталог NN_EMBEDDING_INDEX_DIR):
+    vectors.f16  – матрица (ёмкость, EMBEDDING_DIM), float16
+    keys.txt     – ключ и индекс класса top-1 через пробел, по строке на запись
+    meta.json    – размерность, ёмкость и подпись модели
+    lock         – блокировка единственного процесса, пишущего в индекс
+
+Отдельно в памяти каждого процесса хранятся перцептивные отпечатки
+недавних изображений (NearDuplicateIndex): почти совпадающее изображение
+получает готовое предсказание из кэша без прогона модели.
+"""
+from prometheus_client import Counter, Gauge
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import fcntl
+import json
+import os
+import threading
+
+import numpy as np
+
+from app.neural_network import EMBEDDING_DIM
+from app.preprocessing import SKETCH_DIM
+
+# Каталог индекса; по умолчанию индекс выключен. Писать в каталог может только
+# один процесс: остальные воркеры uvicorn работают без индекса
+EMBEDDING_INDEX_DIR = os.environ.get("NN_EMBEDDING_INDEX_DIR", "")
+EMBEDDING_INDEX_CAPACITY = int(os.environ.get("NN_EMBEDDING_INDEX_CAPACITY", "65536"))
+# Строк float16, переводимых в float32 за один шаг поиска: ограничивает
+# временную память поиска (4096 × 256 × 4 байта = 4 МБ)
+SEARCH_BLOCK_ROWS = 4096
+
+# Косинусное расстояние между перцептивными отпечатками, до которого
+# изображение считается копией уже обработанного; 0 – выключено
+NEAR_DUPLICATE_EPSILON = float(os.environ.get("NN_NEAR_DUPLICATE_EPSILON", "0.02"))
+NEAR_DUPLICATE_CAPACITY = int(
+    os.environ.get("NN_NEAR_DUPLICATE_CAPACITY", os.environ.get("NN_PREDICTION_CACHE_SIZE", "10000"))
+)
+
+INDEX_SIZE = Gauge("nn_embedding_index_size", "Количество эмбеддингов в индексе")
+NEAR_DUPLICATES = Counter("nn_near_duplicates_total", "Предсказания, взятые у почти совпадающего изображения")
+
+
+class EmbeddingIndex:
+    """
+    Индекс нормированных эмбеддингов с векторным поиском по косинусной
+    близости: скалярное произведение блоками по всей матрице или только
+    по строкам одного класса. Потокобезопасен: добавление, чтение и поиск
+    выполняются под одной блокировкой, поэтому поиск не видит индекс,
+    переоткрываемый после замены весов. Между процессами каталог
+    защищён файловой блокировкой: индекс открывает только один из них.
+    """
+
+    def __init__(self, path: str, dim: int = EMBEDDING_DIM, capacity: int = EMBEDDING_INDEX_CAPACITY) -> None:
+        """
+        :param path: Каталог файлов индекса
+        :param dim: Размерность эмбеддинга
+        :param capacity: Начальная ёмкость (удваивается по мере заполнения)
+        """
+        self.path: str = path
+        self.dim: int = dim
+        self.initial_capacity: int = max(1, capacity)
+        self.signature: Optional[str] = None
+        self._vectors: Optional[np.memmap] = None
+        self._keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+        # Строки каждого класса top-1 для поиска в пределах класса
+        self._class_rows: Dict[int, List[int]] = {}
+        self._keys_file = None
+        self._lock_file = None
+        # Предупреждение о чужой блокировке выводится один раз
+        self._locked_out: bool = False
+        self._lock = threading.Lock()
+        self._bound_model: Optional[Tuple[str, str]] = None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def open(self, signature: str) -> bool:
+        """
+        Открывает индекс из каталога или создаёт пустой. Индекс, собранный
+        другой моделью (другая подпись), очищается: эмбеддинги разных весов
+        несравнимы.
+
+        :param signature: Подпись модели, эмбеддинги которой хранятся в индексе
+        :return: False, если каталог уже открыт другим процессом
+        """
+        with self._lock:
+            self._close()
+            os.makedirs(self.path, exist_ok=True)
+            if not self._acquire_writer_lock():
+                return False
+            meta = self._read_meta()
+            if (
+                meta.get("signature") != signature
+                or meta.get("dim") != self.dim
+                or not os.path.exists(self._file("vectors.f16"))
+            ):
+                if meta:
+                    print(f"[WARNING] Индекс эмбеддингов собран другой моделью и будет очищен: {self.path}")
+                self._create(signature, self.initial_capacity)
+            else:
+                self._load(meta)
+            self.signature = signature
+            INDEX_SIZE.set(len(self._keys))
+            return True
+
+    def bind(self, engine, path_to_weights: str) -> bool:
+        """
+        Привязывает индекс к текущей модели. Повторный вызов с той же
+        версией модели ничего не стоит; после горячей замены весов индекс
+        открывается заново и очищается, если веса изменились.
+
+        :param engine: Текущий движок нейросети
+        :param path_to_weights: Путь к весам движка
+        :return: False, если индексом владеет другой процесс
+        """
+        # Версия из реестра меняется при каждой замене, в отличие от id()
+        # движка, который может достаться новому объекту
+        model = (engine.version, path_to_weights)
+        if self._bound_model == model:
+            return True
+        if not self.open(model_signature(path_to_weights)):
+            return False
+        self._bound_model = model
+        return True
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        :return: Нормированный эмбеддинг (float32) по ключу или None
+        """
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                return None
+            return np.asarray(self._vectors[row], dtype=np.float32)
+
+    def add(self, key: str, vector: np.ndarray, label: int) -> bool:
+        """
+        Добавляет эмбеддинг, если ключа ещё нет.
+
+        :param key: Ключ (SHA-256 изображения)
+        :param vector: Эмбеддинг формы (dim,)
+        :param label: Индекс класса top-1 изображения
+        :return: True, если запись добавлена
+        """
+        return self.add_many([key], vector[np.newaxis], [label]) == 1
+
+    def add_many(self, keys: Sequence[str], vectors: np.ndarray, labels: Sequence[int]) -> int:
+        """
+        Добавляет эмбеддинги пачкой; уже известные ключи пропускаются.
+
+        :param keys: Ключи
+        :param vectors: Эмбеддинги формы (len(keys), dim)
+        :param labels: Индексы классов top-1
+        :return: Количество добавленных записей
+        """
+        vectors = normalize(vectors)
+        with self._lock:
+            fresh, seen = [], set()
+            for i, key in enumerate(keys):
+                if key not in self._rows and key not in seen:
+                    fresh.append(i)
+                    seen.add(key)
+            if not fresh:
+                return 0
+            start = len(self._keys)
+            self._reserve(start + len(fresh))
+            self._vectors[start : start + len(fresh)] = vectors[fresh]
+            for row, i in enumerate(fresh, start):
+                self._append(keys[i], int(labels[i]), row)
+            self._keys_file.write("".join(f"{keys[i]} {int(labels[i])}\n" for i in fresh))
+            self._keys_file.flush()
+            INDEX_SIZE.set(len(self._keys))
+            return len(fresh)
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        exclude: Optional[Sequence[Optional[str]]] = None,
+        label: Optional[int] = None,
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Ищет k ближайших эмбеддингов по косинусной близости для каждого
+        запроса. Строки просматриваются один раз для всех запросов: блок
+        float16 переводится в float32 и умножается на матрицу запросов.
+
+        :param queries: Эмбеддинги формы (M, dim) или (dim,)
+        :param k: Количество соседей
+        :param exclude: Ключ, не попадающий в результат, для каждого запроса (сам запрос)
+        :param label: Искать только среди изображений этого класса top-1
+        :return: Для каждого запроса – пары (ключ, близость) по убыванию близости
+        """
+        queries = normalize(np.atleast_2d(queries))
+        with self._lock:
+            return self._search(queries, k, exclude, label)
+
+    def _search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        exclude: Optional[Sequence[Optional[str]]],
+        label: Optional[int],
+    ) -> List[List[Tuple[str, float]]]:
+        if label is None:
+            rows = None
+            count = len(self._keys)
+        else:
+            rows = np.array(self._class_rows.get(label, ()), dtype=np.int64)
+            count = len(rows)
+        if count == 0 or k <= 0:
+            return [[] for _ in queries]
+
+        # Запасной кандидат на случай, если исключаемый ключ попадёт в top-k
+        want = min(k + 1, count)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        buffer = np.empty((min(SEARCH_BLOCK_ROWS, count), self.dim), dtype=np.float32)
+        for block_rows, block in self._blocks(rows, count):
+            converted = buffer[: len(block_rows)]
+            np.copyto(converted, block)
+            scores = queries @ converted.T
+            if scores.shape[1] > want:
+                top = np.argpartition(scores, -want, axis=1)[:, -want:]
+                scores = np.take_along_axis(scores, top, axis=1)
+            else:
+                top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_rows = np.concatenate([best_rows, block_rows[top]], axis=1)
+            if best_scores.shape[1] > want:
+                keep = np.argpartition(best_scores, -want, axis=1)[:, -want:]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        results: List[List[Tuple[str, float]]] = []
+        for q, row_order in enumerate(order):
+            skip = exclude[q] if exclude is not None else None
+            neighbours = []
+            for j in row_order:
+                key = self._keys[best_rows[q, j]]
+                if key == skip:
+                    continue
+                neighbours.append((key, float(best_scores[q, j])))
+                if len(neighbours) == k:
+                    break
+            results.append(neighbours)
+        return results
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+            self._bound_model = None
+            if self._lock_file is not None:
+                # Закрытие файла снимает блокировку
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _blocks(self, rows: Optional[np.ndarray], count: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        vectors = self._vectors
+        for start in range(0, count, SEARCH_BLOCK_ROWS):
+            stop = min(start + SEARCH_BLOCK_ROWS, count)
+            if rows is None:
+                yield np.arange(start, stop), vectors[start:stop]
+            else:
+                yield rows[start:stop], vectors[rows[start:stop]]
+
+    def _append(self, key: str, label: int, row: int) -> None:
+        self._rows[key] = row
+        self._keys.append(key)
+        self._class_rows.setdefault(label, []).append(row)
+
+    def _close(self) -> None:
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        if self._keys_file is not None:
+            self._keys_file.close()
+            self._keys_file = None
+        self._keys, self._rows, self._class_rows = [], {}, {}
+
+    def _acquire_writer_lock(self) -> bool:
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self._file("lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            if not self._locked_out:
+                print(f"[WARNING] Индекс эмбеддингов {self.path} открыт другим процессом, в этом он выключен")
+                self._locked_out = True
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read_meta(self) -> Dict[str, object]:
+        try:
+            with open(self._file("meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, signature: str, capacity: int) -> None:
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "capacity": capacity, "signature": signature}, f)
+        os.replace(tmp, self._file("meta.json"))
+
+    def _create(self, signature: str, capacity: int) -> None:
+        self._vectors = np.memmap(self._file("vectors.f16"), dtype=np.float16, mode="w+", shape=(capacity, self.dim))
+        self._keys_file = open(self._file("keys.txt"), "w", encoding="utf-8")
+        self._write_meta(signature, capacity)
+
+    def _load(self, meta: Dict[str, object]) -> None:
+        capacity = int(meta["capacity"])
+        self._vectors = np.memmap(self._file("vectors.f16"), dtype=np.float16, mode="r+", shape=(capacity, self.dim))
+        with open(self._file("keys.txt"), encoding="utf-8") as f:
+            lines = [line.split() for line in f if line.strip()]
+        # Строки после сбоя могли не дописаться: лишние ключи отбрасываются
+        for row, (key, label) in enumerate(lines[:capacity]):
+            self._append(key, int(label), row)
+        self._keys_file = open(self._file("keys.txt"), "a", encoding="utf-8")
+
+    def _reserve(self, size: int) -> None:
+        capacity = self._vectors.shape[0]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        # Файл растёт на месте: новые строки дописываются нулями в конец
+        self._vectors.flush()
+        with open(self._file("vectors.f16"), "r+b") as f:
+            f.truncate(capacity * self.dim * np.dtype(np.float16).itemsize)
+        self._vectors = np.memmap(self._file("vectors.f16"), dtype=np.float16, mode="r+", shape=(capacity, self.dim))
+        self._write_meta(self.signature, capacity)
+
+
+class NearDuplicateIndex:
+    """
+    Перцептивные отпечатки недавно обработанных изображений в памяти
+    процесса. Хранит не больше capacity записей: новые затирают самые
+    старые, как записи вытесняются из кэша предсказаний, предсказания
+    которого по найденному ключу и берутся. Потокобезопасен.
+    """
+
+    def __init__(self, epsilon: float, capacity: int, dim: int = SKETCH_DIM) -> None:
+        """
+        :param epsilon: Наибольшее косинусное расстояние до копии
+        :param capacity: Количество хранимых отпечатков
+        :param dim: Размерность отпечатка
+        """
+        self.epsilon: float = epsilon
+        self._vectors = np.zeros((max(1, capacity), dim), dtype=np.float32)
+        self._keys: List[Optional[str]] = [None] * len(self._vectors)
+        self._rows: Dict[str, int] = {}
+        self._next: int = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def nearest(self, sketches: np.ndarray) -> List[Optional[str]]:
+        """
+        :param sketches: Нормированные отпечатки формы (M, dim)
+        :return: Для каждого отпечатка ключ ближайшей копии в пределах
+            epsilon или None
+        """
+        with self._lock:
+            if not self._rows:
+                return [None] * len(sketches)
+            scores = sketches @ self._vectors.T
+        best = scores.argmax(axis=1)
+        return [
+            self._keys[row] if 1.0 - scores[q, row] <= self.epsilon else None
+            for q, row in enumerate(best.tolist())
+        ]
+
+    def add_many(self, keys: Sequence[str], sketches: np.ndarray) -> None:
+        """
+        Запоминает отпечатки; уже известные ключи пропускаются.
+
+        :param keys: Ключи (SHA-256 изображений)
+        :param sketches: Нормированные отпечатки формы (len(keys), dim)
+        """
+        with self._lock:
+            for key, sketch in zip(keys, sketches):
+                if key in self._rows:
+                    continue
+                row = self._next
+                old = self._keys[row]
+                if old is not None:
+                    del self._rows[old]
+                self._vectors[row] = sketch
+                self._keys[row] = key
+                self._rows[key] = row
+                self._next = (row + 1) % len(self._keys)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Нормирует эмбеддинги по L2, чтобы косинусная близость сводилась к
+    скалярному произведению.
+
+    :param vectors: Эмбеддинги формы (N, dim)
+    :return: Нормированные эмбеддинги float32
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def model_signature(path_to_weights: str) -> str:
+    """
+    Подпись весов модели: путь, размер и время изменения файла. Меняется
+    при замене весов, но не при перезапуске процесса.
+    """
+    try:
+        stat = os.stat(path_to_weights)
+        return f"{os.path.abspath(path_to_weights)}:{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        return f"{os.path.abspath(path_to_weights)}:missing"
+
+
+embedding_index: Optional[EmbeddingIndex] = EmbeddingIndex(EMBEDDING_INDEX_DIR) if EMBEDDING_INDEX_DIR else None
+
+
+def get_embedding_index() -> Optional[EmbeddingIndex]:
+    """
+    Зависимость FastAPI: общий для процесса индекс эмбеддингов (None, если выключен).
+    """
+    return embedding_index
+
+
+near_duplicate_index: Optional[NearDuplicateIndex] = (
+    NearDuplicateIndex(NEAR_DUPLICATE_EPSILON, NEAR_DUPLICATE_CAPACITY) if NEAR_DUPLICATE_EPSILON > 0 else None
+)
+
+
+def get_near_duplicate_index() -> Optional[NearDuplicateIndex]:
+    """
+    Зависимость FastAPI: отпечатки недавних изображений процесса (None, если выключены).
+    """
+    return near_duplicate_index
@@ -1,31 +1,131 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import JSONResponse
 from typing import Optional, List
 
 from app.services import NeuralNetworkService
-from app.schemas import GetPrediction
+from app.schemas import GetPrediction, BatchPredictionItem, ReadinessStatus, ModelStatus, ReloadModel, SimilarImage
+from app.model_registry import registry, resolve_weights_path, ModelNotReadyError
+from app.batching import TOP_K
+from app.inference_client import inference_client
+from app.profiling import require_admin
+import os
+
+# Максимальное количество изображений в одном запросе /predict/batch
+MAX_BATCH_FILES = int(os.environ.get("NN_MAX_BATCH_FILES", "64"))
 
 router = APIRouter()
 
 
 @router.get("/predict/{id}", response_model=GetPrediction)
-def get_prediction(
-    id: str, nn_service: NeuralNetworkService = Depends()
+async def get_prediction(
+    id: str,
+    k: int = Query(1, ge=1, le=TOP_K),
+    nn_service: NeuralNetworkService = Depends(),
 ) -> GetPrediction:
     """
     Возвращает предсказание класса для изображения по его ID из MongoDB.
 
     :param id: Строковый идентификатор изображения (MongoDB ObjectId)
+    :param k: Количество наиболее вероятных классов с вероятностями в ответе
     :param nn_service: Сервис нейросети (внедряется автоматически через Depends)
-    :return: Объект с предсказанным классом
+    :return: Объект с предсказанным классом, top-k и версией модели
     :raises HTTPException: 404, если изображение не найдено или предсказание не удалось
     """
-    prediction: Optional[str] = nn_service.get_prediction(id)
+    prediction: Optional[GetPrediction] = await nn_service.get_prediction(id, k)
     if prediction:
-        return GetPrediction(predicted_class=prediction)
+        return prediction
 
     raise HTTPException(status_code=404, detail="Image not found or prediction failed")
 
 
+@router.post("/predict", response_model=GetPrediction)
+async def predict_image(
+    request: Request,
+    k: int = Query(1, ge=1, le=TOP_K),
+    nn_service: NeuralNetworkService = Depends(),
+) -> GetPrediction:
+    """
+    Возвращает предсказание класса для изображения, переданного в теле запроса:
+    multipart/form-data с полем file или «сырые» байты (image/*, application/octet-stream).
+
+    :param request: Запрос с изображением
+    :param k: Количество наиболее вероятных классов с вероятностями в ответе
+    :param nn_service: Сервис нейросети
+    :return: Объект с предсказанным классом, top-k и версией модели
+    :raises HTTPException: 400, если изображение не передано; 422, если его не удалось декодировать
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        image_data = await upload.read() if hasattr(upload, "read") else b""
+    else:
+        image_data = await request.body()
+
+    if not image_data:
+        raise HTTPException(status_code=400, detail="Image is required")
+
+    prediction: Optional[GetPrediction] = await nn_service.predict_image(image_data, k)
+    if prediction:
+        return prediction
+
+    raise HTTPException(status_code=422, detail="Image could not be decoded")
+
+
+@router.post("/predict/batch", response_model=List[BatchPredictionItem])
+async def predict_images(
+    files: List[UploadFile] = File(...),
+    k: int = Query(1, ge=1, le=TOP_K),
+    nn_service: NeuralNetworkService = Depends(),
+) -> List[BatchPredictionItem]:
+    """
+    Возвращает предсказания для нескольких изображений, переданных полями
+    files в multipart/form-data. Ошибка одного изображения не влияет на остальные.
+
+    :param files: Изображения
+    :param k: Количество наиболее вероятных классов с вероятностями в ответе
+    :param nn_service: Сервис нейросети
+    :return: Результаты в порядке файлов: предсказание или текст ошибки
+    :raises HTTPException: 413, если файлов больше NN_MAX_BATCH_FILES
+    """
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_FILES} images per request")
+
+    buffers = [await upload.read() for upload in files]
+    predictions = await nn_service.predict_images(buffers, k)
+
+    items: List[BatchPredictionItem] = []
+    for image_data, prediction in zip(buffers, predictions):
+        if prediction is not None:
+            items.append(BatchPredictionItem(prediction=prediction))
+        else:
+            items.append(BatchPredictionItem(error="Image is required" if not image_data else "Image could not be decoded"))
+    return items
+
+
+@router.get("/similar/{image_id}", response_model=List[SimilarImage])
+async def get_similar_images(
+    image_id: str,
+    k: int = Query(10, ge=1, le=100),
+    nn_service: NeuralNetworkService = Depends(),
+) -> List[SimilarImage]:
+    """
+    Возвращает изображения, похожие на изображение из MongoDB, по
+    косинусной близости эмбеддингов модели.
+
+    :param image_id: Строковый идентификатор изображения (MongoDB ObjectId)
+    :param k: Количество похожих изображений
+    :param nn_service: Сервис нейросети
+    :return: Похожие изображения по убыванию близости
+    :raises HTTPException: 404, если изображение не найдено, индекс выключен или модель не отдаёт эмбеддинги
+    """
+    similar: Optional[List[SimilarImage]] = await nn_service.find_similar(image_id, k)
+    if similar is not None:
+        return similar
+
+    raise HTTPException(status_code=404, detail="Image not found or its embedding is not available")
+
+
 @router.get("/classes", response_model=List[str])
 def get_all_classes(nn_service: NeuralNetworkService = Depends()) -> List[str]:
     """
@@ -46,3 +146,60 @@ def get_classes_count(nn_service: NeuralNetworkService = Depends()) -> int:
     :return: Количество классов
     """
     return nn_service.get_cnt_classes()
+
+
+
+@router.get("/ready", response_model=ReadinessStatus)
+async def get_readiness() -> JSONResponse:
+    """
+    Проверка готовности: все зарегистрированные модели загружены (в режиме
+    shm – в процессе инференса, и воркер к нему подключён).
+
+    :return: Состояние моделей; код 503, пока хотя бы одна модель не готова
+    """
+    if inference_client is not None:
+        ready, models = await inference_client.status()
+    else:
+        ready, models = registry.is_ready(), registry.status()
+    body = ReadinessStatus(ready=ready, models=models)
+    return JSONResponse(status_code=200 if ready else 503, content=body.model_dump())
+
+
+@router.post(
+    "/models/{name}/reload", response_model=ModelStatus, status_code=202, dependencies=[Depends(require_admin)]
+)
+async def reload_model(
+    name: str, params: ReloadModel, background_tasks: BackgroundTasks
+) -> ModelStatus:
+    """
+    Горячая замена весов модели без перезапуска сервиса. Новая модель
+    собирается в фоне, текущая продолжает обслуживать запросы до подмены.
+
+    :param name: Имя модели
+    :param params: Путь к новым весам внутри каталога ресурсов (по умолчанию – текущие)
+    :return: Текущее состояние модели
+    :raises HTTPException: 404, если модель не зарегистрирована или ADMIN_TOKEN не задан;
+        403, если токен X-Admin-Token неверный; 400, если файл весов некорректен;
+        503, если процесс инференса недоступен (режим shm)
+    """
+    try:
+        entry = registry.get_entry(name)
+    except ModelNotReadyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    path: Optional[str] = None
+    if params.path_to_weights:
+        try:
+            path = resolve_weights_path(params.path_to_weights)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    if inference_client is not None:
+        # Модель загружена в процессе инференса, замена выполняется там
+        try:
+            return ModelStatus(**await inference_client.reload(name, path))
+        except ConnectionError as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    background_tasks.add_task(registry.reload, name, path)
+    return ModelStatus(**entry.to_dict())
@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from prometheus_client import Counter, Gauge
+from typing import AsyncIterator, Callable, TypeVar
+import asyncio
+import os
+import threading
+
+T = TypeVar("T")
+
+CPU_COUNT = os.cpu_count() or 1
+# Потоки внутри одной операции TensorFlow (матричные умножения, свёртки)
+TF_INTRA_OP_THREADS = int(os.environ.get("NN_TF_INTRA_OP_THREADS", str(CPU_COUNT)))
+# Независимые операции графа, выполняемые параллельно; у ResNet50 граф
+# почти последовательный, и лишние потоки только конкурируют за ядра
+TF_INTER_OP_THREADS = int(os.environ.get("NN_TF_INTER_OP_THREADS", "1"))
+# Одновременные прогоны модели: каждый уже занимает TF_INTRA_OP_THREADS ядер
+INFERENCE_WORKERS = int(os.environ.get("NN_INFERENCE_WORKERS", "1"))
+# Потоки декодирования изображений (Pillow отпускает GIL на декодировании)
+DECODE_WORKERS = int(os.environ.get("NN_DECODE_WORKERS", str(CPU_COUNT)))
+# Сколько изображений может одновременно находиться в обработке (декодирование,
+# очередь планировщика, прогон); сверх этого запросы сразу отклоняются
+MAX_PENDING_IMAGES = int(os.environ.get("NN_MAX_PENDING_IMAGES", "128"))
+RETRY_AFTER_SECONDS = int(os.environ.get("NN_RETRY_AFTER_SECONDS", "1"))
+
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    "nn_executor_queue_depth", "Задачи, ожидающие свободного потока пула", ["executor"]
+)
+EXECUTOR_ACTIVE = Gauge(
+    "nn_executor_active", "Задачи, выполняемые потоками пула", ["executor"]
+)
+ADMISSION_PENDING = Gauge(
+    "nn_admission_pending_images", "Изображения, принятые в обработку и ещё не завершённые"
+)
+ADMISSION_REJECTED = Counter(
+    "nn_admission_rejected_total", "Изображения, отклонённые из-за переполнения очереди"
+)
+
+_tf_threads_configured = False
+_tf_threads_lock = threading.Lock()
+
+
+class OverloadedError(Exception):
+    """
+    Очередь обработки заполнена: запрос отклоняется сразу, а не ждёт.
+    """
+
+    def __init__(self, retry_after: int = RETRY_AFTER_SECONDS) -> None:
+        super().__init__("Inference queue is full")
+        self.retry_after: int = retry_after
+
+
+class BoundedExecutor:
+    """
+    Пул потоков фиксированного размера для CPU-нагрузки с метриками
+    глубины очереди. Отделён от общего пула Starlette, чтобы инференс и
+    декодирование не вытесняли друг друга и не занимали больше ядер, чем есть.
+    """
+
+    def __init__(self, name: str, max_workers: int) -> None:
+        """
+        :param name: Имя пула (метка в метриках и префикс имён потоков)
+        :param max_workers: Количество потоков
+        """
+        self.name: str = name
+        self.max_workers: int = max(1, max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"nn-{name}")
+        self._queued = EXECUTOR_QUEUE_DEPTH.labels(executor=name)
+        self._active = EXECUTOR_ACTIVE.labels(executor=name)
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Выполняет функцию в пуле и ждёт результата, не блокируя event loop.
+
+        :param fn: Блокирующая функция
+        :return: Результат функции
+        """
+        self._queued.inc()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._call, partial(fn, *args, **kwargs)
+        )
+
+    def _call(self, fn: Callable[[], T]) -> T:
+        self._queued.dec()
+        self._active.inc()
+        try:
+            return fn()
+        finally:
+            self._active.dec()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AdmissionController:
+    """
+    Ограничение количества изображений в обработке. Используется только из
+    event loop, поэтому счётчик не требует блокировок.
+    """
+
+    def __init__(self, max_pending: int = MAX_PENDING_IMAGES, retry_after: int = RETRY_AFTER_SECONDS) -> None:
+        """
+        :param max_pending: Максимальное количество изображений в обработке, 0 – без ограничения
+        :param retry_after: Значение заголовка Retry-After для отклонённых запросов
+        """
+        self.max_pending: int = max_pending
+        self.retry_after: int = retry_after
+        self.pending: int = 0
+
+    @asynccontextmanager
+    async def admit(self, count: int = 1) -> AsyncIterator[None]:
+        """
+        Принимает count изображений в обработку на время блока или сразу
+        отклоняет их, если очередь заполнена.
+
+        :param count: Количество изображений в запросе
+        :raises OverloadedError: Если принятие превысит max_pending
+        """
+        if self.max_pending and self.pending + count > self.max_pending:
+            ADMISSION_REJECTED.inc(count)
+            raise OverloadedError(self.retry_after)
+
+        self.pending += count
+        ADMISSION_PENDING.set(self.pending)
+        try:
+            yield
+        finally:
+            self.pending -= count
+            ADMISSION_PENDING.set(self.pending)
+
+
+def configure_tensorflow_threads() -> None:
+    """
+    Задаёт размеры пулов потоков TensorFlow. Настройки действуют на весь
+    процесс и применяются только до инициализации рантайма, поэтому
+    вызываются один раз, перед сборкой первой модели.
+    """
+    global _tf_threads_configured
+
+    with _tf_threads_lock:
+        if _tf_threads_configured:
+            return
+        _tf_threads_configured = True
+
+        import tensorflow as tf
+
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+            tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+        except RuntimeError as e:
+            print(f"[WARNING] Не удалось настроить потоки TensorFlow: {e}")
+
+
+inference_executor = BoundedExecutor("inference", INFERENCE_WORKERS)
+decode_executor = BoundedExecutor("decode", DECODE_WORKERS)
+admission = AdmissionController()
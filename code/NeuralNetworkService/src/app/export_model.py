@@ -0,0 +1,213 @@
+"""
+Экспорт обученной модели в артефакт только для инференса и проверка
+соответствия экспортированного артефакта исходной Keras-модели.
+
+Примеры:
+    python -m app.export_model export --format keras --output resources/v1.keras
+    python -m app.export_model export --format savedmodel --output resources/v1_savedmodel
+    python -m app.export_model export --format tflite --quantize int8 --output resources/v1_int8.tflite
+    python -m app.export_model check --backend tflite --artifact resources/v1_int8.tflite
+"""
+from typing import Dict, Iterator, List, Optional
+import argparse
+import glob
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from app.neural_network import NeuralNetwork
+
+EXPORT_FORMATS = ("keras", "savedmodel", "onnx", "tflite")
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+
+
+def find_images(images_dir: str) -> List[str]:
+    """
+    Возвращает отсортированный список изображений в каталоге.
+
+    :param images_dir: Каталог с изображениями
+    """
+    paths: List[str] = []
+    for pattern in IMAGE_PATTERNS:
+        paths.extend(glob.glob(os.path.join(images_dir, pattern)))
+    return sorted(paths)
+
+
+def load_batch(engine: NeuralNetwork, paths: List[str]) -> np.ndarray:
+    buffers = []
+    for path in paths:
+        with open(path, "rb") as f:
+            buffers.append(f.read())
+    return engine.load_and_preprocess_batch(buffers)
+
+
+def export_model(
+    engine: NeuralNetwork,
+    export_format: str,
+    output: str,
+    quantize: Optional[str] = None,
+    calibration_images: Optional[List[str]] = None,
+) -> None:
+    """
+    Замораживает Keras-модель в артефакт инференса. Dropout и прочие слои
+    обучения трассируются в режиме training=False и в артефакт не попадают.
+
+    :param engine: Движок с загруженной Keras-моделью
+    :param export_format: keras (полная модель .keras), savedmodel, onnx или tflite
+    :param output: Путь к создаваемому артефакту
+    :param quantize: None или "int8" (пост-тренировочное квантование, только tflite)
+    :param calibration_images: Изображения для калибровки int8-квантования
+    """
+    if engine.model is None:
+        raise ValueError("Экспорт возможен только из бэкенда keras")
+    if quantize and export_format != "tflite":
+        raise ValueError("int8-квантование поддерживается только для формата tflite")
+
+    if export_format == "keras":
+        engine.model.save(output)
+    elif export_format == "savedmodel":
+        engine.model.export(output, format="tf_saved_model")
+    elif export_format == "onnx":
+        engine.model.export(output, format="onnx")
+    elif export_format == "tflite":
+        saved_model_dir = tempfile.mkdtemp(prefix="nn_export_")
+        try:
+            engine.model.export(saved_model_dir, format="tf_saved_model")
+            converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+            if quantize == "int8":
+                if not calibration_images:
+                    raise ValueError("Для int8-квантования нужны калибровочные изображения")
+                calibration = load_batch(engine, calibration_images)
+
+                def representative_dataset() -> Iterator[List[np.ndarray]]:
+                    for sample in calibration:
+                        yield [sample[np.newaxis, ...]]
+
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                converter.representative_dataset = representative_dataset
+                converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            with open(output, "wb") as f:
+                f.write(converter.convert())
+        finally:
+            shutil.rmtree(saved_model_dir, ignore_errors=True)
+    else:
+        raise ValueError(f"Неизвестный формат экспорта: {export_format}")
+
+    print(f"Артефакт сохранён: {output} [{export_format}{', ' + quantize if quantize else ''}]")
+
+
+def rss_mb() -> float:
+    """
+    Текущий резидентный объём памяти процесса в мегабайтах.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        # Вне Linux доступен только пиковый объём
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(engine: NeuralNetwork, batch: np.ndarray, runs: int) -> Dict[str, float]:
+    """
+    Замеряет задержку инференса по одному изображению.
+
+    :param engine: Движок нейросети
+    :param batch: Предобработанные изображения
+    :param runs: Количество проходов по всем изображениям
+    :return: Средняя задержка, p50 и p95 в миллисекундах
+    """
+    engine.predict_batch(batch[:1])  # прогрев
+    latencies: List[float] = []
+    for _ in range(runs):
+        for sample in batch:
+            started = time.perf_counter()
+            engine.predict_batch(sample[np.newaxis, ...])
+            latencies.append((time.perf_counter() - started) * 1000)
+    return {
+        "latency_mean_ms": float(np.mean(latencies)),
+        "latency_p50_ms": float(np.percentile(latencies, 50)),
+        "latency_p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def check_parity(
+    backend: str, artifact: str, images: List[str], weights: str, runs: int = 10
+) -> Dict[str, object]:
+    """
+    Сравнивает top-1 экспортированного артефакта с исходной Keras-моделью
+    на тестовых изображениях, а также задержку и прирост памяти при загрузке.
+
+    :param backend: Бэкенд артефакта (keras для .keras, savedmodel, tflite, onnx)
+    :param artifact: Путь к артефакту
+    :param images: Тестовые изображения
+    :param weights: Путь к весам Keras-модели
+    :param runs: Количество повторов для замера задержки
+    :return: Отчёт сравнения
+    """
+    report: Dict[str, object] = {"images": [os.path.basename(p) for p in images]}
+    predictions: Dict[str, List[int]] = {}
+
+    for name, kwargs in (
+        ("keras", {"backend": "keras", "path_to_weights": weights}),
+        (backend, {"backend": backend, "path_to_weights": artifact}),
+    ):
+        rss_before = rss_mb()
+        engine = NeuralNetwork(**kwargs)
+        rss_loaded = rss_mb() - rss_before
+
+        batch = load_batch(engine, images)
+        predictions[name] = [int(i) for i in np.argmax(engine.predict_batch(batch), axis=1)]
+        report[name] = {"top1": predictions[name], "rss_load_mb": rss_loaded, **measure(engine, batch, runs)}
+
+    matches = sum(a == b for a, b in zip(predictions["keras"], predictions[backend]))
+    report["top1_agreement"] = matches / len(images) if images else 0.0
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Экспорт и проверка артефактов модели")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Экспортировать модель для инференса")
+    export_parser.add_argument("--format", choices=EXPORT_FORMATS, required=True)
+    export_parser.add_argument("--output", required=True)
+    export_parser.add_argument("--quantize", choices=("int8",), default=None)
+    export_parser.add_argument("--weights", default="resources/v1.weights.h5")
+    export_parser.add_argument("--calibration-dir", default="resources/imgs")
+
+    check_parser = subparsers.add_parser("check", help="Сравнить артефакт с Keras-моделью")
+    check_parser.add_argument("--backend", choices=EXPORT_FORMATS, required=True)
+    check_parser.add_argument("--artifact", required=True)
+    check_parser.add_argument("--weights", default="resources/v1.weights.h5")
+    check_parser.add_argument("--images-dir", default="resources/imgs")
+    check_parser.add_argument("--runs", type=int, default=10)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        engine = NeuralNetwork(path_to_weights=args.weights)
+        export_model(
+            engine,
+            args.format,
+            args.output,
+            quantize=args.quantize,
+            calibration_images=find_images(args.calibration_dir),
+        )
+        return 0
+
+    report = check_parity(
+        args.backend, args.artifact, find_images(args.images_dir), args.weights, args.runs
+    )
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0 if report["top1_agreement"] == 1.0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,249 @@
+"""
+HTTP-воркер в режиме NN_SERVING_MODE=shm: модель держит отдельный процесс
+инференса (app/inference_server.py), а воркер не импортирует TensorFlow.
+Изображение декодируется в воркере, копируется в свободный слот общей
+памяти, а по unix-сокету уходит только номер слота.
+"""
+from fastapi import HTTPException
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import itertools
+
+import numpy as np
+
+from app.inference_server import INFERENCE_SOCKET, SERVING_MODE, SharedSlots, encode_message, read_message
+from app.neural_network import Config, InferenceBackend, NeuralNetwork
+from app.preprocessing import BatchDecoder
+
+# Пауза между попытками подключиться к процессу инференса
+RECONNECT_SECONDS = 1.0
+
+
+class RemoteBackend(InferenceBackend):
+    """
+    Заглушка бэкенда в HTTP-воркере: прогон выполняет процесс инференса.
+    """
+
+    name = "shm"
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        raise RuntimeError("Inference runs in the inference server process")
+
+
+class RemoteEngine(NeuralNetwork):
+    """
+    Движок HTTP-воркера: метаданные модели из процесса инференса и
+    декодирование с предобработкой изображений без TensorFlow.
+    """
+
+    def __init__(self, info: Dict[str, Any]) -> None:
+        """
+        :param info: Ответ процесса инференса на hello
+        """
+        height, width, _ = info["img_shape"]
+        self.conf: Config = Config(
+            height, width, num_classes=info["num_classes"], path_to_weights=info["path_to_weights"]
+        )
+        self.architecture: str = info["architecture"]
+        self.decoder: BatchDecoder = BatchDecoder(self.conf.IMG_SIZE)
+        self.class_names = info["class_names"]
+        self.version: str = info["version"]
+        self.model = None
+        self.backend: InferenceBackend = RemoteBackend()
+
+
+class InferenceClient:
+    """
+    Соединение HTTP-воркера с процессом инференса. Метод submit повторяет
+    BatchScheduler.submit, поэтому сервису всё равно, где выполняется
+    прогон. При потере соединения ожидающие запросы получают ошибку, а
+    соединение восстанавливается в фоне.
+    """
+
+    def __init__(self, socket_path: str = INFERENCE_SOCKET) -> None:
+        """
+        :param socket_path: Путь unix-сокета процесса инференса
+        """
+        self.socket_path: str = socket_path
+        # None, пока воркер не подключился к процессу с загруженной моделью
+        self.engine: Optional[RemoteEngine] = None
+        self._slots: Optional[SharedSlots] = None
+        self._free: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """
+        Запускает фоновое подключение к процессу инференса.
+        """
+        self._write_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._disconnect(RuntimeError("Inference client stopped"))
+
+    async def submit(self, tensor: np.ndarray) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        Передаёт одно предобработанное изображение процессу инференса и
+        ждёт результата.
+
+        :param tensor: Тензор изображения формы (H, W, 3)
+        :return: Индексы и вероятности top-k классов по убыванию вероятности;
+            эмбеддинг не передаётся (None)
+        """
+        slots, free = self._slots, self._free
+        if slots is None:
+            raise RuntimeError("Inference server is not connected")
+        # Свободных слотов нет – ждём, как в очереди планировщика
+        slot = await free.get()
+        if self._slots is not slots:
+            raise RuntimeError("Inference server connection was lost")
+
+        # Единственная копия тензора: дальше процесс инференса читает слот на месте.
+        # Слот освобождается при получении ответа, даже если запрос отменён
+        slots.inputs[slot] = tensor
+        try:
+            response = await self._request({"op": "predict", "slot": slot})
+        except ConnectionError:
+            free.put_nowait(slot)
+            raise
+        if self.engine is not None:
+            self.engine.version = response["version"]
+        return response["indices"], response["probabilities"], None
+
+    async def status(self) -> Tuple[bool, Dict[str, Dict[str, object]]]:
+        """
+        :return: Готовность (соединение установлено и модели загружены) и состояние моделей
+        """
+        try:
+            response = await self._request({"op": "status"})
+        except (ConnectionError, RuntimeError):
+            return False, {}
+        return response["ready"] and self.engine is not None, response["models"]
+
+    async def reload(self, name: str, path: Optional[str]) -> Dict[str, object]:
+        """
+        Запускает горячую замену весов в процессе инференса.
+
+        :param name: Имя модели
+        :param path: Абсолютный путь к новым весам (None – текущие)
+        :return: Состояние модели до замены
+        """
+        return (await self._request({"op": "reload", "name": name, "path": path}))["model"]
+
+    async def _request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        writer = self._writer
+        if writer is None:
+            raise ConnectionError("Inference server is not connected")
+        request_id = next(self._ids)
+        message["id"] = request_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        async with self._write_lock:
+            writer.write(encode_message(message))
+            await writer.drain()
+        return await future
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._connect()
+            except Exception as e:
+                if self.engine is not None:
+                    print(f"[WARNING] Соединение с процессом инференса потеряно: {e}")
+            self._disconnect(ConnectionError("Inference server connection was lost"))
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    async def _connect(self) -> None:
+        reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+        responses = asyncio.create_task(self._read_responses(reader))
+        try:
+            info = await self._request({"op": "hello"})
+            while not info["ready"]:
+                # Процесс инференса ещё загружает модель
+                await asyncio.sleep(RECONNECT_SECONDS)
+                info = await self._request({"op": "hello"})
+
+            self._slots = SharedSlots.attach(info["shm"], info["slots"], info["img_shape"], info["top_k"])
+            await self._request({"op": "attached"})
+            self._free = asyncio.Queue()
+            for slot in range(self._slots.slots):
+                self._free.put_nowait(slot)
+            self.engine = RemoteEngine(info)
+            print(f"Подключено к процессу инференса {self.socket_path}: модель {self.engine.version}")
+            await responses
+        finally:
+            responses.cancel()
+
+    async def _read_responses(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                response = await read_message(reader)
+                future = self._pending.pop(response["id"], None)
+                if "k" in response:
+                    # Результат забирается из слота до его освобождения
+                    slot, k = response["slot"], response["k"]
+                    response["indices"] = self._slots.indices[slot, :k].astype(np.intp)
+                    response["probabilities"] = self._slots.probabilities[slot, :k].copy()
+                if "slot" in response:
+                    self._free.put_nowait(response["slot"])
+                if future is None or future.done():
+                    continue
+                if "error" in response:
+                    future.set_exception(RuntimeError(response["error"]))
+                else:
+                    future.set_result(response)
+        except Exception as e:
+            # Ожидающие ответа (в т.ч. hello при подключении) не должны зависнуть
+            self._fail_pending(ConnectionError(f"Inference server connection was lost: {e!r}"))
+            raise
+
+    def _disconnect(self, error: Exception) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._fail_pending(error)
+        self.engine = None
+        if self._slots is not None:
+            self._slots.close()
+            self._slots = None
+            self._free = None
+
+    def _fail_pending(self, error: Exception) -> None:
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+
+
+inference_client: Optional[InferenceClient] = InferenceClient() if SERVING_MODE == "shm" else None
+
+
+def get_remote_engine() -> NeuralNetwork:
+    """
+    Зависимость FastAPI в режиме shm вместо get_engine: движок с метаданными
+    модели из процесса инференса.
+
+    :raises HTTPException: 503, если процесс инференса недоступен или модель не загружена
+    """
+    engine = inference_client.engine if inference_client is not None else None
+    if engine is None:
+        raise HTTPException(status_code=503, detail="Inference server is not ready", headers={"Retry-After": "5"})
+    return engine
+
+
+def get_inference_client() -> InferenceClient:
+    """
+    Зависимость FastAPI в режиме shm вместо get_scheduler.
+    """
+    return inference_client
@@ -0,0 +1,284 @@
+"""
+Процесс инференса для режима NN_SERVING_MODE=shm: единственный процесс
+сервиса, который импортирует TensorFlow и держит модель в памяти.
+HTTP-воркеры uvicorn (app/inference_client.py) сами декодируют изображения
+в слоты общей памяти, а по unix-сокету передают только номер слота; top-k
+возвращается через тот же слот. Изображения всех воркеров попадают в общие
+батчи планировщика.
+
+Запуск из каталога src:
+    python -m app.inference_server
+    NN_SERVING_MODE=shm uvicorn main:app --workers 4
+
+Протокол: JSON-сообщения с 4-байтовой длиной, на каждый запрос с полем id
+приходит ответ с тем же id. Операции:
+    hello    – выделить соединению сегмент слотов ({"ready": false}, пока модель загружается)
+    attached – воркер подключился к сегменту, его имя можно удалить
+    predict  – прогнать изображение из слота
+    status   – состояние моделей (для /nn/ready)
+    reload   – горячая замена весов
+"""
+from multiprocessing import resource_tracker, shared_memory
+from prometheus_client import start_http_server
+from typing import Any, Dict, Optional, Sequence, Set
+import argparse
+import asyncio
+import json
+import os
+import signal
+import struct
+
+import numpy as np
+
+from app.batching import TOP_K, scheduler
+from app.executor import inference_executor
+from app.model_registry import registry
+
+# Режим обслуживания: local – модель в каждом HTTP-воркере, shm – в отдельном процессе инференса
+SERVING_MODE = os.environ.get("NN_SERVING_MODE", "local")
+INFERENCE_SOCKET = os.environ.get("NN_INFERENCE_SOCKET", "/tmp/caloriecam-nn-inference.sock")
+# Слотов на одного HTTP-воркера: столько его изображений может одновременно
+# ждать прогона; каждый слот – один входной тензор (224×224×3 float32 ≈ 0.6 МБ)
+SHM_SLOTS = int(os.environ.get("NN_SHM_SLOTS", "16"))
+# Порт метрик Prometheus процесса инференса (батчи, пулы, загрузка модели), 0 – выключено
+INFERENCE_METRICS_PORT = int(os.environ.get("NN_INFERENCE_METRICS_PORT", "0"))
+
+_HEADER = struct.Struct("!I")
+
+
+class SharedSlots:
+    """
+    Сегмент общей памяти с фиксированным числом слотов: входной тензор
+    изображения и top-k индексы и вероятности на слот. Сегмент создаёт
+    процесс инференса для каждого соединения, воркер подключается к нему
+    по имени; оба работают с одними и теми же страницами без копирования.
+    """
+
+    def __init__(
+        self, shm: shared_memory.SharedMemory, slots: int, img_shape: Sequence[int], top_k: int
+    ) -> None:
+        """
+        :param shm: Сегмент общей памяти
+        :param slots: Количество слотов
+        :param img_shape: Форма входного тензора (H, W, 3)
+        :param top_k: Количество классов в результате
+        """
+        self.shm: shared_memory.SharedMemory = shm
+        self.slots: int = slots
+        self.img_shape = tuple(img_shape)
+        self.top_k: int = top_k
+        inputs_bytes = slots * int(np.prod(self.img_shape)) * 4
+        self.inputs: Optional[np.ndarray] = np.ndarray((slots, *self.img_shape), dtype=np.float32, buffer=shm.buf)
+        self.indices: Optional[np.ndarray] = np.ndarray(
+            (slots, top_k), dtype=np.int32, buffer=shm.buf, offset=inputs_bytes
+        )
+        self.probabilities: Optional[np.ndarray] = np.ndarray(
+            (slots, top_k), dtype=np.float32, buffer=shm.buf, offset=inputs_bytes + slots * top_k * 4
+        )
+        self._unlinked: bool = False
+
+    @classmethod
+    def create(cls, slots: int, img_shape: Sequence[int], top_k: int) -> "SharedSlots":
+        size = slots * (int(np.prod(img_shape)) * 4 + top_k * 8)
+        return cls(shared_memory.SharedMemory(create=True, size=size), slots, img_shape, top_k)
+
+    @classmethod
+    def attach(cls, name: str, slots: int, img_shape: Sequence[int], top_k: int) -> "SharedSlots":
+        shm = shared_memory.SharedMemory(name=name)
+        # Сегментом владеет процесс инференса; без этого resource_tracker
+        # воркера попытается удалить его ещё раз при выходе
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, slots, img_shape, top_k)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def unlink(self) -> None:
+        """
+        Удаляет имя сегмента. Подключённые процессы продолжают работать с
+        ним, а память освобождается, когда последний из них его закроет.
+        """
+        if not self._unlinked:
+            self._unlinked = True
+            self.shm.unlink()
+
+    def close(self) -> None:
+        # Представления numpy держат буфер сегмента: без их удаления close() падает с BufferError
+        self.inputs = self.indices = self.probabilities = None
+        self.shm.close()
+
+
+async def read_message(reader: asyncio.StreamReader) -> Dict[str, Any]:
+    """
+    Читает одно сообщение протокола.
+
+    :raises asyncio.IncompleteReadError: Если соединение закрыто
+    """
+    (length,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return json.loads(await reader.readexactly(length))
+
+
+def encode_message(message: Dict[str, Any]) -> bytes:
+    body = json.dumps(message).encode("utf-8")
+    return _HEADER.pack(len(body)) + body
+
+
+class InferenceServer:
+    """
+    Сервер процесса инференса: загружает модели через реестр, запускает
+    планировщик батчей и обслуживает соединения HTTP-воркеров по unix-сокету.
+    """
+
+    def __init__(self, socket_path: str = INFERENCE_SOCKET, slots: int = SHM_SLOTS, top_k: int = TOP_K) -> None:
+        """
+        :param socket_path: Путь unix-сокета
+        :param slots: Слотов общей памяти на одно соединение
+        :param top_k: Количество классов в результате
+        """
+        self.socket_path: str = socket_path
+        self.slots: int = max(1, slots)
+        self.top_k: int = max(1, top_k)
+        # Соединения воркеров: обработчик и поток записи
+        self._connections: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    async def serve(self) -> None:
+        """
+        Работает до SIGTERM или SIGINT.
+        """
+        loop = asyncio.get_running_loop()
+        # Модели загружаются в фоне; до готовности воркеры получают {"ready": false}
+        loop.run_in_executor(None, registry.load_all)
+        await scheduler.start()
+
+        if os.path.exists(self.socket_path):
+            # Сокет остался от предыдущего запуска
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        print(f"Процесс инференса ожидает HTTP-воркеры на {self.socket_path}")
+
+        stopped = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stopped.set)
+        try:
+            await stopped.wait()
+        finally:
+            server.close()
+            # Обработчики завершаются сами по закрытию соединения, дождавшись своих прогонов
+            for writer in self._connections.values():
+                writer.close()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await server.wait_closed()
+            await scheduler.stop()
+            inference_executor.shutdown()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        slots: Optional[SharedSlots] = None
+        tasks: Set[asyncio.Task] = set()
+        write_lock = asyncio.Lock()
+        self._connections[asyncio.current_task()] = writer
+
+        async def reply(request_id: int, response: Dict[str, Any]) -> None:
+            response["id"] = request_id
+            async with write_lock:
+                writer.write(encode_message(response))
+                await writer.drain()
+
+        async def respond(request: Dict[str, Any]) -> None:
+            try:
+                response = await self._dispatch(request, slots)
+            except Exception as e:
+                response = {"error": str(e) or type(e).__name__}
+                if request.get("op") == "predict":
+                    # Воркер освобождает слот и при ошибке
+                    response["slot"] = request.get("slot")
+            try:
+                await reply(request["id"], response)
+            except ConnectionError:
+                pass
+
+        try:
+            while True:
+                request = await read_message(reader)
+                op = request.get("op")
+                if op == "hello":
+                    if slots is None and registry.is_ready():
+                        slots = SharedSlots.create(self.slots, registry.get().conf.IMG_SHAPE, self.top_k)
+                    await reply(request["id"], self._hello(slots))
+                elif op == "attached" and slots is not None:
+                    # Воркер держит сегмент открытым, имя больше не нужно: при
+                    # аварийном завершении обоих процессов память не утечёт
+                    slots.unlink()
+                    await reply(request["id"], {})
+                else:
+                    # Прогоны выполняются конкурентно, иначе не соберётся батч
+                    task = asyncio.create_task(respond(request))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            # Сегмент закрывается только после завершения прогонов, читающих его слоты
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+            self._connections.pop(asyncio.current_task(), None)
+            if slots is not None:
+                slots.unlink()
+                slots.close()
+
+    def _hello(self, slots: Optional[SharedSlots]) -> Dict[str, Any]:
+        if slots is None:
+            return {"ready": False}
+        engine = registry.get()
+        return {
+            "ready": True,
+            "shm": slots.name,
+            "slots": slots.slots,
+            "img_shape": list(slots.img_shape),
+            "top_k": slots.top_k,
+            "architecture": engine.architecture,
+            "class_names": engine.class_names,
+            "num_classes": engine.conf.NUM_CLASSES,
+            "path_to_weights": engine.conf.PATH_TO_WEIGHTS,
+            "version": engine.version,
+        }
+
+    async def _dispatch(self, request: Dict[str, Any], slots: Optional[SharedSlots]) -> Dict[str, Any]:
+        op = request.get("op")
+        if op == "predict":
+            if slots is None:
+                raise RuntimeError("Shared memory is not attached")
+            slot = int(request["slot"])
+            # Тензор читается прямо из слота; копия – только при сборке батча
+            indices, probabilities, _ = await scheduler.submit(slots.inputs[slot])
+            k = len(indices)
+            slots.indices[slot, :k] = indices
+            slots.probabilities[slot, :k] = probabilities
+            return {"slot": slot, "k": k, "version": registry.get().version}
+        if op == "status":
+            return {"ready": registry.is_ready(), "models": registry.status()}
+        if op == "reload":
+            entry = registry.get_entry(request["name"])
+            asyncio.get_running_loop().run_in_executor(None, registry.reload, entry.name, request.get("path"))
+            return {"model": entry.to_dict()}
+        raise ValueError(f"Unknown operation: {op}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Процесс инференса NNService (режим NN_SERVING_MODE=shm)")
+    parser.add_argument("--socket", default=INFERENCE_SOCKET, help="Путь unix-сокета")
+    parser.add_argument("--slots", type=int, default=SHM_SLOTS, help="Слотов общей памяти на HTTP-воркер")
+    parser.add_argument("--metrics-port", type=int, default=INFERENCE_METRICS_PORT, help="Порт метрик, 0 – выключено")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+    asyncio.run(InferenceServer(args.socket, args.slots).serve())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
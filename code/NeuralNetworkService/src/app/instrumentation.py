@@ -0,0 +1,159 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Iterator, List, Optional, Tuple
+import os
+import re
+import time
+import uuid
+
+# Заголовок с идентификатором трассировки: приходит от DishesService (или
+# другого клиента) либо создаётся здесь и возвращается в ответе
+TRACE_HEADER = "X-Trace-Id"
+# Запросы дольше порога печатаются с разбивкой по этапам, отрицательное значение – не печатать
+TRACE_LOG_SLOW_MS = float(os.environ.get("TRACE_LOG_SLOW_MS", "1000"))
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+STAGE_SECONDS = Histogram(
+    "nn_stage_seconds", "Длительность этапа обработки запроса", ["stage"], buckets=STAGE_BUCKETS
+)
+# Метка endpoint – имя функции-обработчика: в отличие от пути, ID в пути
+# не раздувают количество рядов
+HTTP_REQUESTS = Counter(
+    "nn_http_requests_total", "HTTP-запросы по обработчику и коду ответа", ["method", "endpoint", "status"]
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "nn_http_request_seconds", "Длительность HTTP-запроса", ["method", "endpoint"], buckets=STAGE_BUCKETS
+)
+HTTP_IN_FLIGHT = Gauge("nn_http_requests_in_flight", "HTTP-запросы в обработке")
+
+_TRACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+_trace_id: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+# Этапы текущего запроса; список общий для задач, запущенных из запроса
+_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("spans", default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    """
+    :return: Идентификатор трассировки текущего запроса или задания
+    """
+    return _trace_id.get()
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Замеряет этап обработки: длительность попадает в гистограмму
+    nn_stage_seconds и в разбивку текущего запроса.
+
+    :param stage: Имя этапа (метка stage)
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage=stage).observe(elapsed)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+@contextmanager
+def trace(name: str, trace_id: Optional[str] = None) -> Iterator[str]:
+    """
+    Трассировка работы вне HTTP-запроса (например, загрузки модели):
+    свой идентификатор и разбивка по этапам.
+
+    :param name: Название работы для журнала
+    :param trace_id: Идентификатор трассировки (по умолчанию – новый)
+    :return: Идентификатор трассировки
+    """
+    trace_id = trace_id or uuid.uuid4().hex
+    spans: List[Tuple[str, float]] = []
+    trace_token = _trace_id.set(trace_id)
+    spans_token = _spans.set(spans)
+    started = time.perf_counter()
+    try:
+        yield trace_id
+    finally:
+        _log_slow(name, trace_id, time.perf_counter() - started, spans)
+        _spans.reset(spans_token)
+        _trace_id.reset(trace_token)
+
+
+class InstrumentationMiddleware:
+    """
+    ASGI-middleware: счётчики и длительность запросов по обработчику
+    и коду ответа, количество запросов в обработке, идентификатор
+    трассировки (X-Trace-Id) и разбивка по этапам в заголовке Server-Timing.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["path"].startswith("/metrics"):
+            # Сбор метрик не должен попадать в сами метрики
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        incoming = _header(scope, TRACE_HEADER)
+        trace_id = incoming if incoming and _TRACE_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+        spans: List[Tuple[str, float]] = []
+        trace_token = _trace_id.set(trace_id)
+        spans_token = _spans.set(spans)
+        status = 500
+
+        async def send_with_headers(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append(TRACE_HEADER, trace_id)
+                if spans:
+                    headers.append("Server-Timing", _server_timing(spans))
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            # Обработчик известен только после маршрутизации
+            endpoint = getattr(scope.get("endpoint"), "__name__", None) or "unmatched"
+            HTTP_REQUESTS.labels(method=method, endpoint=endpoint, status=str(status)).inc()
+            HTTP_REQUEST_SECONDS.labels(method=method, endpoint=endpoint).observe(elapsed)
+            _log_slow(f"{method} {scope['path']} {status}", trace_id, elapsed, spans)
+            _spans.reset(spans_token)
+            _trace_id.reset(trace_token)
+
+
+def _header(scope: Scope, name: str) -> Optional[str]:
+    key = name.lower().encode("latin-1")
+    for header, value in scope.get("headers", ()):
+        if header == key:
+            return value.decode("latin-1")
+    return None
+
+
+def _server_timing(spans: List[Tuple[str, float]]) -> str:
+    return ", ".join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in spans)
+
+
+def _log_slow(name: str, trace_id: str, elapsed: float, spans: List[Tuple[str, float]]) -> None:
+    if TRACE_LOG_SLOW_MS < 0 or elapsed * 1000 < TRACE_LOG_SLOW_MS:
+        return
+    stages = ", ".join(f"{stage}={seconds * 1000:.1f} мс" for stage, seconds in spans)
+    print(f"[TRACE] {trace_id} {name}: {elapsed * 1000:.1f} мс" + (f" ({stages})" if stages else ""))
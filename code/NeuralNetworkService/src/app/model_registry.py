@@ -0,0 +1,260 @@
+from fastapi import HTTPException
+from functools import partial
+from prometheus_client import Gauge
+from typing import Callable, Dict, Optional
+import os
+import threading
+import time
+
+from app.neural_network import NeuralNetwork
+from app.cascade import CascadeNeuralNetwork
+from app.instrumentation import span, trace
+
+# Имя модели по умолчанию и путь к её весам задаются через переменные окружения
+DEFAULT_MODEL_NAME = os.environ.get("NN_DEFAULT_MODEL", "resnet50")
+DEFAULT_WEIGHTS_PATH = os.environ.get("NN_WEIGHTS_PATH", "resources/v1.weights.h5")
+# Бэкенд инференса: keras или экспортированный артефакт (savedmodel, tflite, onnx)
+DEFAULT_BACKEND = os.environ.get("NN_BACKEND", "keras")
+# Каскад: если заданы веса облегчённой модели, она отвечает первой, а ResNet50
+# запускается только при вероятности top-1 ниже порога
+CASCADE_LIGHT_WEIGHTS = os.environ.get("NN_CASCADE_LIGHT_WEIGHTS")
+CASCADE_LIGHT_BACKEND = os.environ.get("NN_CASCADE_LIGHT_BACKEND", "keras")
+CASCADE_THRESHOLD = float(os.environ.get("NN_CASCADE_THRESHOLD", "0.8"))
+RESOURCES_DIR = os.path.abspath(os.environ.get("NN_RESOURCES_DIR", "resources"))
+# Размеры батчей для прогрева модели перед тем, как она станет доступна
+WARMUP_BATCH_SIZES = [
+    int(size) for size in os.environ.get("NN_WARMUP_BATCH_SIZES", "1").split(",") if size.strip()
+]
+
+PROCESS_STARTED = time.time()
+
+MODEL_LOAD_SECONDS = Gauge("nn_model_load_seconds", "Длительность загрузки модели", ["model"])
+MODEL_WARMUP_SECONDS = Gauge("nn_model_warmup_seconds", "Длительность прогрева модели", ["model"])
+STARTUP_SECONDS = Gauge("nn_startup_seconds", "Время от старта процесса до готовности всех моделей")
+
+STATUS_NOT_LOADED = "not_loaded"
+STATUS_LOADING = "loading"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+
+class ModelNotReadyError(Exception):
+    """
+    Модель ещё не загружена (или загрузка завершилась ошибкой).
+    """
+
+
+class ModelEntry:
+    """
+    Состояние одной зарегистрированной модели.
+    """
+
+    def __init__(self, name: str, factory: Callable[..., NeuralNetwork], path_to_weights: str) -> None:
+        self.name: str = name
+        self.factory: Callable[..., NeuralNetwork] = factory
+        self.path_to_weights: str = path_to_weights
+        self.engine: Optional[NeuralNetwork] = None
+        self.status: str = STATUS_NOT_LOADED
+        self.version: int = 0
+        self.loaded_at: Optional[float] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def model_version(self) -> str:
+        """
+        Строковая версия модели: имя и порядковый номер загрузки весов.
+        """
+        return f"{self.name}:{self.version}"
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "name": self.name,
+            "status": self.status,
+            "version": self.model_version,
+            "path_to_weights": self.path_to_weights,
+            "loaded_at": self.loaded_at,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "error": self.error,
+        }
+
+
+class ModelRegistry:
+    """
+    Реестр моделей процесса: каждая модель строится один раз и разделяется
+    между всеми запросами. Замена весов выполняется «на горячую»: новая модель
+    собирается рядом со старой, которая продолжает обслуживать запросы,
+    после чего ссылка атомарно подменяется.
+    """
+
+    def __init__(self) -> None:
+        self._models: Dict[str, ModelEntry] = {}
+        self._lock = threading.Lock()
+
+    def register(
+        self,
+        name: str,
+        factory: Callable[..., NeuralNetwork] = NeuralNetwork,
+        path_to_weights: str = DEFAULT_WEIGHTS_PATH,
+    ) -> None:
+        """
+        Регистрирует модель без её загрузки.
+
+        :param name: Имя модели
+        :param factory: Фабрика движка, принимает path_to_weights
+        :param path_to_weights: Путь к файлу с весами
+        """
+        with self._lock:
+            self._models[name] = ModelEntry(name, factory, path_to_weights)
+
+    def load(self, name: str, path_to_weights: Optional[str] = None) -> ModelEntry:
+        """
+        Строит и прогревает модель, после чего публикует её в реестре.
+        При повторном вызове выполняет горячую замену весов.
+
+        :param name: Имя зарегистрированной модели
+        :param path_to_weights: Новый путь к весам (по умолчанию – текущий)
+        :return: Обновлённое состояние модели
+        """
+        entry = self._entry(name)
+        path = path_to_weights or entry.path_to_weights
+        if entry.engine is None:
+            entry.status = STATUS_LOADING
+
+        started = time.perf_counter()
+        try:
+            with trace(f"load model {name}"):
+                with span("model_load"):
+                    engine = entry.factory(path_to_weights=path)
+                loaded = time.perf_counter()
+                with span("model_warmup"):
+                    engine.warmup(WARMUP_BATCH_SIZES)
+        except Exception as e:
+            print(f"[ERROR] Не удалось загрузить модель {name}: {e}")
+            with self._lock:
+                entry.error = str(e)
+                if entry.engine is None:
+                    entry.status = STATUS_FAILED
+            raise
+
+        with self._lock:
+            entry.path_to_weights = path
+            entry.version += 1
+            engine.version = entry.model_version
+            entry.engine = engine
+            entry.status = STATUS_READY
+            entry.error = None
+            entry.loaded_at = time.time()
+            entry.load_seconds = loaded - started
+            entry.warmup_seconds = time.perf_counter() - loaded
+        MODEL_LOAD_SECONDS.labels(model=name).set(entry.load_seconds)
+        MODEL_WARMUP_SECONDS.labels(model=name).set(entry.warmup_seconds)
+        print(
+            f"Модель {entry.model_version} загружена за {entry.load_seconds:.2f} с, "
+            f"прогрета за {entry.warmup_seconds:.2f} с"
+        )
+        return entry
+
+    def reload(self, name: str, path_to_weights: Optional[str] = None) -> None:
+        """
+        Горячая замена весов для фоновой задачи: ошибка не пробрасывается,
+        а пишется в журнал и остаётся в entry.error (видна в /nn/ready),
+        модель продолжает работать на прежних весах.
+
+        :param name: Имя зарегистрированной модели
+        :param path_to_weights: Новый путь к весам (по умолчанию – текущий)
+        """
+        try:
+            self.load(name, path_to_weights=path_to_weights)
+        except Exception as e:
+            entry = self._entry(name)
+            print(f"[ERROR] Горячая замена модели {name} не удалась, работает {entry.model_version}: {e}")
+
+    def load_all(self) -> None:
+        """
+        Загружает все зарегистрированные модели. Ошибка одной модели
+        не мешает загрузке остальных.
+        """
+        for name in list(self._models):
+            try:
+                self.load(name)
+            except Exception:
+                pass
+        if self.is_ready():
+            STARTUP_SECONDS.set(time.time() - PROCESS_STARTED)
+
+    def get(self, name: Optional[str] = None) -> NeuralNetwork:
+        """
+        Возвращает загруженный движок модели.
+
+        :param name: Имя модели (по умолчанию – модель по умолчанию)
+        :raises ModelNotReadyError: Если модель ещё не готова
+        """
+        entry = self._entry(name or DEFAULT_MODEL_NAME)
+        engine = entry.engine
+        if engine is None:
+            raise ModelNotReadyError(f"Model '{entry.name}' is {entry.status}")
+        return engine
+
+    def get_entry(self, name: Optional[str] = None) -> ModelEntry:
+        return self._entry(name or DEFAULT_MODEL_NAME)
+
+    def is_ready(self) -> bool:
+        return bool(self._models) and all(
+            entry.engine is not None for entry in self._models.values()
+        )
+
+    def status(self) -> Dict[str, Dict[str, object]]:
+        return {name: entry.to_dict() for name, entry in self._models.items()}
+
+    def _entry(self, name: str) -> ModelEntry:
+        try:
+            return self._models[name]
+        except KeyError:
+            raise ModelNotReadyError(f"Model '{name}' is not registered")
+
+
+def resolve_weights_path(path: str) -> str:
+    """
+    Проверяет, что путь к весам указывает на существующий файл внутри
+    каталога ресурсов, и возвращает его абсолютную форму.
+
+    :param path: Путь к весам (абсолютный или относительно каталога ресурсов)
+    :raises ValueError: Если путь вне каталога ресурсов или файла нет
+    """
+    full_path = os.path.abspath(os.path.join(RESOURCES_DIR, path))
+    if os.path.commonpath([full_path, RESOURCES_DIR]) != RESOURCES_DIR:
+        raise ValueError("Weights must be located inside the resources directory")
+    if not os.path.exists(full_path):
+        raise ValueError(f"Weights file not found: {path}")
+    return full_path
+
+
+registry = ModelRegistry()
+if CASCADE_LIGHT_WEIGHTS:
+    registry.register(
+        DEFAULT_MODEL_NAME,
+        partial(
+            CascadeNeuralNetwork,
+            path_to_light_weights=CASCADE_LIGHT_WEIGHTS,
+            threshold=CASCADE_THRESHOLD,
+            backend=DEFAULT_BACKEND,
+            light_backend=CASCADE_LIGHT_BACKEND,
+        ),
+    )
+else:
+    registry.register(DEFAULT_MODEL_NAME, partial(NeuralNetwork, backend=DEFAULT_BACKEND))
+
+
+def get_engine() -> NeuralNetwork:
+    """
+    Зависимость FastAPI: возвращает общий для процесса движок нейросети.
+
+    :raises HTTPException: 503, если модель ещё не загружена
+    """
+    try:
+        return registry.get()
+    except ModelNotReadyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
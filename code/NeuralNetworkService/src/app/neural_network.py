@@ -1,11 +1,17 @@
-import tensorflow as tf
-from tensorflow.keras.applications import ResNet50
-from tensorflow.keras import layers, models
-from tensorflow.keras import mixed_precision
-from tensorflow.keras.preprocessing import image
 import numpy as np
 import os
-from typing import List, Tuple
+from typing import TYPE_CHECKING, BinaryIO, Dict, List, Optional, Sequence, Tuple, Type, Union
+
+from app.executor import TF_INTRA_OP_THREADS, configure_tensorflow_threads
+from app.preprocessing import BatchDecoder, caffe_preprocess_in_place, decode_into
+
+# TensorFlow импортируется лениво, при первой загрузке модели: так сервер
+# начинает принимать запросы (и отвечать на /nn/ready) без ожидания импорта
+if TYPE_CHECKING:
+    import tensorflow as tf
+
+# Размер эмбеддинга – выход предпоследнего слоя Dense(256) головы классификатора
+EMBEDDING_DIM = 256
 
 
 class Config:
@@ -30,7 +36,7 @@ class Config:
             use_fine_tune (bool): Включить ли fine-tuning.
             fine_tune_at (int): С какого слоя размораживать.
             num_classes (int): Кол-во классов.
-            path_to_weights (str): Путь до файла с весами.
+            path_to_weights (str): Путь до файла с весами (для бэкенда keras) или до экспортированного артефакта.
             path_to_class_names (str): Путь до файла с названиями классов.
         """
         self.IMG_SIZE: Tuple[int, int] = (img_height, img_width)
@@ -42,9 +48,154 @@ class Config:
         self.PATH_TO_CLASS_NAMES: str = path_to_class_names
 
 
+class InferenceBackend:
+    """
+    Базовый класс бэкенда инференса: принимает батч предобработанных
+    изображений и возвращает вероятности классов.
+    """
+
+    name: str = "base"
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            batch (np.ndarray): Тензор формы (N, H, W, 3), float32.
+
+        Returns:
+            np.ndarray: Вероятности классов формы (N, NUM_CLASSES).
+        """
+        raise NotImplementedError
+
+    def predict_with_embeddings(self, batch: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Args:
+            batch (np.ndarray): Тензор формы (N, H, W, 3), float32.
+
+        Returns:
+            Tuple[np.ndarray, Optional[np.ndarray]]: Вероятности классов и эмбеддинги
+                формы (N, EMBEDDING_DIM); None, если бэкенд не отдаёт эмбеддинги.
+        """
+        return self.predict(batch), None
+
+
+class KerasBackend(InferenceBackend):
+    """
+    Инференс напрямую через Keras-модель (граф обучения).
+    """
+
+    name = "keras"
+
+    def __init__(self, model: "tf.keras.Model") -> None:
+        self.model: "tf.keras.Model" = model
+        self.embedding_model: Optional["tf.keras.Model"] = self._build_embedding_model(model)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model.predict_on_batch(batch))
+
+    def predict_with_embeddings(self, batch: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if self.embedding_model is None:
+            return self.predict(batch), None
+        probabilities, embeddings = self.embedding_model.predict_on_batch(batch)
+        return np.asarray(probabilities), np.asarray(embeddings, dtype=np.float32)
+
+    @staticmethod
+    def _build_embedding_model(model: "tf.keras.Model") -> Optional["tf.keras.Model"]:
+        """
+        Модель с двумя выходами на тех же слоях и весах: вероятности классов
+        и выход предпоследнего Dense (эмбеддинг) за один прогон.
+        """
+        import tensorflow as tf
+
+        dense = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.Dense)]
+        if len(dense) < 2 or dense[-2].units != EMBEDDING_DIM:
+            return None
+        return tf.keras.Model(inputs=model.inputs, outputs=[model.outputs[0], dense[-2].output])
+
+
+class SavedModelBackend(InferenceBackend):
+    """
+    Инференс через экспортированный SavedModel (только граф инференса).
+    """
+
+    name = "savedmodel"
+
+    def __init__(self, path: str) -> None:
+        import tensorflow as tf
+
+        loaded = tf.saved_model.load(path)
+        self._loaded = loaded
+        self._fn = loaded.signatures["serving_default"]
+        self._output_key: str = list(self._fn.structured_outputs)[0]
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        import tensorflow as tf
+
+        outputs = self._fn(tf.constant(batch, dtype=tf.float32))
+        return outputs[self._output_key].numpy()
+
+
+class TFLiteBackend(InferenceBackend):
+    """
+    Инференс через TFLite-интерпретатор (в т.ч. int8-квантованные модели).
+    Вход и выход модели остаются float32, квантование выполняется внутри.
+    """
+
+    name = "tflite"
+
+    def __init__(self, path: str) -> None:
+        import tensorflow as tf
+
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=TF_INTRA_OP_THREADS)
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size: int = 0
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        if batch.shape[0] != self._batch_size:
+            self.interpreter.resize_tensor_input(self._input["index"], batch.shape)
+            self.interpreter.allocate_tensors()
+            self._batch_size = batch.shape[0]
+        self.interpreter.set_tensor(self._input["index"], np.ascontiguousarray(batch, dtype=np.float32))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output["index"]).copy()
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    Инференс через ONNX Runtime (опциональная зависимость onnxruntime).
+    """
+
+    name = "onnx"
+
+    def __init__(self, path: str) -> None:
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("Для бэкенда onnx требуется пакет onnxruntime") from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self._input_name: str = self.session.get_inputs()[0].name
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        feed = {self._input_name: np.ascontiguousarray(batch, dtype=np.float32)}
+        return self.session.run(None, feed)[0]
+
+
+BACKENDS: Dict[str, Type[InferenceBackend]] = {
+    backend.name: backend
+    for backend in (KerasBackend, SavedModelBackend, TFLiteBackend, OnnxBackend)
+}
+
+
+ARCHITECTURES: Tuple[str, ...] = ("resnet50", "mobilenet_v3")
+
+
 class NeuralNetwork:
     """
-    Класс нейросети на базе ResNet50 с возможностью fine-tuning.
+    Класс нейросети на базе ResNet50 (или облегчённой MobileNetV3)
+    с возможностью fine-tuning.
     """
 
     def __init__(
@@ -56,11 +207,32 @@ class NeuralNetwork:
         num_classes: int = 101,
         path_to_weights: str = "resources/v1.weights.h5",
         path_to_class_names: str = "resources/class_names.txt",
+        backend: str = "keras",
+        for_training: bool = False,
+        architecture: str = "resnet50",
     ) -> None:
         """
         Инициализирует модель, загружает веса и классы.
+
+        Args:
+            architecture (str): Архитектура модели: resnet50 или mobilenet_v3.
+            backend (str): Бэкенд инференса: keras, savedmodel, tflite или onnx.
+                Для всех, кроме keras, path_to_weights указывает на экспортированный артефакт.
+            for_training (bool): Собрать модель для обучения (compile, mixed_float16).
         """
-        mixed_precision.set_global_policy("mixed_float16")
+        if backend not in BACKENDS:
+            raise ValueError(f"Неизвестный бэкенд: {backend}")
+        if architecture not in ARCHITECTURES:
+            raise ValueError(f"Неизвестная архитектура: {architecture}")
+
+        configure_tensorflow_threads()
+        import tensorflow as tf
+        from tensorflow.keras import mixed_precision
+
+        # float16 ускоряет работу только на GPU, на CPU он медленнее float32
+        gpus = tf.config.list_physical_devices("GPU")
+        if for_training or gpus:
+            mixed_precision.set_global_policy("mixed_float16")
 
         self.conf: Config = Config(
             img_height,
@@ -71,30 +243,57 @@ class NeuralNetwork:
             path_to_weights,
             path_to_class_names,
         )
+        self.architecture: str = architecture
+        self.decoder: BatchDecoder = BatchDecoder(self.conf.IMG_SIZE)
         self.class_names: List[str] = self.load_class_names()
-        self.model: tf.keras.Model = self.build_resnet50()
-
-        self.model.compile(
-            optimizer="adam",
-            loss="sparse_categorical_crossentropy",
-            metrics=["accuracy"],
-        )
-
-        if self.load_weights():
-            print("Веса загружены!")
+        # Версию назначает реестр моделей при публикации движка
+        self.version: str = "unversioned"
+        self.model: Optional["tf.keras.Model"] = None
+
+        if backend == KerasBackend.name and path_to_weights.endswith(".keras"):
+            # Полная сериализованная модель: одна загрузка без сборки графа и весов ImageNet
+            self.model = tf.keras.models.load_model(path_to_weights, compile=False)
+            print(f"Модель загружена: {path_to_weights}")
+            self.backend: InferenceBackend = KerasBackend(self.model)
+        elif backend == KerasBackend.name:
+            # Веса ImageNet нужны только как стартовая точка обучения, если
+            # обученных весов нет; при обслуживании их сразу перезаписывают
+            has_weights = os.path.exists(path_to_weights)
+            if not for_training and not has_weights:
+                # Модель со случайными весами отвечала бы случайными классами:
+                # ошибка помечает модель в реестре сбойной, и /nn/ready отвечает 503
+                raise FileNotFoundError(f"Не найдены веса модели: {path_to_weights}")
+            build = self.build_resnet50 if architecture == "resnet50" else self.build_mobilenet_v3
+            self.model = build(base_weights="imagenet" if for_training and not has_weights else None)
+
+            if for_training:
+                self.model.compile(
+                    optimizer="adam",
+                    loss="sparse_categorical_crossentropy",
+                    metrics=["accuracy"],
+                )
+
+            if self.load_weights():
+                print("Веса загружены!")
+            else:
+                print("Не удалось загрузить веса, обучение начнётся с весов ImageNet")
+
+            self.backend = KerasBackend(self.model)
         else:
-            print("Не удалось загрузить веса!")
+            self.backend = BACKENDS[backend](self.conf.PATH_TO_WEIGHTS)
+            print(f"Артефакт модели загружен: {self.conf.PATH_TO_WEIGHTS} [{backend}]")
 
         print("TensorFlow version:", tf.__version__)
-        print("Num GPUs Available:", len(tf.config.list_physical_devices("GPU")))
+        print("Num GPUs Available:", len(gpus))
 
 
     def __repr__(self) -> str:
         """
         Строковое представление модели.
         """
-        self.model.summary()
-        return f'NN [ResNet50] (IMG[shape={self.conf.IMG_SHAPE}], SETTINGS[num_classes={self.conf.NUM_CLASSES}, fine_tune={"YES" if self.conf.USE_FINE_TUNE else "NO"}])'
+        if self.model is not None:
+            self.model.summary()
+        return f'NN [{self.architecture}/{self.backend.name}] (IMG[shape={self.conf.IMG_SHAPE}], SETTINGS[num_classes={self.conf.NUM_CLASSES}, fine_tune={"YES" if self.conf.USE_FINE_TUNE else "NO"}])'
 
 
     def load_weights(self) -> bool:
@@ -127,16 +326,59 @@ class NeuralNetwork:
             return [name.strip() for name in content.split(",") if name.strip()]
 
 
-    def build_resnet50(self) -> tf.keras.Model:
+    def build_resnet50(self, base_weights: Optional[str] = "imagenet") -> "tf.keras.Model":
         """
         Строит архитектуру модели ResNet50.
 
+        Args:
+            base_weights (Optional[str]): Начальные веса базовой модели ("imagenet" или None).
+
+        Returns:
+            tf.keras.Model: Скомпонованная модель.
+        """
+        from tensorflow.keras.applications import ResNet50
+
+        base_model: "tf.keras.Model" = ResNet50(
+            weights=base_weights, include_top=False, input_shape=self.conf.IMG_SHAPE
+        )
+        return self._add_head(base_model)
+
+
+    def build_mobilenet_v3(self, base_weights: Optional[str] = "imagenet") -> "tf.keras.Model":
+        """
+        Строит облегчённую модель на базе MobileNetV3Small с той же головой
+        классификатора. Предобработка входа встроена в модель, поэтому она
+        принимает пиксели RGB в диапазоне [0, 255].
+
+        Args:
+            base_weights (Optional[str]): Начальные веса базовой модели ("imagenet" или None).
+
         Returns:
             tf.keras.Model: Скомпонованная модель.
         """
-        base_model: tf.keras.Model = ResNet50(
-            weights="imagenet", include_top=False, input_shape=self.conf.IMG_SHAPE
+        from tensorflow.keras.applications import MobileNetV3Small
+
+        base_model: "tf.keras.Model" = MobileNetV3Small(
+            weights=base_weights,
+            include_top=False,
+            input_shape=self.conf.IMG_SHAPE,
+            include_preprocessing=True,
         )
+        return self._add_head(base_model)
+
+
+    def _add_head(self, base_model: "tf.keras.Model") -> "tf.keras.Model":
+        """
+        Замораживает базовую модель (кроме слоёв fine-tuning) и добавляет
+        голову классификатора.
+
+        Args:
+            base_model (tf.keras.Model): Базовая модель без верхних слоёв.
+
+        Returns:
+            tf.keras.Model: Скомпонованная модель.
+        """
+        from tensorflow.keras import layers, models
 
         for layer in base_model.layers:
             layer.trainable = False
@@ -169,10 +411,192 @@ class NeuralNetwork:
         Returns:
             np.ndarray: Обработанный тензор изображения.
         """
-        img = image.load_img(img_path, target_size=self.conf.IMG_SIZE)
-        img_array = image.img_to_array(img)
-        img_array = tf.keras.applications.resnet50.preprocess_input(img_array)
-        return np.expand_dims(img_array, axis=0)
+        with open(img_path, "rb") as f:
+            return self.load_and_preprocess_bytes(f.read())
+
+
+    def load_and_preprocess_bytes(self, image_data: Union[bytes, BinaryIO]) -> np.ndarray:
+        """
+        Декодирует изображение из памяти и предобрабатывает его для предсказания.
+
+        Args:
+            image_data (Union[bytes, BinaryIO]): Закодированное изображение (JPEG, PNG и т.д.)
+                или файловый объект, из которого оно читается по мере декодирования.
+
+        Returns:
+            np.ndarray: Обработанный тензор изображения формы (1, H, W, 3).
+        """
+        return self.load_and_preprocess_batch([image_data])
+
+
+    def load_and_preprocess_batch(self, buffers: Sequence[Union[bytes, BinaryIO]]) -> np.ndarray:
+        """
+        Декодирует список изображений из памяти сразу в один заранее
+        выделенный тензор и предобрабатывает весь батч на месте.
+
+        Args:
+            buffers (Sequence[bytes]): Закодированные изображения.
+
+        Returns:
+            np.ndarray: Обработанный тензор формы (N, H, W, 3).
+        """
+        return self.preprocess(self.decode_batch(buffers))
+
+
+    def load_and_preprocess_many(
+        self, buffers: Sequence[Union[bytes, BinaryIO]]
+    ) -> Tuple[np.ndarray, List[Optional[Exception]]]:
+        """
+        Как load_and_preprocess_batch, но ошибка декодирования одного
+        изображения не прерывает обработку остальных.
+
+        Args:
+            buffers (Sequence[Union[bytes, BinaryIO]]): Закодированные изображения.
+
+        Returns:
+            Tuple[np.ndarray, List[Optional[Exception]]]: Обработанный тензор формы (N, H, W, 3)
+                и ошибки декодирования по изображениям (None – успешно).
+        """
+        batch, errors = self.decoder.decode(buffers)
+        return self.preprocess(batch), errors
+
+
+    def decode_batch(self, buffers: Sequence[Union[bytes, BinaryIO]]) -> np.ndarray:
+        """
+        Декодирует список изображений параллельно в один заранее выделенный
+        тензор без предобработки.
+
+        Args:
+            buffers (Sequence[bytes]): Закодированные изображения.
+
+        Returns:
+            np.ndarray: Пиксели RGB в диапазоне [0, 255] формы (N, H, W, 3), float32.
+        """
+        batch, errors = self.decoder.decode(buffers)
+        for error in errors:
+            if error is not None:
+                raise error
+        return batch
+
+
+    def preprocess(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Приводит декодированный батч к входу модели. Для ResNet50 каналы
+        переставляются в BGR и центрируются на месте; MobileNetV3 выполняет
+        предобработку сама.
+
+        Args:
+            batch (np.ndarray): Пиксели RGB формы (N, H, W, 3), float32.
+
+        Returns:
+            np.ndarray: Вход модели формы (N, H, W, 3).
+        """
+        if self.architecture != "resnet50":
+            return batch
+        return caffe_preprocess_in_place(batch)
+
+
+    def decode_image(self, image_data: Union[bytes, BinaryIO], out: np.ndarray) -> None:
+        """
+        Декодирует изображение и записывает пиксели RGB в переданный буфер.
+        Без NN_JPEG_DRAFT (по умолчанию) декодирование и изменение размера
+        (ближайший сосед) повторяют keras.preprocessing.image.load_img при
+        обучении, но только для полученных байтов: DishesService присылает
+        копию, уже уменьшенную до 512 px и перекодированную в JPEG q90.
+
+        Args:
+            image_data (Union[bytes, BinaryIO]): Закодированное изображение или файловый объект.
+            out (np.ndarray): Буфер формы (H, W, 3) для записи пикселей.
+        """
+        decode_into(image_data, out, self.decoder.draft)
+
+
+    def predict_batch(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Выполняет один прогон модели на батче предобработанных изображений.
+
+        Args:
+            batch (np.ndarray): Тензор формы (N, H, W, 3).
+
+        Returns:
+            np.ndarray: Вероятности классов формы (N, NUM_CLASSES).
+        """
+        return self.backend.predict(batch)
+
+
+    def predict_top_k(self, batch: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Выполняет прогон модели и возвращает k наиболее вероятных классов
+        для каждого изображения батча.
+
+        Args:
+            batch (np.ndarray): Тензор формы (N, H, W, 3).
+            k (int): Количество классов.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Индексы и вероятности классов формы (N, k),
+                отсортированные по убыванию вероятности.
+        """
+        return self.top_k(self.predict_batch(batch), k)
+
+
+    def predict_top_k_with_embeddings(
+        self, batch: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        Как predict_top_k, но за тот же прогон возвращает и эмбеддинги
+        изображений (выход слоя Dense(256)).
+
+        Args:
+            batch (np.ndarray): Тензор формы (N, H, W, 3).
+            k (int): Количество классов.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]: Индексы и вероятности
+                формы (N, k) и эмбеддинги формы (N, EMBEDDING_DIM) или None, если
+                бэкенд их не отдаёт (экспортированные артефакты).
+        """
+        probabilities, embeddings = self.backend.predict_with_embeddings(batch)
+        indices, top = self.top_k(probabilities, k)
+        return indices, top, embeddings
+
+
+    @staticmethod
+    def top_k(probabilities: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Векторно выбирает k наибольших вероятностей в каждой строке:
+        argpartition за O(C), затем сортировка только k выбранных.
+
+        Args:
+            probabilities (np.ndarray): Вероятности классов формы (N, C).
+            k (int): Количество классов.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Индексы и вероятности формы (N, k).
+        """
+        k = max(1, min(k, probabilities.shape[1]))
+        if k < probabilities.shape[1]:
+            indices = np.argpartition(probabilities, -k, axis=1)[:, -k:]
+        else:
+            indices = np.broadcast_to(np.arange(k), (probabilities.shape[0], k))
+        top = np.take_along_axis(probabilities, indices, axis=1)
+        order = np.argsort(-top, axis=1)
+        return (
+            np.take_along_axis(indices, order, axis=1),
+            np.take_along_axis(top, order, axis=1),
+        )
+
+
+    def warmup(self, batch_sizes: Sequence[int] = (1,)) -> None:
+        """
+        Прогревает модель холостыми прогонами: трассировка графа и выделение
+        памяти происходят до первого реального запроса.
+
+        Args:
+            batch_sizes (Sequence[int]): Размеры батчей для прогрева.
+        """
+        for batch_size in batch_sizes:
+            self.predict_batch(np.zeros((batch_size, *self.conf.IMG_SHAPE), dtype=np.float32))
 
 
     def get_prediction(self, img_path: str) -> int:
@@ -186,5 +610,5 @@ class NeuralNetwork:
             int: Индекс предсказанного класса.
         """
         img_tensor = self.load_and_preprocess_image(img_path)
-        prediction = self.model.predict(img_tensor)
+        prediction = self.predict_batch(img_tensor)
         return int(np.argmax(prediction))
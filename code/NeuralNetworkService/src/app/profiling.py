@@ -0,0 +1,354 @@
+from collections import Counter
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import Response
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Dict, Optional
+import asyncio
+import hmac
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+import zipfile
+
+import numpy as np
+
+from app.cache import TTLCache
+from app.executor import inference_executor
+from app.instrumentation import current_trace_id
+from app.model_registry import get_engine
+from app.neural_network import KerasBackend, NeuralNetwork, SavedModelBackend
+
+# Токен администратора; без него профилирование выключено целиком:
+# middleware не подключается, а эндпоинты /admin отвечают 404
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+ADMIN_HEADER = "X-Admin-Token"
+# Заголовок запроса, включающий профилирование только этого запроса
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+# Период опроса стеков потоков семплирующим профилировщиком
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+MAX_PROFILE_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+MAX_TF_PROFILE_INFERENCES = 100
+
+# Профили отдельных запросов хранятся до скачивания
+profiles: TTLCache[str] = TTLCache(
+    "profile",
+    max_size=int(os.environ.get("PROFILE_STORE_SIZE", "32")),
+    ttl_seconds=float(os.environ.get("PROFILE_STORE_TTL_SECONDS", "600")),
+)
+
+# Одновременно работает не больше одного профилировщика: каждый опрашивает
+# стеки всех потоков процесса
+_profiler_lock = threading.Lock()
+_tracemalloc_baseline: Optional[tracemalloc.Snapshot] = None
+
+
+class SamplingProfiler:
+    """
+    Семплирующий профилировщик на стандартной библиотеке: отдельный поток
+    периодически снимает стеки всех потоков процесса (sys._current_frames)
+    и считает одинаковые стеки. Результат – «свёрнутые» стеки (folded
+    stacks), которые принимают flamegraph.pl, speedscope и inferno.
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS) -> None:
+        """
+        :param interval_ms: Период снятия стеков, мс
+        """
+        self.interval: float = max(interval_ms, 0.1) / 1000
+        self.stacks: Counter = Counter()
+        self.samples: int = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        """
+        Останавливает профилировщик.
+
+        :return: Свёрнутые стеки: строка «поток;функция (файл:строка);... количество»
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.folded()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+
+class ProfilingMiddleware:
+    """
+    ASGI-middleware: профилирует запрос с заголовками X-Profile и верным
+    X-Admin-Token. Профиль сохраняется под идентификатором трассировки,
+    который возвращается в заголовке X-Profile-Id, и скачивается через
+    GET /admin/profiles/{id}. Подключается только при заданном ADMIN_TOKEN.
+
+    Профилировщик снимает стеки всех потоков процесса, пока выполняется
+    запрос, поэтому в профиль попадают и конкурентные запросы и батчи инференса
+    этого процесса; корень каждого стека – имя потока. Точный профиль
+    одного запроса получается на ненагруженном экземпляре.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not _profile_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        if not _profiler_lock.acquire(blocking=False):
+            # Уже работает другой профилировщик: запрос выполняется как обычно
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = current_trace_id() or uuid.uuid4().hex
+        profiler = SamplingProfiler()
+
+        async def send_with_header(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(PROFILE_ID_HEADER, profile_id)
+            await send(message)
+
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_header)
+        finally:
+            profiles.set(profile_id, profiler.stop())
+            _profiler_lock.release()
+
+
+def _profile_requested(scope: Scope) -> bool:
+    headers = dict(scope.get("headers", ()))
+    token = headers.get(ADMIN_HEADER.lower().encode("latin-1"), b"").decode("latin-1")
+    return bool(headers.get(PROFILE_HEADER.lower().encode("latin-1"))) and _token_valid(token)
+
+
+def _token_valid(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """
+    Зависимость эндпоинтов /admin.
+
+    :raises HTTPException: 404, если ADMIN_TOKEN не задан; 403, если токен неверный
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not _token_valid(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def _download(content: bytes, filename: str, media_type: str = "text/plain; charset=utf-8") -> Response:
+    return Response(
+        content=content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def tracemalloc_folded(snapshot: tracemalloc.Snapshot, baseline: Optional[tracemalloc.Snapshot] = None) -> str:
+    """
+    Сворачивает снимок tracemalloc в формат flamegraph: вес стека – байты
+    (или прирост байт относительно baseline).
+
+    :param snapshot: Снимок памяти
+    :param baseline: Предыдущий снимок для подсчёта прироста
+    :return: Свёрнутые стеки с размерами в байтах
+    """
+    snapshot = snapshot.filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        )
+    )
+    if baseline is not None:
+        stats = [(stat.traceback, stat.size_diff) for stat in snapshot.compare_to(baseline, "traceback")]
+    else:
+        stats = [(stat.traceback, stat.size) for stat in snapshot.statistics("traceback")]
+
+    lines = []
+    for traceback, size in stats:
+        if size <= 0:
+            continue
+        # Кадры tracemalloc идут от самого старого к последнему
+        stack = ";".join(f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in traceback)
+        lines.append(f"{stack} {size}\n")
+    return "".join(lines)
+
+
+def profile_tensorflow(engine: NeuralNetwork, inferences: int, batch_size: int) -> bytes:
+    """
+    Снимает профиль TensorFlow на уровне операций для inferences прогонов
+    модели на батче из нулей.
+
+    :param engine: Модель
+    :param inferences: Количество прогонов
+    :param batch_size: Размер батча
+    :return: ZIP-архив каталога профиля (plugins/profile/...) для TensorBoard
+    """
+    import tensorflow as tf
+
+    batch = np.zeros((batch_size, *engine.conf.IMG_SHAPE), dtype=np.float32)
+    engine.predict_batch(batch)
+    logdir = tempfile.mkdtemp(prefix="nn-tf-profile-")
+    try:
+        tf.profiler.experimental.start(logdir)
+        try:
+            for step in range(inferences):
+                with tf.profiler.experimental.Trace("inference", step_num=step, _r=1):
+                    engine.predict_batch(batch)
+        finally:
+            tf.profiler.experimental.stop()
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+            for root, _, files in os.walk(logdir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    zf.write(path, os.path.relpath(path, logdir))
+        return archive.getvalue()
+    finally:
+        shutil.rmtree(logdir, ignore_errors=True)
+
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@router.post("/profile/cpu")
+async def profile_cpu(
+    seconds: float = Query(10.0, gt=0, le=MAX_PROFILE_SECONDS),
+    interval_ms: float = Query(PROFILE_SAMPLE_INTERVAL_MS, gt=0),
+) -> Response:
+    """
+    Семплирующее профилирование всего процесса в течение заданного окна.
+
+    :param seconds: Длительность окна, с
+    :param interval_ms: Период снятия стеков, мс
+    :return: Файл свёрнутых стеков для flamegraph
+    :raises HTTPException: 409, если уже работает другой профилировщик
+    """
+    if not _profiler_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    try:
+        profiler = SamplingProfiler(interval_ms)
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            folded = profiler.stop()
+    finally:
+        _profiler_lock.release()
+    return _download(folded.encode(), f"cpu-{int(time.time())}.folded")
+
+
+@router.get("/profiles/{profile_id}")
+def get_profile(profile_id: str) -> Response:
+    """
+    Профиль запроса, выполненного с заголовком X-Profile.
+
+    :param profile_id: Значение заголовка X-Profile-Id из ответа
+    :return: Файл свёрнутых стеков для flamegraph
+    :raises HTTPException: 404, если профиль не найден или устарел
+    """
+    folded = profiles.get(profile_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return _download(folded.encode(), f"request-{profile_id}.folded")
+
+
+@router.post("/profile/tensorflow")
+async def profile_tensorflow_ops(
+    inferences: int = Query(10, ge=1, le=MAX_TF_PROFILE_INFERENCES),
+    batch_size: int = Query(1, ge=1, le=64),
+    engine: NeuralNetwork = Depends(get_engine),
+) -> Response:
+    """
+    Профиль TensorFlow на уровне операций для N прогонов модели на батче
+    из нулей. Профилировщик TensorFlow записывает все операции процесса:
+    батчи, которые в это время выполняются в других потоках пула
+    инференса, попадают в профиль и делят с прогонами процессор.
+
+    :param inferences: Количество прогонов
+    :param batch_size: Размер батча
+    :param engine: Текущая модель
+    :return: ZIP-архив профиля (открывается в TensorBoard, вкладка Profile)
+    :raises HTTPException: 409, если бэкенд модели – не TensorFlow или модель – каскад
+    """
+    # У каскада нет одного бэкенда: он прогоняет две модели
+    backend = getattr(engine, "backend", None)
+    if backend is None or backend.name not in (KerasBackend.name, SavedModelBackend.name):
+        name = backend.name if backend is not None else engine.architecture
+        raise HTTPException(status_code=409, detail=f"Backend {name} is not profiled by TensorFlow")
+    content = await inference_executor.run(profile_tensorflow, engine, inferences, batch_size)
+    return _download(content, f"tf-profile-{int(time.time())}.zip", "application/zip")
+
+
+@router.post("/tracemalloc/start")
+def start_tracemalloc(frames: int = Query(25, ge=1, le=100)) -> Dict[str, object]:
+    """
+    Включает tracemalloc и запоминает исходный снимок памяти. До вызова
+    этого эндпоинта выделения памяти не отслеживаются.
+
+    :param frames: Глубина сохраняемого стека выделения
+    """
+    global _tracemalloc_baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    _tracemalloc_baseline = tracemalloc.take_snapshot()
+    return {"tracing": True, "frames": tracemalloc.get_traceback_limit()}
+
+
+@router.get("/tracemalloc/snapshot")
+def get_tracemalloc_snapshot(diff: bool = Query(True)) -> Response:
+    """
+    Снимок памяти tracemalloc в формате flamegraph.
+
+    :param diff: Прирост относительно исходного снимка (иначе – вся занятая память)
+    :return: Файл свёрнутых стеков с размерами в байтах
+    :raises HTTPException: 409, если tracemalloc не включён
+    """
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc is not started")
+    folded = tracemalloc_folded(tracemalloc.take_snapshot(), _tracemalloc_baseline if diff else None)
+    return _download(folded.encode(), f"memory-{int(time.time())}.folded")
+
+
+@router.post("/tracemalloc/stop")
+def stop_tracemalloc() -> Dict[str, object]:
+    """
+    Выключает tracemalloc и освобождает собранные трассы.
+    """
+    global _tracemalloc_baseline
+    tracemalloc.stop()
+    _tracemalloc_baseline = None
+    return {"tracing": False}
@@ -1,5 +1,46 @@
 from pydantic import BaseModel
+from typing import Dict, List, Optional
+
+
+class ClassProbability(BaseModel):
+    class_name: str
+    probability: float
 
 
 class GetPrediction(BaseModel):
     predicted_class: str
+    probability: Optional[float] = None
+    top_k: List[ClassProbability] = []
+    model_version: Optional[str] = None
+
+
+class BatchPredictionItem(BaseModel):
+    """Результат для одного изображения батча: предсказание или ошибка"""
+    prediction: Optional[GetPrediction] = None
+    error: Optional[str] = None
+
+
+class SimilarImage(BaseModel):
+    """Похожее изображение и косинусная близость его эмбеддинга"""
+    image_id: str
+    similarity: float
+
+
+class ModelStatus(BaseModel):
+    name: str
+    status: str
+    version: str
+    path_to_weights: str
+    loaded_at: Optional[float] = None
+    load_seconds: Optional[float] = None
+    warmup_seconds: Optional[float] = None
+    error: Optional[str] = None
+
+
+class ReadinessStatus(BaseModel):
+    ready: bool
+    models: Dict[str, ModelStatus]
+
+
+class ReloadModel(BaseModel):
+    path_to_weights: Optional[str] = None
@@ -1,10 +1,35 @@
 from fastapi import Depends
-from typing import List, Optional
-from tempfile import NamedTemporaryFile
+from starlette.concurrency import run_in_threadpool
+from typing import BinaryIO, List, Optional, Sequence, Tuple, Union
+import asyncio
+import hashlib
 import os
 
+import numpy as np
+
 from app.neural_network import NeuralNetwork
-from app.database_mongo import get_image_from_mongo
+from app.model_registry import get_engine
+from app.batching import BatchScheduler, get_scheduler
+from app.executor import admission, decode_executor
+from app.database_mongo import find_image_ids_by_hashes, get_image_hash, open_image_from_mongo
+from app.embedding_index import (
+    NEAR_DUPLICATES,
+    EmbeddingIndex,
+    NearDuplicateIndex,
+    get_embedding_index,
+    get_near_duplicate_index,
+)
+from app.preprocessing import perceptual_sketch
+from app.schemas import ClassProbability, GetPrediction, SimilarImage
+from app.cache import TTLCache
+from app.instrumentation import span
+
+# Кэш предсказаний по SHA-256 содержимого изображения и версии модели
+prediction_cache: TTLCache[GetPrediction] = TTLCache(
+    "prediction",
+    max_size=int(os.environ.get("NN_PREDICTION_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.environ.get("NN_PREDICTION_CACHE_TTL_SECONDS", "3600")),
+)
 
 
 class NeuralNetworkService:
@@ -12,37 +37,264 @@ class NeuralNetworkService:
     Сервис для обработки изображений и получения предсказаний от нейросети.
     """
 
-    def __init__(self, engine: NeuralNetwork = Depends()) -> None:
+    def __init__(
+        self,
+        engine: NeuralNetwork = Depends(get_engine),
+        scheduler: BatchScheduler = Depends(get_scheduler),
+        index: Optional[EmbeddingIndex] = Depends(get_embedding_index),
+        near_duplicates: Optional[NearDuplicateIndex] = Depends(get_near_duplicate_index),
+    ) -> None:
         """
         Инициализирует сервис с экземпляром нейросети.
 
-        :param engine: Зависимость, экземпляр класса NeuralNetwork
+        :param engine: Зависимость, общий для процесса экземпляр NeuralNetwork из реестра моделей
+        :param scheduler: Зависимость, планировщик батчевого инференса
+        :param index: Зависимость, индекс эмбеддингов изображений (None, если выключен)
+        :param near_duplicates: Зависимость, отпечатки недавних изображений (None, если выключены)
         """
         self.NNEngine: NeuralNetwork = engine
+        self.scheduler: BatchScheduler = scheduler
+        self.index: Optional[EmbeddingIndex] = index
+        self.near_duplicates: Optional[NearDuplicateIndex] = near_duplicates
 
-    def get_prediction(self, image_id: str) -> Optional[str]:
+    async def get_prediction(self, image_id: str, k: int = 1) -> Optional[GetPrediction]:
         """
         Получает предсказание от нейросети по ID изображения из MongoDB.
+        Сам прогон модели выполняется планировщиком батчей вместе с
+        конкурентными запросами; повторные и почти совпадающие с недавними
+        изображения отдаются из кэша.
+
+        :param image_id: Строковый ID изображения (ObjectId в MongoDB)
+        :param k: Количество наиболее вероятных классов в ответе (не больше NN_TOP_K)
+        :return: Предсказанный класс, top-k и версия модели или None, если не удалось
+        :raises OverloadedError: Если очередь обработки заполнена
+        """
+        with span("mongo_open"):
+            image = await run_in_threadpool(open_image_from_mongo, image_id=image_id)
+
+        if image is None:
+            return None
+
+        # Хэш содержимого хранится в метаданных файла, поэтому при попадании
+        # в кэш изображение не читается из GridFS вовсе, а при промахе
+        # читается чанками прямо в декодер
+        stream, image_hash = image
+        with stream:
+            return await self._predict(stream, image_hash, k)
+
+    async def predict_image(self, image_data: bytes, k: int = 1) -> Optional[GetPrediction]:
+        """
+        Получает предсказание от нейросети по закодированному изображению,
+        переданному напрямую, без обращения к MongoDB.
+
+        :param image_data: Закодированное изображение (JPEG, PNG и т.д.)
+        :param k: Количество наиболее вероятных классов в ответе (не больше NN_TOP_K)
+        :return: Предсказанный класс, top-k и версия модели или None, если изображение не декодируется
+        :raises OverloadedError: Если очередь обработки заполнена
+        """
+        return await self._predict(image_data, hashlib.sha256(image_data).hexdigest(), k)
+
+    async def find_similar(self, image_id: str, k: int = 10) -> Optional[List[SimilarImage]]:
+        """
+        Ищет изображения, похожие на изображение из MongoDB, по косинусной
+        близости их эмбеддингов. Изображение, которого ещё нет в индексе,
+        сначала прогоняется через модель.
 
         :param image_id: Строковый ID изображения (ObjectId в MongoDB)
-        :return: Название предсказанного класса или None, если не удалось
+        :param k: Количество похожих изображений
+        :return: Похожие изображения по убыванию близости или None, если
+            изображение не найдено или его эмбеддинг недоступен
+        :raises OverloadedError: Если очередь обработки заполнена
         """
-        image_data: Optional[bytes] = get_image_from_mongo(image_id=image_id)
+        if self.index is None:
+            return None
+        image_hash = await run_in_threadpool(get_image_hash, image_id)
+        if image_hash is None:
+            return None
+
+        if not await run_in_threadpool(self.index.bind, self.NNEngine, self.NNEngine.conf.PATH_TO_WEIGHTS):
+            # Индексом владеет другой воркер
+            return None
+        if image_hash not in self.index:
+            image = await run_in_threadpool(open_image_from_mongo, image_id=image_id)
+            if image is None:
+                return None
+            stream, _ = image
+            with stream:
+                # Кэш предсказаний пропускается: нужен сам прогон модели с эмбеддингом
+                await self._predict(stream, image_hash, 1, use_cache=False)
 
-        if not image_data:
+        vector = self.index.get(image_hash)
+        if vector is None:
             return None
+        with span("similarity"):
+            (neighbours,) = await run_in_threadpool(self.index.search, vector, k, [image_hash])
+        ids = await run_in_threadpool(find_image_ids_by_hashes, [key for key, _ in neighbours])
+        similar = [
+            SimilarImage(image_id=similar_id, similarity=similarity)
+            for key, similarity in neighbours
+            for similar_id in ids.get(key, [])
+            if similar_id != image_id
+        ]
+        return similar[:k]
+
+    async def _predict(
+        self, source: Union[bytes, BinaryIO], image_hash: Optional[str], k: int, use_cache: bool = True
+    ) -> Optional[GetPrediction]:
+        cache_key = (image_hash, self.NNEngine.version) if image_hash else None
+        cached = prediction_cache.get(cache_key) if cache_key and use_cache else None
+        if cached is not None:
+            return self._limit_top_k(cached, k)
+
+        async with admission.admit():
+            with span("decode"):
+                (img_tensor,) = await decode_executor.run(self._decode_each, [source])
+            if img_tensor is None:
+                return None
+
+            sketches = None
+            if cache_key and use_cache and self.near_duplicates is not None:
+                with span("similarity"):
+                    sketches, (reused,) = await run_in_threadpool(self._find_near_duplicates, [img_tensor])
+                if reused is not None:
+                    prediction_cache.set(cache_key, reused)
+                    return self._limit_top_k(reused, k)
+
+            # Ожидание в очереди планировщика и прогон модели в составе батча
+            with span("inference"):
+                indices, probabilities, embedding = await self.scheduler.submit(img_tensor)
+        prediction = self._to_prediction(indices, probabilities)
+        if image_hash and embedding is not None:
+            await self._index_embeddings([(image_hash, embedding, int(indices[0]))])
+        if cache_key:
+            prediction_cache.set(cache_key, prediction)
+        if sketches is not None:
+            self.near_duplicates.add_many([image_hash], sketches)
+        return self._limit_top_k(prediction, k)
+
+    async def predict_images(self, buffers: Sequence[bytes], k: int = 1) -> List[Optional[GetPrediction]]:
+        """
+        Получает предсказания для нескольких закодированных изображений за
+        один запрос. Изображения декодируются одним вызовом в пуле потоков и
+        отправляются в планировщик одновременно, поэтому попадают в общие
+        батчи прогона модели; повторные и почти совпадающие с недавними
+        изображения отдаются из кэша.
+
+        :param buffers: Закодированные изображения
+        :param k: Количество наиболее вероятных классов в ответе (не больше NN_TOP_K)
+        :return: Предсказания в порядке изображений; None для нераспознанных
+        :raises OverloadedError: Если изображения не помещаются в очередь обработки
+        """
+        version = self.NNEngine.version
+        keys = [(hashlib.sha256(image_data).hexdigest(), version) for image_data in buffers]
+        results: List[Optional[GetPrediction]] = [prediction_cache.get(key) for key in keys]
+        misses = [i for i, prediction in enumerate(results) if prediction is None]
+
+        if not misses:
+            return [self._limit_top_k(prediction, k) for prediction in results]
+
+        async with admission.admit(len(misses)):
+            with span("decode"):
+                tensors = await decode_executor.run(self._decode_each, [buffers[i] for i in misses])
+            decoded = [(i, tensor) for i, tensor in zip(misses, tensors) if tensor is not None]
+            sketches = {}
+            if decoded and self.near_duplicates is not None:
+                with span("similarity"):
+                    found, reused = await run_in_threadpool(
+                        self._find_near_duplicates, [tensor for _, tensor in decoded]
+                    )
+                pending = []
+                for (i, tensor), sketch, prediction in zip(decoded, found, reused):
+                    if prediction is not None:
+                        results[i] = prediction
+                        prediction_cache.set(keys[i], prediction)
+                    else:
+                        sketches[i] = sketch
+                        pending.append((i, tensor))
+                decoded = pending
+            with span("inference"):
+                outputs = await asyncio.gather(*(self.scheduler.submit(tensor) for _, tensor in decoded))
+
+        indexed: List[Tuple[str, np.ndarray, int]] = []
+        for (i, _), (indices, probabilities, embedding) in zip(decoded, outputs):
+            results[i] = self._to_prediction(indices, probabilities)
+            if embedding is not None:
+                indexed.append((keys[i][0], embedding, int(indices[0])))
+        if indexed:
+            await self._index_embeddings(indexed)
+        for i, _ in decoded:
+            prediction_cache.set(keys[i], results[i])
+        if sketches:
+            self.near_duplicates.add_many([keys[i][0] for i in sketches], np.stack(list(sketches.values())))
+        return [self._limit_top_k(prediction, k) if prediction else None for prediction in results]
+
+    async def _index_embeddings(self, items: List[Tuple[str, np.ndarray, int]]) -> None:
+        """
+        Добавляет эмбеддинги прогнанных изображений в индекс для поиска похожих.
+
+        :param items: SHA-256 изображения, его эмбеддинг и индекс класса top-1
+        """
+        if self.index is None:
+            return
+
+        def add() -> None:
+            if not self.index.bind(self.NNEngine, self.NNEngine.conf.PATH_TO_WEIGHTS):
+                return
+            keys, embeddings, labels = zip(*items)
+            self.index.add_many(keys, np.stack(embeddings), labels)
+
+        with span("similarity"):
+            await run_in_threadpool(add)
+
+    def _find_near_duplicates(
+        self, tensors: Sequence[np.ndarray]
+    ) -> Tuple[np.ndarray, List[Optional[GetPrediction]]]:
+        """
+        Считает перцептивные отпечатки декодированных изображений и ищет
+        среди недавних изображений почти совпадающие, предсказания которых
+        текущей моделью ещё лежат в кэше.
+
+        :param tensors: Предобработанные изображения формы (H, W, 3)
+        :return: Отпечатки и готовые предсказания (None – нужен прогон модели)
+        """
+        sketches = np.concatenate([perceptual_sketch(tensor[np.newaxis]) for tensor in tensors])
+        version = self.NNEngine.version
+        reused = [
+            prediction_cache.peek((key, version)) if key is not None else None
+            for key in self.near_duplicates.nearest(sketches)
+        ]
+        for prediction in reused:
+            if prediction is not None:
+                NEAR_DUPLICATES.inc()
+        return sketches, reused
 
-        with NamedTemporaryFile(delete=False) as temp_file:
-            temp_file.write(image_data)
-            temp_file_path = temp_file.name
+    def _decode_each(self, buffers: Sequence[Union[bytes, BinaryIO]]) -> List[Optional[np.ndarray]]:
+        # Нераспознанное изображение не должно ронять остальные изображения батча
+        batch, errors = self.NNEngine.load_and_preprocess_many(buffers)
+        tensors: List[Optional[np.ndarray]] = []
+        for tensor, error in zip(batch, errors):
+            if error is not None:
+                print(f"[WARNING] Не удалось декодировать изображение: {error}")
+            tensors.append(tensor if error is None else None)
+        return tensors
 
-        try:
-            idx: int = self.NNEngine.get_prediction(temp_file_path)
-            class_name: str = self.NNEngine.class_names[idx]
-        finally:
-            os.remove(temp_file_path)
+    def _to_prediction(self, indices: np.ndarray, probabilities: np.ndarray) -> GetPrediction:
+        top_k = [
+            ClassProbability(class_name=self.NNEngine.class_names[idx], probability=float(prob))
+            for idx, prob in zip(indices.tolist(), probabilities.tolist())
+        ]
+        return GetPrediction(
+            predicted_class=top_k[0].class_name,
+            probability=top_k[0].probability,
+            top_k=top_k,
+            model_version=self.NNEngine.version,
+        )
 
-        return class_name
+    @staticmethod
+    def _limit_top_k(prediction: GetPrediction, k: int) -> GetPrediction:
+        if len(prediction.top_k) <= k:
+            return prediction
+        return prediction.model_copy(update={"top_k": prediction.top_k[:k]})
 
     def get_all_classes(self) -> List[str]:
         """
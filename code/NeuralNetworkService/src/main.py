@@ -1,8 +1,50 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from app.endpoints import router
+from app.model_registry import get_engine, registry
+from app.batching import get_scheduler, scheduler
+from app.embedding_index import embedding_index, get_embedding_index
+from app.inference_client import get_inference_client, get_remote_engine, inference_client
+from app.executor import OverloadedError, decode_executor, inference_executor
+from app.instrumentation import InstrumentationMiddleware
+from app.profiling import ADMIN_TOKEN, ProfilingMiddleware, router as admin_router
+from prometheus_client import make_asgi_app
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
 
-app = FastAPI(title="NeuralNetworkService")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if inference_client is not None:
+        # Режим shm: модель держит процесс инференса, воркер к нему подключается
+        await inference_client.start()
+    else:
+        # Модели загружаются один раз на процесс в фоне, чтобы /nn/ready
+        # отвечал 503 во время загрузки, а не блокировал старт сервера
+        loop = asyncio.get_running_loop()
+        app.state.models_loading = loop.run_in_executor(None, registry.load_all)
+        await scheduler.start()
+    yield
+    if inference_client is not None:
+        await inference_client.stop()
+    else:
+        await scheduler.stop()
+    if embedding_index is not None:
+        embedding_index.close()
+    inference_executor.shutdown()
+    decode_executor.shutdown()
+
+
+app = FastAPI(title="NeuralNetworkService", lifespan=lifespan)
+
+if inference_client is not None:
+    # Движок и планировщик процесса инференса вместо локальных. Индекс
+    # эмбеддингов выключен: эмбеддинги через общую память не передаются,
+    # а писать в индекс может только один процесс
+    app.dependency_overrides[get_engine] = get_remote_engine
+    app.dependency_overrides[get_scheduler] = get_inference_client
+    app.dependency_overrides[get_embedding_index] = lambda: None
 
 # Настройка CORS
 app.add_middleware(
@@ -11,9 +53,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id", "Server-Timing", "X-Profile-Id"],
 )
 
+# Профилирование отдельных запросов (X-Profile); без ADMIN_TOKEN не подключается
+# вовсе и ничего не стоит. Добавляется до InstrumentationMiddleware, чтобы
+# профиль сохранялся под идентификатором трассировки запроса
+if ADMIN_TOKEN:
+    app.add_middleware(ProfilingMiddleware)
+
+# Счётчики и длительность запросов, X-Trace-Id и разбивка по этапам (Server-Timing)
+app.add_middleware(InstrumentationMiddleware)
+
 app.include_router(router=router, prefix="/nn")
+app.include_router(router=admin_router, prefix="/admin")
+
+
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError) -> JSONResponse:
+    # Перегрузка: клиент повторит запрос позже, а не будет ждать в очереди
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+app.mount("/metrics", make_asgi_app())
 
 
 @app.get("/")
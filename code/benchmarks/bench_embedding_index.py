@@ -0,0 +1,128 @@
+"""
+Замер индекса эмбеддингов NNService (app/embedding_index.py) на большом
+числе векторов: заполнение float16-матрицы в memmap, поиск k ближайших
+по всему индексу для одного запроса и пачки запросов (/nn/similar),
+поиск среди изображений одного класса (search с label) и RSS. Для сравнения полный поиск выполняется и по
+float32-матрице в памяти.
+
+Векторы случайные (неотрицательные, как выход ReLU слоя Dense(256)),
+классы распределены равномерно, поэтому замер показывает стоимость
+поиска, а не качество эмбеддингов:
+    python bench_embedding_index.py --vectors 1000000 --queries 20
+"""
+from typing import Dict, List
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadgen import percentiles, read_rss_mb  # noqa: E402
+from standins import NN_SRC  # noqa: E402
+
+sys.path.insert(0, NN_SRC)
+from app.embedding_index import EmbeddingIndex, normalize  # noqa: E402
+from app.neural_network import EMBEDDING_DIM  # noqa: E402
+
+NUM_CLASSES = 101
+
+
+def timed(fn, repeats: int) -> Dict[str, float]:
+    seconds: List[float] = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - started)
+    return percentiles(seconds)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Замер индекса эмбеддингов")
+    parser.add_argument("--vectors", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=20, help="Повторов каждого замера поиска")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-queries", type=int, default=16, help="Запросов в одном проходе по матрице")
+    parser.add_argument("--chunk", type=int, default=65536, help="Векторов в одной пачке заполнения")
+    parser.add_argument("--workdir", default=None, help="Каталог файлов индекса (по умолчанию временный)")
+    parser.add_argument("--skip-float32", action="store_true", help="Не замерять поиск по float32 в памяти")
+    parser.add_argument("--output", help="Сохранить результат в JSON-файл")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="caloriecam-index-")
+    rng = np.random.default_rng(0)
+    index_dir = os.path.join(workdir, "embeddings")
+    # Индекс каждый раз заполняется заново
+    shutil.rmtree(index_dir, ignore_errors=True)
+    index = EmbeddingIndex(index_dir, capacity=args.chunk)
+    index.open("bench")
+    rss_before = read_rss_mb(os.getpid()).get("VmRSS")
+
+    known_row = args.vectors // 2
+    known_label = 0
+    started = time.perf_counter()
+    for start in range(0, args.vectors, args.chunk):
+        count = min(args.chunk, args.vectors - start)
+        vectors = rng.random((count, EMBEDDING_DIM), dtype=np.float32)
+        labels = rng.integers(0, NUM_CLASSES, count)
+        index.add_many([f"{start + i:064x}" for i in range(count)], vectors, labels)
+        if start <= known_row < start + count:
+            known_label = int(labels[known_row - start])
+    index.flush()
+    fill_seconds = time.perf_counter() - started
+
+    query = rng.random(EMBEDDING_DIM, dtype=np.float32)
+    queries = rng.random((args.batch_queries, EMBEDDING_DIM), dtype=np.float32)
+    known_key = f"{known_row:064x}"
+    # Запрос по классу: известный вектор с небольшим шумом должен найти сам себя
+    near_copy = index.get(known_key) + rng.normal(0, 0.002, EMBEDDING_DIM).astype(np.float32)
+
+    single = timed(lambda: index.search(query, args.k), args.queries)
+    batch = timed(lambda: index.search(queries, args.k), args.queries)
+    batch["queries_per_second"] = args.batch_queries / (batch["p50_ms"] / 1000)
+    class_search = timed(lambda: index.search(near_copy, 1, label=known_label), args.queries)
+    match = index.search(near_copy, 1, label=known_label)[0][0]
+    report: Dict[str, object] = {
+        "vectors": len(index),
+        "dim": EMBEDDING_DIM,
+        "file_mb": os.path.getsize(os.path.join(index.path, "vectors.f16")) / 2**20,
+        "fill_seconds": fill_seconds,
+        "fill_vectors_per_second": args.vectors / fill_seconds,
+        "search_single": single,
+        "search_batch": batch,
+        "class_search": class_search,
+        "class_search_found": match[0] == known_key,
+        "class_search_distance": 1.0 - match[1],
+        "rss_before_mb": rss_before,
+        "rss_after_search_mb": read_rss_mb(os.getpid()).get("VmRSS"),
+    }
+
+    if not args.skip_float32:
+        # Тот же поиск по нормированной float32-матрице, целиком загруженной в память
+        matrix = normalize(np.asarray(index._vectors[: len(index)], dtype=np.float32))
+        q = normalize(query[np.newaxis])[0]
+
+        def search_float32() -> None:
+            scores = matrix @ q
+            top = np.argpartition(scores, -args.k)[-args.k:]
+            top[np.argsort(-scores[top])]
+
+        report["search_single_float32_in_memory"] = timed(search_float32, args.queries)
+        report["rss_float32_mb"] = read_rss_mb(os.getpid()).get("VmRSS")
+        del matrix
+
+    index.close()
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
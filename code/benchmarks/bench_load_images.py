@@ -0,0 +1,98 @@
+"""
+Сравнение пакетной загрузки POST /dish/load_images/{name} с N
+последовательными POST /dish/load_image/{name} на работающем DishesService.
+
+Пример (сервисы подняты через docker-compose):
+    python bench_load_images.py --url http://localhost:8001 --n 8 --repeats 5
+
+К каждому изображению дописываются случайные байты, чтобы загрузки не
+попадали в кэш предсказаний и дедупликацию MongoDB (JPEG и PNG с
+«хвостом» после конца данных декодируются как обычно).
+"""
+from typing import Dict, List
+import argparse
+import glob
+import json
+import os
+import statistics
+import time
+
+import httpx
+
+DEFAULT_IMAGES_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "NeuralNetworkService", "src", "resources", "imgs"
+)
+
+
+def load_images(images_dir: str, n: int, unique: bool) -> List[bytes]:
+    paths = sorted(glob.glob(os.path.join(images_dir, "*.jpg")) + glob.glob(os.path.join(images_dir, "*.png")))
+    if not paths:
+        raise SystemExit(f"В {images_dir} нет изображений")
+    images = []
+    for i in range(n):
+        with open(paths[i % len(paths)], "rb") as f:
+            image_data = f.read()
+        images.append(image_data + os.urandom(16) if unique else image_data)
+    return images
+
+
+def run_sequential(client: httpx.Client, url: str, images: List[bytes]) -> float:
+    started = time.perf_counter()
+    for i, image_data in enumerate(images):
+        response = client.post(
+            f"{url}/dish/load_image/bench", files={"file": (f"{i}.jpg", image_data, "image/jpeg")}
+        )
+        response.raise_for_status()
+    return time.perf_counter() - started
+
+
+def run_batch(client: httpx.Client, url: str, images: List[bytes]) -> float:
+    started = time.perf_counter()
+    response = client.post(
+        f"{url}/dish/load_images/bench",
+        files=[("files", (f"{i}.jpg", image_data, "image/jpeg")) for i, image_data in enumerate(images)],
+    )
+    response.raise_for_status()
+    failed = [item for item in response.json()["items"] if item["status"] != "success"]
+    if failed:
+        print(f"[WARNING] Ошибки в пакете: {failed}")
+    return time.perf_counter() - started
+
+
+def summarize(seconds: List[float], n: int) -> Dict[str, float]:
+    return {
+        "mean_ms": statistics.mean(seconds) * 1000,
+        "min_ms": min(seconds) * 1000,
+        "per_image_ms": statistics.mean(seconds) * 1000 / n,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Пакетная загрузка против последовательных")
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--images-dir", default=DEFAULT_IMAGES_DIR)
+    parser.add_argument("--n", type=int, default=8, help="Изображений в пакете")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--no-unique", action="store_true", help="Не делать изображения уникальными")
+    args = parser.parse_args()
+
+    sequential: List[float] = []
+    batch: List[float] = []
+    with httpx.Client(timeout=120) as client:
+        for _ in range(args.repeats):
+            sequential.append(run_sequential(client, args.url, load_images(args.images_dir, args.n, not args.no_unique)))
+            batch.append(run_batch(client, args.url, load_images(args.images_dir, args.n, not args.no_unique)))
+
+    report = {
+        "n": args.n,
+        "repeats": args.repeats,
+        "sequential": summarize(sequential, args.n),
+        "batch": summarize(batch, args.n),
+    }
+    report["speedup"] = report["sequential"]["mean_ms"] / report["batch"]["mean_ms"]
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,100 @@
+"""
+Микробенчмарк движка NNService в одном процессе, без HTTP и хранилищ:
+загрузка и прогрев модели, NeuralNetwork.load_and_preprocess_image,
+NeuralNetwork.get_prediction и батчевый прогон predict_batch.
+
+Без обученных весов (--model tiny или random, см. standins.py):
+    python bench_model.py --model tiny --repeats 50
+    python bench_model.py --model random --batch-sizes 1,8,16
+"""
+from typing import Callable, Dict, List
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadgen import percentiles, read_rss_mb  # noqa: E402
+from standins import DEFAULT_IMAGES_DIR, NN_SRC, list_images, resolve_model  # noqa: E402
+
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "3")
+sys.path.insert(0, NN_SRC)
+from app.executor import configure_tensorflow_threads  # noqa: E402
+
+
+def timed(fn: Callable[[], object], repeats: int) -> Dict[str, float]:
+    fn()
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - started)
+    return percentiles(seconds)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарк NeuralNetwork")
+    parser.add_argument("--model", default="tiny", help="tiny, random или путь к весам")
+    parser.add_argument("--images-dir", default=DEFAULT_IMAGES_DIR)
+    parser.add_argument("--repeats", type=int, default=30)
+    parser.add_argument("--batch-sizes", default="1,8,16")
+    parser.add_argument("--workdir", default=None, help="Каталог для сгенерированной модели")
+    parser.add_argument("--output", help="Сохранить результат в JSON-файл")
+    args = parser.parse_args()
+
+    configure_tensorflow_threads()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="caloriecam-bench-")
+    path_to_weights = resolve_model(args.model, workdir)
+    from app.neural_network import NeuralNetwork
+
+    started = time.perf_counter()
+    engine = NeuralNetwork(
+        path_to_weights=path_to_weights,
+        path_to_class_names=os.path.join(NN_SRC, "resources", "class_names.txt"),
+    )
+    load_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    engine.warmup()
+    warmup_seconds = time.perf_counter() - started
+
+    paths: List[str] = list_images(args.images_dir)
+    report: Dict[str, object] = {
+        "model": args.model,
+        "load_seconds": load_seconds,
+        "warmup_seconds": warmup_seconds,
+        "load_and_preprocess_image": {
+            os.path.basename(path): timed(lambda: engine.load_and_preprocess_image(path), args.repeats)
+            for path in paths
+        },
+        "get_prediction": {
+            os.path.basename(path): timed(lambda: engine.get_prediction(path), args.repeats)
+            for path in paths
+        },
+    }
+
+    predict_batch: Dict[str, Dict[str, float]] = {}
+    buffers = []
+    for path in paths:
+        with open(path, "rb") as f:
+            buffers.append(f.read())
+    for batch_size in [int(size) for size in args.batch_sizes.split(",") if size.strip()]:
+        batch = engine.load_and_preprocess_batch([buffers[i % len(buffers)] for i in range(batch_size)])
+        stats = timed(lambda: engine.predict_batch(batch), args.repeats)
+        stats["images_per_second"] = batch_size / (stats["p50_ms"] / 1000)
+        predict_batch[str(batch_size)] = stats
+    report["predict_batch"] = predict_batch
+    rss = read_rss_mb(os.getpid())
+    report["rss_mb"] = rss.get("VmRSS")
+    report["rss_hwm_mb"] = rss.get("VmHWM")
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
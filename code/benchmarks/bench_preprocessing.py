@@ -0,0 +1,118 @@
+"""
+Микробенчмарк предобработки батча изображений для ResNet50: прежний путь
+через утилиты Keras (load_img, img_to_array, preprocess_input, expand_dims
+и склейка батча) против app.preprocessing – последовательно, параллельно и
+с уменьшенным декодированием JPEG.
+
+Пример (TensorFlow нужен только для прежнего пути):
+    python bench_preprocessing.py --batch 32 --side 512 --repeats 5
+"""
+from typing import Callable, Dict, List
+import argparse
+import glob
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "NeuralNetworkService", "src"))
+from app.preprocessing import BatchDecoder, caffe_preprocess_in_place  # noqa: E402
+
+DEFAULT_IMAGES_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "NeuralNetworkService", "src", "resources", "imgs"
+)
+IMG_SIZE = (224, 224)
+
+
+def make_buffers(images_dir: str, batch: int, side: int) -> List[bytes]:
+    paths = sorted(glob.glob(os.path.join(images_dir, "*.jpg")) + glob.glob(os.path.join(images_dir, "*.png")))
+    if not paths:
+        raise SystemExit(f"В {images_dir} нет изображений")
+    buffers = []
+    for i in range(batch):
+        with Image.open(paths[i % len(paths)]) as img:
+            img = img.convert("RGB")
+            if side:
+                scale = side / max(img.size)
+                img = img.resize((round(img.width * scale), round(img.height * scale)), Image.BICUBIC)
+            out = io.BytesIO()
+            img.save(out, "JPEG", quality=90)
+            buffers.append(out.getvalue())
+    return buffers
+
+
+def keras_path(buffers: List[bytes]) -> np.ndarray:
+    from tensorflow.keras.applications.resnet50 import preprocess_input
+    from tensorflow.keras.preprocessing.image import img_to_array, load_img
+
+    tensors = []
+    for image_data in buffers:
+        img = load_img(io.BytesIO(image_data), target_size=IMG_SIZE)
+        tensors.append(np.expand_dims(preprocess_input(img_to_array(img)), axis=0))
+    return np.concatenate(tensors)
+
+
+def module_path(decoder: BatchDecoder) -> Callable[[List[bytes]], np.ndarray]:
+    def run(buffers: List[bytes]) -> np.ndarray:
+        batch, _ = decoder.decode(buffers)
+        return caffe_preprocess_in_place(batch)
+
+    return run
+
+
+def measure(fn: Callable[[List[bytes]], np.ndarray], buffers: List[bytes], repeats: int) -> Dict[str, float]:
+    fn(buffers)
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn(buffers)
+        seconds.append(time.perf_counter() - started)
+    return {
+        "batch_ms": statistics.median(seconds) * 1000,
+        "per_image_ms": statistics.median(seconds) * 1000 / len(buffers),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарк предобработки батча")
+    parser.add_argument("--images-dir", default=DEFAULT_IMAGES_DIR)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--side", type=int, default=512, help="Длинная сторона JPEG, 0 – как есть")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--no-keras", action="store_true", help="Не измерять прежний путь через Keras")
+    args = parser.parse_args()
+
+    buffers = make_buffers(args.images_dir, args.batch, args.side)
+    variants = {
+        "serial": module_path(BatchDecoder(IMG_SIZE, threads=1, draft=False)),
+        "parallel": module_path(BatchDecoder(IMG_SIZE, threads=args.threads, draft=False)),
+        "parallel_draft": module_path(BatchDecoder(IMG_SIZE, threads=args.threads, draft=True)),
+    }
+    if not args.no_keras:
+        variants = {"keras": keras_path, **variants}
+
+    report: Dict[str, object] = {"batch": args.batch, "side": args.side, "threads": args.threads}
+    for name, fn in variants.items():
+        report[name] = measure(fn, buffers, args.repeats)
+
+    # Без draft результат должен совпадать с прежним путём; с draft пиксели
+    # отличаются из-за усреднения при уменьшенном декодировании
+    reference = variants["keras" if "keras" in variants else "serial"](buffers)
+    for name in ("parallel", "parallel_draft"):
+        report[name]["max_abs_diff"] = float(np.max(np.abs(variants[name](buffers) - reference)))
+        report[name]["mean_abs_diff"] = float(np.mean(np.abs(variants[name](buffers) - reference)))
+    if "keras" in report:
+        report["speedup"] = report["keras"]["batch_ms"] / report["parallel"]["batch_ms"]
+        report["speedup_draft"] = report["keras"]["batch_ms"] / report["parallel_draft"]["batch_ms"]
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,236 @@
+"""
+Сравнение режимов обслуживания NNService с несколькими HTTP-воркерами
+uvicorn под нагрузкой POST /nn/predict (уникальные изображения):
+
+    local  – модель и TensorFlow в каждом воркере (NN_SERVING_MODE=local);
+    shm    – один процесс инференса (python -m app.inference_server), воркеры
+             передают ему изображения через общую память (NN_SERVING_MODE=shm);
+    tflite – как local, но с TFLite-артефактом (--tflite): интерпретатор
+             отображает файл модели в память (mmap), страницы весов общие.
+
+Для каждого режима и числа воркеров сохраняются пропускная способность,
+задержки и память каждого процесса после нагрузки: RSS и PSS (общие
+страницы делятся между процессами, поэтому сумма PSS – реальный расход
+памяти узла). По умолчанию модель – полный ResNet50 со случайными весами:
+    python bench_serving_modes.py --workers 1,2,4 --requests 200
+"""
+from typing import Dict, Iterator, List
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+from loadgen import run_load, unique_images  # noqa: E402
+from run_suite import free_port  # noqa: E402
+from standins import NN_SRC, list_images, resolve_model  # noqa: E402
+
+MODES = ("local", "shm", "tflite")
+# Строки журнала, по которым видно, что воркер готов: модель загружена
+# в нём самом или он подключился к процессу инференса
+READY_MARKERS = {"local": "загружена за", "tflite": "загружена за", "shm": "Подключено к процессу инференса"}
+
+
+def children(pid: int) -> List[int]:
+    """
+    Все потомки процесса (воркеры uvicorn, resource_tracker и т.п.).
+    """
+    parents: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # Имя процесса в скобках может содержать пробелы
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        parents.setdefault(ppid, []).append(int(entry))
+    found, stack = [], [pid]
+    while stack:
+        for child in parents.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+def memory_mb(pid: int) -> Dict[str, float]:
+    """
+    RSS и PSS процесса, МБ (по /proc/<pid>/smaps_rollup).
+    """
+    values: Dict[str, float] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    values[f"{key.lower()}_mb"] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return values
+
+
+def role(pid: int) -> str:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = f.read().replace(b"\0", b" ").decode(errors="replace")
+    except OSError:
+        return "exited"
+    if "app.inference_server" in cmdline:
+        return "inference_server"
+    if "resource_tracker" in cmdline:
+        return "resource_tracker"
+    if "multiprocessing" in cmdline:
+        return "http_worker"
+    return "uvicorn"
+
+
+def process_memory(pids: List[int]) -> Dict[str, object]:
+    processes = []
+    for pid in pids:
+        for member in [pid, *children(pid)]:
+            processes.append({"pid": member, "role": role(member), **memory_mb(member)})
+    workers = [p for p in processes if p["role"] == "http_worker"]
+    if not workers:
+        # С одним воркером uvicorn обслуживает запросы в основном процессе
+        workers = [p for p in processes if p["role"] == "uvicorn"]
+        for process in workers:
+            process["role"] = "http_worker"
+    return {
+        "processes": processes,
+        "total_rss_mb": sum(p.get("rss_mb", 0.0) for p in processes),
+        "total_pss_mb": sum(p.get("pss_mb", 0.0) for p in processes),
+        "worker_rss_mb": max((p.get("rss_mb", 0.0) for p in workers), default=0.0),
+        "worker_pss_mb": max((p.get("pss_mb", 0.0) for p in workers), default=0.0),
+    }
+
+
+def wait_ready(procs: List[subprocess.Popen], log_path: str, marker: str, count: int, url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        for proc in procs:
+            if proc.poll() is not None:
+                raise RuntimeError(f"Процесс завершился с кодом {proc.returncode}, см. {log_path}")
+        with open(log_path, encoding="utf-8", errors="replace") as f:
+            started = f.read().count(marker)
+        if started >= count:
+            try:
+                if httpx.get(f"{url}/nn/ready", timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Сервис не стал готов за {timeout} с, см. {log_path}")
+        time.sleep(0.5)
+
+
+@contextlib.contextmanager
+def serving(mode: str, workers: int, weights: str, port: int, workdir: str, timeout: float) -> Iterator[List[subprocess.Popen]]:
+    """
+    Запускает NNService в выбранном режиме: uvicorn с workers воркерами и,
+    для shm, процесс инференса.
+    """
+    env = dict(
+        os.environ,
+        TF_CPP_MIN_LOG_LEVEL="3",
+        NN_WEIGHTS_PATH=weights,
+        NN_BACKEND="tflite" if mode == "tflite" else "keras",
+        NN_SERVING_MODE="shm" if mode == "shm" else "local",
+        NN_INFERENCE_SOCKET=os.path.join(workdir, f"inference-{port}.sock"),
+        # Индекс эмбеддингов рассчитан на один процесс
+        NN_EMBEDDING_INDEX_DIR="",
+    )
+    log_path = os.path.join(workdir, f"{mode}-{workers}.log")
+    procs: List[subprocess.Popen] = []
+    with open(log_path, "w") as log:
+        try:
+            if mode == "shm":
+                procs.append(subprocess.Popen(
+                    [sys.executable, "-m", "app.inference_server"], cwd=NN_SRC, env=env, stdout=log, stderr=subprocess.STDOUT
+                ))
+            procs.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                 "--workers", str(workers), "--log-level", "warning"],
+                cwd=NN_SRC, env=env, stdout=log, stderr=subprocess.STDOUT,
+            ))
+            wait_ready(procs, log_path, READY_MARKERS[mode], workers, f"http://127.0.0.1:{port}", timeout)
+            yield procs
+        finally:
+            # Сначала воркеры, затем процесс инференса
+            for proc in reversed(procs):
+                proc.terminate()
+                try:
+                    proc.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Память и пропускная способность режимов обслуживания NNService")
+    parser.add_argument("--model", default="random", help="tiny, random или путь к весам")
+    parser.add_argument("--tflite", help="TFLite-артефакт для режима tflite (python -m app.export_model export --format tflite)")
+    parser.add_argument("--modes", default="local,shm", help=f"Режимы через запятую: {', '.join(MODES)}")
+    parser.add_argument("--workers", default="1,2,4", help="Количество HTTP-воркеров через запятую")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--workdir", default=None, help="Каталог для модели и журналов (по умолчанию временный)")
+    parser.add_argument("--output", help="Сохранить результат в JSON-файл")
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        raise SystemExit(f"Неизвестные режимы: {', '.join(sorted(unknown))}")
+    if "tflite" in modes and not args.tflite:
+        raise SystemExit("Для режима tflite нужен --tflite")
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="caloriecam-serving-"))
+    weights = resolve_model(args.model, workdir)
+    images = unique_images(list_images(), args.warmup + args.requests)
+    report: Dict[str, object] = {
+        "config": {key: getattr(args, key) for key in ("model", "tflite", "requests", "concurrency", "warmup")},
+        "cpu_count": os.cpu_count(),
+        "results": {},
+    }
+
+    for mode in modes:
+        for workers in [int(count) for count in args.workers.split(",")]:
+            name = f"{mode}-{workers}"
+            print(f"[{name}] запуск")
+            port = free_port()
+            model_path = os.path.abspath(args.tflite) if mode == "tflite" else weights
+            with serving(mode, workers, model_path, port, workdir, args.startup_timeout) as procs:
+                load = asyncio.run(
+                    run_load(
+                        f"http://127.0.0.1:{port}", "nn-predict", args.requests, args.concurrency,
+                        images=images, warmup=args.warmup,
+                    )
+                )
+                memory = process_memory([proc.pid for proc in procs])
+            result: Dict[str, object] = {"workers": workers, **load, **memory}
+            report["results"][name] = result
+            print(
+                f"[{name}] {load['throughput_rps']:.1f} запросов/с, p50 {load.get('p50_ms', 0):.0f} мс, "
+                f"воркер RSS {memory['worker_rss_mb']:.0f} МБ, всего PSS {memory['total_pss_mb']:.0f} МБ"
+            )
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,107 @@
+"""
+Нагрузочный тест загрузок: N запросов POST /dish/load_image/{name} с
+заданной конкурентностью к работающему DishesService.
+
+Пример:
+    python load_test_uploads.py --url http://localhost:8001 --requests 200 --concurrency 20
+
+Если обращения к БД блокируют event loop, конкурентные загрузки
+выполняются по очереди и пропускная способность не растёт с
+--concurrency; с асинхронными драйверами она ограничена NNService и
+размерами пулов соединений.
+"""
+from typing import Dict, List
+import argparse
+import asyncio
+import glob
+import json
+import os
+import statistics
+import time
+
+import httpx
+
+DEFAULT_IMAGES_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "NeuralNetworkService", "src", "resources", "imgs"
+)
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+
+    def at(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "p50_ms": at(0.50),
+        "p95_ms": at(0.95),
+        "p99_ms": at(0.99),
+    }
+
+
+async def run(url: str, images: List[bytes], total: int, concurrency: int, mode: str) -> Dict[str, object]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+
+        async def upload(i: int) -> None:
+            # Случайный «хвост» делает изображения уникальными для кэшей и дедупликации
+            image_data = images[i % len(images)] + os.urandom(16)
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(
+                        f"{url}/dish/load_image/load_test",
+                        params={"mode": mode},
+                        files={"file": (f"{i}.jpg", image_data, "image/jpeg")},
+                    )
+                    key = str(response.status_code)
+                except httpx.HTTPError as e:
+                    key = type(e).__name__
+                latencies.append(time.perf_counter() - started)
+                if key not in ("200", "202"):
+                    errors[key] = errors.get(key, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(upload(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "mode": mode,
+        "seconds": elapsed,
+        "throughput_rps": total / elapsed,
+        "errors": errors,
+        **percentiles(latencies),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест загрузки изображений")
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--images-dir", default=DEFAULT_IMAGES_DIR)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.images_dir, "*.jpg")) + glob.glob(os.path.join(args.images_dir, "*.png")))
+    if not paths:
+        raise SystemExit(f"В {args.images_dir} нет изображений")
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+
+    report = asyncio.run(run(args.url, images, args.requests, args.concurrency, args.mode))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,262 @@
+"""
+Конкурентный генератор нагрузки на NNService и DishesService:
+пропускная способность, задержки p50/p95/p99, ошибки по кодам ответа и
+RSS процесса сервиса (по /proc, если передан --pid).
+
+Сценарии:
+    nn-predict       POST /nn/predict с байтами изображения
+    nn-predict-id    GET /nn/predict/{id} по изображениям из MongoDB
+                     (ID из --ids или /bench/images сервиса с заменами)
+    dish-load-image  POST /dish/load_image/{name} (--mode sync или async)
+
+Пример:
+    python loadgen.py nn-predict --url http://127.0.0.1:8000 --requests 500 --concurrency 16 --pid 12345
+"""
+from typing import Awaitable, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+import httpx
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from standins import DEFAULT_IMAGES_DIR, list_images  # noqa: E402
+
+SCENARIOS = ("nn-predict", "nn-predict-id", "dish-load-image")
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+
+    def at(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "p50_ms": at(0.50),
+        "p95_ms": at(0.95),
+        "p99_ms": at(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def unique_images(paths: List[str], count: int, quality: int = 90) -> List[bytes]:
+    """
+    Готовит count разных изображений: в угол каждого вставляется случайный
+    квадрат, поэтому не срабатывают ни кэши предсказаний, ни дедупликация
+    по хэшу (в т.ч. по хэшу нормализованной копии в DishesService).
+    """
+    sources = []
+    for path in paths:
+        with Image.open(path) as img:
+            sources.append(img.convert("RGB"))
+    images = []
+    for i in range(count):
+        img = sources[i % len(sources)].copy()
+        patch = max(16, max(img.size) // 64)
+        img.paste(Image.frombytes("RGB", (patch, patch), os.urandom(patch * patch * 3)), (0, 0))
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=quality)
+        images.append(out.getvalue())
+    return images
+
+
+def read_rss_mb(pid: int) -> Dict[str, float]:
+    """
+    Текущий (VmRSS) и пиковый (VmHWM) резидентный размер процесса, МБ.
+    """
+    values: Dict[str, float] = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    values[key] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return values
+
+
+class RssSampler:
+    """
+    Периодически читает RSS процесса сервиса во время нагрузки.
+    """
+
+    def __init__(self, pid: Optional[int], interval: float = 0.1) -> None:
+        self.pid: Optional[int] = pid
+        self.interval: float = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "RssSampler":
+        if self.pid:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        while True:
+            rss = read_rss_mb(self.pid).get("VmRSS")
+            if rss is not None:
+                self.samples.append(rss)
+            await asyncio.sleep(self.interval)
+
+    def report(self) -> Dict[str, float]:
+        if not self.samples:
+            return {}
+        final = read_rss_mb(self.pid)
+        return {
+            "rss_start_mb": self.samples[0],
+            "rss_peak_mb": max(self.samples),
+            "rss_end_mb": final.get("VmRSS", self.samples[-1]),
+            "rss_hwm_mb": final.get("VmHWM", max(self.samples)),
+        }
+
+
+def make_request(
+    scenario: str, images: List[bytes], ids: List[str], mode: str
+) -> Callable[[httpx.AsyncClient, str, int], Awaitable[httpx.Response]]:
+    if scenario == "nn-predict":
+        return lambda client, url, i: client.post(
+            f"{url}/nn/predict",
+            content=images[i % len(images)],
+            headers={"Content-Type": "image/jpeg"},
+        )
+    if scenario == "nn-predict-id":
+        return lambda client, url, i: client.get(f"{url}/nn/predict/{ids[i % len(ids)]}")
+    return lambda client, url, i: client.post(
+        f"{url}/dish/load_image/loadgen",
+        params={"mode": mode},
+        files={"file": (f"{i}.jpg", images[i % len(images)], "image/jpeg")},
+    )
+
+
+async def run_load(
+    url: str,
+    scenario: str,
+    total: int,
+    concurrency: int,
+    images: Optional[List[bytes]] = None,
+    ids: Optional[List[str]] = None,
+    mode: str = "sync",
+    warmup: int = 0,
+    pid: Optional[int] = None,
+) -> Dict[str, object]:
+    """
+    Выполняет total запросов сценария не более чем по concurrency
+    одновременно и возвращает сводку.
+
+    :param url: Базовый URL сервиса
+    :param scenario: Один из SCENARIOS
+    :param total: Количество измеряемых запросов
+    :param concurrency: Максимум одновременных запросов
+    :param images: Изображения для загрузки (по умолчанию – уникальные из тестовых)
+    :param ids: ID изображений для nn-predict-id
+    :param mode: Режим dish-load-image (sync или async)
+    :param warmup: Запросов до начала измерения
+    :param pid: PID процесса сервиса для замера RSS
+    :return: Пропускная способность, перцентили задержки, ошибки и RSS
+    """
+    if scenario not in SCENARIOS:
+        raise ValueError(f"Неизвестный сценарий: {scenario}")
+    if images is None and scenario != "nn-predict-id":
+        images = unique_images(list_images(), warmup + total)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        if scenario == "nn-predict-id" and not ids:
+            response = await client.get(f"{url}/bench/images")
+            response.raise_for_status()
+            ids = response.json()
+        request = make_request(scenario, images or [], ids or [], mode)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies: List[float] = []
+        statuses: Dict[str, int] = {}
+
+        async def one(i: int, measured: bool) -> None:
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    key = str((await request(client, url, i)).status_code)
+                except httpx.HTTPError as e:
+                    key = type(e).__name__
+                if measured:
+                    latencies.append(time.perf_counter() - started)
+                    statuses[key] = statuses.get(key, 0) + 1
+
+        await asyncio.gather(*(one(i, False) for i in range(warmup)))
+
+        async with RssSampler(pid) as sampler:
+            started = time.perf_counter()
+            await asyncio.gather(*(one(warmup + i, True) for i in range(total)))
+            elapsed = time.perf_counter() - started
+
+    ok = sum(count for key, count in statuses.items() if key in ("200", "202"))
+    return {
+        "scenario": scenario,
+        "requests": total,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "throughput_rps": ok / elapsed,
+        "statuses": statuses,
+        **percentiles(latencies),
+        **sampler.report(),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Генератор нагрузки на сервисы CalorieCam")
+    parser.add_argument("scenario", choices=SCENARIOS)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--images-dir", default=DEFAULT_IMAGES_DIR)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync")
+    parser.add_argument("--ids", nargs="*", help="ID изображений для nn-predict-id")
+    parser.add_argument("--pid", type=int, help="PID сервиса для замера RSS")
+    parser.add_argument("--output", help="Сохранить результат в JSON-файл")
+    args = parser.parse_args()
+
+    images = None
+    if args.scenario != "nn-predict-id":
+        images = unique_images(list_images(args.images_dir), args.warmup + args.requests)
+    report = asyncio.run(
+        run_load(
+            args.url,
+            args.scenario,
+            args.requests,
+            args.concurrency,
+            images=images,
+            ids=args.ids,
+            mode=args.mode,
+            warmup=args.warmup,
+            pid=args.pid,
+        )
+    )
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
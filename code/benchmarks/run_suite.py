@@ -0,0 +1,280 @@
+"""
+Сквозной набор замеров без сети и внешних сервисов. Выполняет:
+
+1. micro  – микробенчмарк движка (bench_model.py);
+2. nn     – NNService с mongomock и выбранной моделью под нагрузкой
+            POST /nn/predict и GET /nn/predict/{id};
+3. dishes – DishesService с SQLite, mongomock и заглушкой NNService под
+            нагрузкой POST /dish/load_image в режимах sync и async.
+
+Сервисы запускаются отдельными процессами (standins.py), RSS снимается с
+них же. Результат сохраняется в JSON с коммитом и параметрами запуска,
+чтобы сравнивать замеры разных коммитов:
+
+    python run_suite.py --model tiny --requests 300 --concurrency 16
+    python run_suite.py --baseline results/<старый>.json
+    python run_suite.py --diff results/a.json results/b.json
+"""
+from typing import Dict, Iterator, List, Tuple
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+from loadgen import run_load, unique_images  # noqa: E402
+from standins import list_images  # noqa: E402
+
+STAGES = ("micro", "nn", "dishes")
+# Метрики, которые сравниваются между запусками, и «лучшее» направление
+COMPARED_METRICS = {
+    "throughput_rps": "higher",
+    "images_per_second": "higher",
+    "p50_ms": "lower",
+    "p95_ms": "lower",
+    "p99_ms": "lower",
+    "rss_peak_mb": "lower",
+    "rss_mb": "lower",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_commit() -> Dict[str, object]:
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args], cwd=BENCH_DIR, capture_output=True, text=True, check=False
+        ).stdout.strip()
+
+    return {"sha": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain"))}
+
+
+@contextlib.contextmanager
+def service(args: List[str], log_path: str, ready_url: str, timeout: float) -> Iterator[subprocess.Popen]:
+    """
+    Запускает standins.py в отдельном процессе и ждёт, пока ready_url не
+    ответит 200. Вывод сервиса пишется в log_path.
+    """
+    with open(log_path, "w") as log:
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, "standins.py"), *args],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"Сервис завершился с кодом {proc.returncode}, см. {log_path}")
+                try:
+                    if httpx.get(ready_url, timeout=1).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Сервис не стал готов за {timeout} с, см. {log_path}")
+                time.sleep(0.5)
+            yield proc
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def run_micro(args: argparse.Namespace, workdir: str) -> Dict[str, object]:
+    output = os.path.join(workdir, "micro.json")
+    with open(os.path.join(workdir, "micro.log"), "w") as log:
+        subprocess.run(
+            [
+                sys.executable,
+                os.path.join(BENCH_DIR, "bench_model.py"),
+                "--model", args.model,
+                "--repeats", str(args.repeats),
+                "--workdir", workdir,
+                "--output", output,
+            ],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            check=True,
+        )
+    with open(output, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def run_nn(args: argparse.Namespace, workdir: str, images: List[bytes]) -> Dict[str, object]:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    results: Dict[str, object] = {}
+    with service(
+        ["nn", "--port", str(port), "--model", args.model, "--workdir", workdir],
+        os.path.join(workdir, "nn.log"),
+        f"{url}/nn/ready",
+        args.startup_timeout,
+    ) as proc:
+        for scenario in ("nn-predict", "nn-predict-id"):
+            results[scenario] = asyncio.run(
+                run_load(
+                    url, scenario, args.requests, args.concurrency,
+                    images=images, warmup=args.warmup, pid=proc.pid,
+                )
+            )
+    return results
+
+
+def run_dishes(args: argparse.Namespace, workdir: str, images: List[bytes]) -> Dict[str, object]:
+    stub_port, port = free_port(), free_port()
+    url = f"http://127.0.0.1:{port}"
+    results: Dict[str, object] = {}
+    with service(
+        ["nn-stub", "--port", str(stub_port), "--latency-ms", str(args.stub_latency_ms)],
+        os.path.join(workdir, "nn-stub.log"),
+        f"http://127.0.0.1:{stub_port}/docs",
+        args.startup_timeout,
+    ), service(
+        [
+            "dishes", "--port", str(port), "--workdir", workdir,
+            "--nn-url", f"http://127.0.0.1:{stub_port}/nn/predict",
+        ],
+        os.path.join(workdir, "dishes.log"),
+        f"{url}/",
+        args.startup_timeout,
+    ) as proc:
+        for mode in ("sync", "async"):
+            results[f"dish-load-image-{mode}"] = asyncio.run(
+                run_load(
+                    url, "dish-load-image", args.requests, args.concurrency,
+                    images=images, mode=mode, warmup=args.warmup, pid=proc.pid,
+                )
+            )
+    return results
+
+
+def flatten(report: Dict[str, object], prefix: str = "") -> Dict[str, float]:
+    values: Dict[str, float] = {}
+    for key, value in report.items():
+        path = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            values.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = float(value)
+    return values
+
+
+def compare(old: Dict[str, object], new: Dict[str, object]) -> List[Tuple[str, float, float, float, str]]:
+    """
+    Сравнивает метрики COMPARED_METRICS двух результатов.
+
+    :return: Строки (метрика, было, стало, изменение в %, оценка)
+    """
+    old_values, new_values = flatten(old.get("results", {})), flatten(new.get("results", {}))
+    rows = []
+    for path, before in old_values.items():
+        direction = COMPARED_METRICS.get(path.rsplit(".", 1)[-1])
+        if direction is None or path not in new_values or not before:
+            continue
+        after = new_values[path]
+        change = (after - before) / before * 100
+        better = change > 0 if direction == "higher" else change < 0
+        verdict = "лучше" if better and abs(change) >= 5 else "хуже" if abs(change) >= 5 else ""
+        rows.append((path, before, after, change, verdict))
+    return rows
+
+
+def print_comparison(old: Dict[str, object], new: Dict[str, object]) -> None:
+    print(f"{'метрика':<70} {'было':>10} {'стало':>10} {'%':>8}")
+    for path, before, after, change, verdict in compare(old, new):
+        print(f"{path:<70} {before:>10.2f} {after:>10.2f} {change:>+7.1f}% {verdict}")
+
+
+def load_json(path: str) -> Dict[str, object]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Сквозной набор замеров с локальными заменами зависимостей")
+    parser.add_argument("--model", default="tiny", help="tiny, random или путь к весам")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Этапы через запятую: micro, nn, dishes")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=30, help="Повторов в микробенчмарке")
+    parser.add_argument("--stub-latency-ms", type=float, default=20.0, help="Задержка заглушки NNService на изображение")
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--output-dir", default=os.path.join(BENCH_DIR, "results"))
+    parser.add_argument("--workdir", default=None, help="Каталог для модели, баз и логов (по умолчанию временный)")
+    parser.add_argument("--baseline", help="Сравнить с сохранённым результатом")
+    parser.add_argument("--diff", nargs=2, metavar=("OLD", "NEW"), help="Только сравнить два результата")
+    args = parser.parse_args()
+
+    if args.diff:
+        print_comparison(load_json(args.diff[0]), load_json(args.diff[1]))
+        return 0
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise SystemExit(f"Неизвестные этапы: {', '.join(sorted(unknown))}")
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="caloriecam-bench-"))
+    os.makedirs(workdir, exist_ok=True)
+    commit = git_commit()
+    report: Dict[str, object] = {
+        "commit": commit,
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            key: getattr(args, key)
+            for key in ("model", "requests", "concurrency", "warmup", "repeats", "stub_latency_ms")
+        },
+        "results": {},
+    }
+
+    # Одинаковый набор уникальных изображений для всех сервисов
+    images = unique_images(list_images(), args.warmup + args.requests)
+    if "micro" in stages:
+        print("[micro] микробенчмарк движка")
+        report["results"]["micro"] = run_micro(args, workdir)
+    if "nn" in stages:
+        print("[nn] NNService под нагрузкой")
+        report["results"]["nn"] = run_nn(args, workdir, images)
+    if "dishes" in stages:
+        print("[dishes] DishesService под нагрузкой")
+        report["results"]["dishes"] = run_dishes(args, workdir, images)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    output = os.path.join(args.output_dir, f"{stamp}-{(commit['sha'] or 'nogit')[:8]}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(json.dumps(report["results"], indent=2, ensure_ascii=False))
+    print(f"Результат сохранён: {output}")
+
+    if args.baseline:
+        print_comparison(load_json(args.baseline), report)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
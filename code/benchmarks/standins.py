@@ -0,0 +1,353 @@
+"""
+Локальные замены внешних зависимостей для замеров без сети и docker:
+MongoDB – mongomock (для асинхронного клиента DishesService – тонкая
+асинхронная обёртка над ним), PostgreSQL – SQLite (aiosqlite), NNService –
+заглушка с фиксированным ответом и настраиваемой задержкой, а вместо
+обученных весов – крошечная модель со случайными весами.
+
+Запуск сервиса с заменами в отдельном процессе:
+    python standins.py nn --port 8000 --model tiny
+    python standins.py nn-stub --port 8002 --latency-ms 20
+    python standins.py dishes --port 8001 --nn-url http://127.0.0.1:8002/nn/predict
+
+Модели:
+    tiny   – свёртка и голова классификатора, только накладные расходы сервиса
+    random – полный ResNet50 со случайными весами (реальная стоимость инференса)
+    путь   – файл весов или экспортированный артефакт
+"""
+from typing import Any, AsyncIterator, Dict, List, Optional
+import argparse
+import asyncio
+import glob
+import os
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+NN_SRC = os.path.join(BENCH_DIR, "..", "NeuralNetworkService", "src")
+DISHES_SRC = os.path.join(BENCH_DIR, "..", "DishesService", "src")
+DEFAULT_IMAGES_DIR = os.path.join(NN_SRC, "resources", "imgs")
+NUM_CLASSES = 101
+IMG_SHAPE = (224, 224, 3)
+
+
+def resolve_model(model: str, workdir: str) -> str:
+    """
+    Возвращает путь к весам для NN_WEIGHTS_PATH.
+
+    :param model: tiny, random или путь к файлу весов
+    :param workdir: Каталог для сгенерированной модели
+    :return: Путь к весам или к сгенерированной модели
+    """
+    os.makedirs(workdir, exist_ok=True)
+    if model == "tiny":
+        return build_tiny_model(os.path.join(workdir, "tiny.keras"))
+    if model == "random":
+        return build_random_model(os.path.join(workdir, "random.keras"))
+    return os.path.abspath(model)
+
+
+def build_tiny_model(path: str) -> str:
+    """
+    Сохраняет крошечную модель со случайными весами и тем же входом и
+    выходом, что у боевой (224×224×3 -> 101 класс). Один прогон стоит
+    доли миллисекунды, поэтому замер показывает накладные расходы сервиса:
+    декодирование, батчинг, HTTP и хранилище.
+
+    :param path: Путь к файлу .keras
+    :return: Тот же путь
+    """
+    if os.path.exists(path):
+        return path
+    import tensorflow as tf
+    from tensorflow.keras import layers, models
+
+    tf.random.set_seed(0)
+    model = models.Sequential(
+        [
+            layers.Input(shape=IMG_SHAPE),
+            # Вход после предобработки ResNet50 – примерно [-128, 128]
+            layers.Rescaling(1 / 128.0),
+            layers.Conv2D(8, 3, strides=4, activation="relu"),
+            layers.GlobalAveragePooling2D(),
+            layers.Dense(256, activation="relu"),
+            layers.Dense(NUM_CLASSES, activation="softmax"),
+        ]
+    )
+    model.save(path)
+    return path
+
+
+def build_random_model(path: str) -> str:
+    """
+    Сохраняет ResNet50 с головой классификатора боевой модели и случайными
+    весами: прогон стоит столько же, сколько у обученной модели. Сервис
+    без файла весов не запускается, поэтому модель сохраняется целиком.
+
+    :param path: Путь к файлу .keras
+    :return: Тот же путь
+    """
+    if os.path.exists(path):
+        return path
+    import tensorflow as tf
+    from tensorflow.keras import layers, models
+    from tensorflow.keras.applications import ResNet50
+
+    tf.random.set_seed(0)
+    model = models.Sequential(
+        [
+            ResNet50(weights=None, include_top=False, input_shape=IMG_SHAPE),
+            layers.GlobalAveragePooling2D(),
+            layers.Dense(256, activation="relu"),
+            layers.Dense(NUM_CLASSES, activation="softmax"),
+        ]
+    )
+    model.save(path)
+    return path
+
+
+def list_images(images_dir: str = DEFAULT_IMAGES_DIR) -> List[str]:
+    paths = sorted(glob.glob(os.path.join(images_dir, "*.jpg")) + glob.glob(os.path.join(images_dir, "*.png")))
+    if not paths:
+        raise SystemExit(f"В {images_dir} нет изображений")
+    return paths
+
+
+# --- MongoDB ---------------------------------------------------------------
+
+
+def mongomock_database():
+    """
+    База mongomock с поддержкой GridFS (синхронный API pymongo).
+    """
+    import mongomock
+    import mongomock.gridfs
+
+    mongomock.gridfs.enable_gridfs_integration()
+    return mongomock.MongoClient()["caloriecam"]
+
+
+class AsyncCollection:
+    """
+    Асинхронная обёртка коллекции mongomock с подмножеством API
+    AsyncCollection, которое использует DishesService.
+    """
+
+    def __init__(self, collection) -> None:
+        self._collection = collection
+
+    async def create_index(self, *args, **kwargs) -> str:
+        return self._collection.create_index(*args, **kwargs)
+
+    async def find_one(self, *args, **kwargs) -> Optional[Dict[str, Any]]:
+        return self._collection.find_one(*args, **kwargs)
+
+    async def insert_one(self, *args, **kwargs):
+        return self._collection.insert_one(*args, **kwargs)
+
+    async def delete_one(self, *args, **kwargs):
+        return self._collection.delete_one(*args, **kwargs)
+
+    async def find(self, *args, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        for document in self._collection.find(*args, **kwargs):
+            yield document
+
+
+class AsyncGridIn:
+    """
+    Асинхронная обёртка GridIn: атрибуты, заданные до close(), попадают
+    в документ файла, как у AsyncGridIn pymongo.
+    """
+
+    def __init__(self, grid_in) -> None:
+        object.__setattr__(self, "_grid_in", grid_in)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._grid_in, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._grid_in, name, value)
+
+    async def write(self, data: bytes) -> None:
+        self._grid_in.write(data)
+
+    async def close(self) -> None:
+        self._grid_in.close()
+
+    async def abort(self) -> None:
+        self._grid_in.abort()
+
+
+class AsyncGridFSBucket:
+    """
+    Асинхронная обёртка GridFSBucket поверх mongomock.
+    """
+
+    def __init__(self, db, bucket_name: str) -> None:
+        from gridfs import GridFSBucket
+
+        self._bucket = GridFSBucket(db, bucket_name=bucket_name)
+
+    def open_upload_stream(self, filename: str, **kwargs) -> AsyncGridIn:
+        return AsyncGridIn(self._bucket.open_upload_stream(filename, **kwargs))
+
+
+def install_nn_mongo(images_dir: str = DEFAULT_IMAGES_DIR) -> List[str]:
+    """
+    Подменяет MongoDB NNService на mongomock и сохраняет в GridFS
+    тестовые изображения.
+
+    :param images_dir: Каталог с изображениями
+    :return: ObjectId сохранённых изображений
+    """
+    import hashlib
+    from gridfs import GridFSBucket
+    import app.database_mongo as database_mongo
+
+    db = mongomock_database()
+    database_mongo.db = db
+    database_mongo.images_collection = db["images"]
+    database_mongo.images_fs = GridFSBucket(db, bucket_name=database_mongo.GRIDFS_BUCKET)
+    database_mongo.image_files_collection = db[f"{database_mongo.GRIDFS_BUCKET}.files"]
+
+    ids = []
+    for path in list_images(images_dir):
+        with open(path, "rb") as f:
+            image_data = f.read()
+        grid_in = database_mongo.images_fs.open_upload_stream(os.path.basename(path))
+        grid_in.sha256 = hashlib.sha256(image_data).hexdigest()
+        grid_in.write(image_data)
+        grid_in.close()
+        ids.append(str(grid_in._id))
+    return ids
+
+
+def install_dishes_mongo() -> None:
+    """
+    Подменяет MongoDB DishesService на асинхронную обёртку mongomock.
+    """
+    import app.database_mongo as database_mongo
+
+    db = mongomock_database()
+    database_mongo.db = db
+    database_mongo.images_collection = AsyncCollection(db["images"])
+    database_mongo.images_fs = AsyncGridFSBucket(db, database_mongo.GRIDFS_BUCKET)
+    database_mongo.image_files_collection = AsyncCollection(db[f"{database_mongo.GRIDFS_BUCKET}.files"])
+
+
+# --- NNService -------------------------------------------------------------
+
+
+def stub_nn_app(latency_ms: float = 0.0, predicted_class: str = "pizza"):
+    """
+    Заглушка NNService: отвечает фиксированным предсказанием после
+    задержки latency_ms на каждое изображение запроса.
+
+    :param latency_ms: Имитируемое время инференса одного изображения
+    :param predicted_class: Класс в ответе (должен быть в справочнике блюд)
+    """
+    from fastapi import FastAPI, File, UploadFile
+    from typing import List as ListType
+
+    app = FastAPI(title="NeuralNetworkServiceStub")
+    prediction = {
+        "predicted_class": predicted_class,
+        "probability": 0.9,
+        "top_k": [{"class_name": predicted_class, "probability": 0.9}],
+        "model_version": "stub:1",
+    }
+
+    @app.post("/nn/predict")
+    async def predict() -> Dict[str, Any]:
+        await asyncio.sleep(latency_ms / 1000)
+        return prediction
+
+    @app.get("/nn/predict/{image_id}")
+    async def predict_by_id(image_id: str) -> Dict[str, Any]:
+        await asyncio.sleep(latency_ms / 1000)
+        return prediction
+
+    @app.post("/nn/predict/batch")
+    async def predict_batch(files: ListType[UploadFile] = File(...)) -> ListType[Dict[str, Any]]:
+        await asyncio.sleep(latency_ms * len(files) / 1000)
+        return [{"prediction": prediction, "error": None} for _ in files]
+
+    @app.get("/nn/ready")
+    async def ready() -> Dict[str, Any]:
+        # DishesService сверяет по нему версию модели для кэша предсказаний
+        return {"ready": True, "models": {"stub": {"name": "stub", "status": "ready", "version": "stub:1", "path_to_weights": ""}}}
+
+    return app
+
+
+# --- Запуск сервисов -------------------------------------------------------
+
+
+def _serve(app, port: int) -> None:
+    import uvicorn
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def serve_nn(port: int, model: str, workdir: str, images_dir: str) -> None:
+    """
+    NNService с mongomock вместо MongoDB и выбранной моделью.
+    """
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "3")
+    os.chdir(NN_SRC)
+    sys.path.insert(0, NN_SRC)
+    from app.executor import configure_tensorflow_threads
+
+    # Сборка крошечной модели инициализирует TensorFlow: потоки настраиваются до неё
+    configure_tensorflow_threads()
+    os.environ["NN_WEIGHTS_PATH"] = resolve_model(model, workdir)
+    os.environ.setdefault("NN_EMBEDDING_INDEX_DIR", os.path.join(workdir, "embeddings"))
+    # Нагрузка состоит из почти совпадающих вариантов нескольких фото: с
+    # переиспользованием предсказаний замер не дошёл бы до модели
+    os.environ.setdefault("NN_NEAR_DUPLICATE_EPSILON", "0")
+    from main import app
+
+    image_ids = install_nn_mongo(images_dir)
+    # Замер по ID берёт изображения отсюда
+    app.add_api_route("/bench/images", lambda: image_ids, methods=["GET"])
+    _serve(app, port)
+
+
+def serve_dishes(port: int, nn_url: str, workdir: str) -> None:
+    """
+    DishesService с SQLite вместо PostgreSQL и mongomock вместо MongoDB.
+    """
+    os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(workdir, 'dishes.db')}")
+    os.environ["NEURAL_NETWORK_SERVICE_URL"] = nn_url
+    os.chdir(DISHES_SRC)
+    sys.path.insert(0, DISHES_SRC)
+    from main import app
+
+    install_dishes_mongo()
+    _serve(app, port)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Сервис с локальными заменами зависимостей")
+    parser.add_argument("service", choices=("nn", "nn-stub", "dishes"))
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--model", default="tiny", help="tiny, random или путь к весам")
+    parser.add_argument("--images-dir", default=DEFAULT_IMAGES_DIR)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Задержка заглушки NNService")
+    parser.add_argument("--nn-url", default="http://127.0.0.1:8002/nn/predict")
+    parser.add_argument("--workdir", default=None, help="Каталог для модели и SQLite (по умолчанию временный)")
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="caloriecam-bench-"))
+    os.makedirs(workdir, exist_ok=True)
+    if args.service == "nn":
+        serve_nn(args.port, args.model, workdir, os.path.abspath(args.images_dir))
+    elif args.service == "nn-stub":
+        _serve(stub_nn_app(args.latency_ms), args.port)
+    else:
+        serve_dishes(args.port, args.nn_url, workdir)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())